@@ -52,11 +52,20 @@ except ImportError:
 from server import server_config, server_config_parse
 from interpolation import interpolate
 from sitemap import sitemap_config, sitemap_config_parse
-import sys
+from request_context import get_request_context
+import sys, threading
 
 server = server_config()
 sitemap = sitemap_config(server)
 
+# this flag is set once the configuration files have been loaded and the lock ensures that
+# only one thread loads them
+configured = False
+_configure_lock = threading.Lock()
+
+# this flag is set once the cleanup function has been registered (which requires a request)
+cleanup_registered = False
+
 def cleanup(req):
     """
     This method is called when the server shuts down. It tried to free all the open resources like
@@ -87,6 +96,18 @@ def cleanup(req):
         # delete the datasource
         del sitemap.data_sources[name]
 
+    # remove the stored results of resources
+    if sitemap.resource_store is not None:
+        sitemap.resource_store.clear()
+
+    # stop the threads of parallel aggregates
+    if sitemap.aggregate_pool is not None:
+        sitemap.aggregate_pool.close()
+
+    # close the kept-alive connections of HTTP generators
+    if sitemap.http_pool is not None:
+        sitemap.http_pool.close()
+
 
     # set sitemap to None now that the handler module has been un-configured
     # (it is used as a 'module configured' flag)
@@ -98,72 +119,150 @@ def handler(req):
     filled with an Apache request object.
     """
 
-    if sitemap.document_root == "":
-        # this is the first time a request has been made for this instance of the interpreter
-        # so get the name of the sitemap.xml file from the Apache configuration file, the main
-        # server configuration file and load them both
-        req.server.register_cleanup(req, cleanup) # also register the cleanup function
-        req.add_common_vars()
-        env_dict = req.subprocess_env
-
-        # if the handler is running in a VirtualHost, then fetch the *actual* SERVER_NAME and DOCUMENT_ROOT values
-        if not env_dict.has_key('ServerName') and not env_dict.has_key('DocumentRoot'):
-            use_server_name = req.server.server_hostname
-            use_document_root = req.document_root()
-        # otherwise, they need to have been set using SetEnv
-        else:
-            use_server_name = env_dict['ServerName']
-            use_document_root = env_dict['DocumentRoot']
-            
-        # create the log streams
-        server.access_log = log_buffer(sys.stderr, use_server_name) # what stream should this write to?
-        server.error_log = log_buffer(sys.stderr, use_server_name)
-
-        # if we're not running inside Apache
-        # add the DOCUMENT_ROOT to the Python path
-        if apache.__class__.__name__ == "fake_apache":
-            sys.path.append(use_document_root)
-        # (otherwise this is done with the mod_python PythonPath directive)
-
-        if env_dict.has_key('PycoonConfigRoot'):
-            config_root =  env_dict['PycoonConfigRoot']
-        else:
-            config_root = "/etc/pycoon"
-        
-        server_config_parse("file://%s/%s" % (config_root, "server.xml"), server)
-        if server.log_up_down:
-            server.error_log.write("Successfully loaded server configuration, \"%s\", for \"%s\"" %\
-                                   ("server.xml", use_server_name))
-
-        if env_dict.has_key('PycoonSitemap'):
-            sitemap_filename = env_dict['PycoonSitemap']
-        else:
-            sitemap_filename = "sitemap.xml"
+    # all the per-request state is kept in a request_context so that the sitemap can be shared by
+    # concurrent requests
+    ctx = get_request_context(req)
 
+    global configured, cleanup_registered
+    if not configured or not cleanup_registered:
+        _configure_lock.acquire()
         try:
-            sitemap.server_name = use_server_name
-            sitemap_config_parse("file://%s/%s" % (use_document_root, sitemap_filename), sitemap)
-            if server.log_up_down:
-                server.error_log.write("Successfully loaded sitemap configuration, \"%s\", for \"%s\"" %\
-                                       (sitemap_filename, use_server_name))
-        except:
-            req.status = apache.HTTP_INTERNAL_SERVER_ERROR
-            
-            server.EXCEPTION = sys.exc_info()
-
-            (success, status) = server.handle_error(req, apache.HTTP_INTERNAL_SERVER_ERROR)
-            if success:
-                return status
-            else:
-                return apache.HTTP_INTERNAL_SERVER_ERROR
+            if not cleanup_registered:
+                req.server.register_cleanup(req, cleanup)
+                cleanup_registered = True
+
+            if not configured:
+                status = configure(ctx)
+                configured = sitemap.document_root != ""
+                if status is not None:
+                    return status
+        finally:
+            _configure_lock.release()
 
     # handle the request
-    (success, status) = sitemap.handle(req)
+    (success, status) = sitemap.handle(ctx)
     if success:
         return status
     else:
-        (success, status) = server.handle_error(req, status)
+        (success, status) = server.handle_error(ctx, status)
+        if success:
+            return status
+        else:
+            return apache.HTTP_INTERNAL_SERVER_ERROR
+
+def configure(req):
+    """
+    Loads the server configuration and the sitemap when the first request is made for this instance of
+    the interpreter. Returns None if they were loaded successfully or an Apache status code otherwise.
+
+    @req: a request_context
+    """
+
+    # this is the first time a request has been made for this instance of the interpreter
+    # so get the name of the sitemap.xml file from the Apache configuration file, the main
+    # server configuration file and load them both
+    req.add_common_vars()
+    env_dict = req.subprocess_env
+
+    # if the handler is running in a VirtualHost, then fetch the *actual* SERVER_NAME and DOCUMENT_ROOT values
+    if not env_dict.has_key('ServerName') and not env_dict.has_key('DocumentRoot'):
+        use_server_name = req.server.server_hostname
+        use_document_root = req.document_root()
+    # otherwise, they need to have been set using SetEnv
+    else:
+        use_server_name = env_dict['ServerName']
+        use_document_root = env_dict['DocumentRoot']
+        
+    if env_dict.has_key('PycoonConfigRoot'):
+        config_root =  env_dict['PycoonConfigRoot']
+    else:
+        config_root = "/etc/pycoon"
+    
+    load_server(use_server_name, use_document_root, config_root)
+
+    if env_dict.has_key('PycoonSitemap'):
+        sitemap_filename = env_dict['PycoonSitemap']
+    else:
+        sitemap_filename = "sitemap.xml"
+
+    try:
+        load_sitemap(use_server_name, use_document_root, sitemap_filename)
+    except:
+        req.status = apache.HTTP_INTERNAL_SERVER_ERROR
+        
+        req.exception = sys.exc_info()
+
+        (success, status) = server.handle_error(req, apache.HTTP_INTERNAL_SERVER_ERROR)
         if success:
             return status
         else:
             return apache.HTTP_INTERNAL_SERVER_ERROR
+
+    return None
+
+def load_server(server_name, document_root, config_root):
+    """
+    Creates the log streams and loads the server configuration file.
+
+    @server_name: the name of the (Virtual)Host
+    @document_root: the absolute path of the web application
+    @config_root: the directory containing the server.xml file
+    """
+
+    # create the log streams
+    server.access_log = log_buffer(sys.stderr, server_name) # what stream should this write to?
+    server.error_log = log_buffer(sys.stderr, server_name)
+
+    # if we're not running inside Apache
+    # add the DOCUMENT_ROOT to the Python path
+    if apache.__class__.__name__ == "fake_apache":
+        sys.path.append(document_root)
+    # (otherwise this is done with the mod_python PythonPath directive)
+
+    server_config_parse("file://%s/%s" % (config_root, "server.xml"), server)
+    if server.log_up_down:
+        server.error_log.write("Successfully loaded server configuration, \"%s\", for \"%s\"" %\
+                               ("server.xml", server_name))
+
+def load_sitemap(server_name, document_root, sitemap_filename):
+    """
+    Loads (and warms up) the sitemap.
+
+    @server_name: the name of the (Virtual)Host
+    @document_root: the absolute path of the web application
+    @sitemap_filename: the name of the sitemap file in the document_root
+    """
+
+    sitemap.server_name = server_name
+    sitemap_config_parse("file://%s/%s" % (document_root, sitemap_filename), sitemap)
+    if server.log_up_down:
+        server.error_log.write("Successfully loaded sitemap configuration, \"%s\", for \"%s\"" %\
+                               (sitemap_filename, server_name))
+
+def preload(server_name, document_root, config_root="/etc/pycoon", sitemap_filename="sitemap.xml"):
+    """
+    Loads the server configuration and the sitemap (including its warm-up) before the first request
+    is made, so that no request has to wait for them. It is intended to be called by a module named
+    in a mod_python PythonImport directive, which is imported when each Apache child process starts,
+    e.g.:
+
+        import pycoon
+        pycoon.preload("www.example.com", "/var/www/example")
+
+    Any errors are raised.
+
+    @server_name: the name of the (Virtual)Host
+    @document_root: the absolute path of the web application
+    @config_root: the directory containing the server.xml file. Optional
+    @sitemap_filename: the name of the sitemap file in the document_root. Optional
+    """
+
+    global configured
+    _configure_lock.acquire()
+    try:
+        if not configured:
+            load_server(server_name, document_root, config_root)
+            load_sitemap(server_name, document_root, sitemap_filename)
+            configured = sitemap.document_root != ""
+    finally:
+        _configure_lock.release()
@@ -0,0 +1,707 @@
+"""
+Copyright (C) Richard Lewis 2006
+
+This software is licensed under the terms of the GNU GPL.
+
+The cache module contains the lru_cache class, used for Pycoon's in-memory caches, the
+cached_response class which holds the responses stored in the sitemap's requests and pipeline
+caches, the shared_cache class which can hold those responses for every process of the server,
+the files_cache class used by the read component, the documents_cache class used by generators,
+the stylesheets_cache class used by the XSLT transformer, the response_validator class used
+for conditional GET requests and the single_flight class which stops concurrent requests from
+computing the same cached item.
+"""
+
+import os, time, threading, hashlib, cPickle, sqlite3
+
+try:
+    import fcntl
+except ImportError:
+    # without fcntl, single_flight only works within each process
+    fcntl = None
+from collections import OrderedDict
+
+def file_mtime(path):
+    """
+    Returns the modification time of the file with the given path or None if it doesn't exist.
+    """
+
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def dependencies_valid(dependencies):
+    """
+    Returns True if none of the files in the given dictionary of modification times (indexed by path)
+    has been modified (or created or removed).
+    """
+
+    for path, mtime in dependencies.items():
+        if file_mtime(path) != mtime:
+            return False
+
+    return True
+
+class lru_cache(object):
+    """
+    lru_cache is a dictionary-like cache which holds at most max_entries items whose total size is at
+    most max_bytes. When either limit would be exceeded, the least recently used items are discarded.
+    It may be shared by concurrent requests.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        """
+        lru_cache constructor.
+
+        @max_entries: the maximum number of items in the cache
+        @max_bytes: the maximum total size (in bytes) of the items in the cache
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()   # dictionary of (value, size) tuples (indexed by key) in order of use
+        self.size = 0                  # the total size of the cached items
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the item stored under the given key (marking it as the most recently used) or default if
+        there is no such item.
+        """
+
+        self.lock.acquire()
+        try:
+            try:
+                entry = self.entries.pop(key)
+            except KeyError:
+                return default
+            self.entries[key] = entry
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def put(self, key, value, size):
+        """
+        Stores the given value under the given key, discarding the least recently used items if necessary.
+        Returns False if the value is too big to be cached at all.
+
+        @key: the key for the item
+        @value: the item
+        @size: the size of the item (in bytes)
+        """
+
+        if size > self.max_bytes or self.max_entries < 1:
+            return False
+
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                self.size -= self.entries.pop(key)[1]
+
+            while len(self.entries) >= self.max_entries or self.size + size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+            return True
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        """
+        Discards the item stored under the given key (if there is one).
+        """
+
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                self.size -= self.entries.pop(key)[1]
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """
+        Discards all the cached items.
+        """
+
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.size = 0
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def has_key(self, key):
+        return self.entries.has_key(key)
+
+# the number of items which shared_cache reads at a time when discarding the least recently used items
+EVICTION_BATCH = 16
+
+class shared_cache(object):
+    """
+    shared_cache is a dictionary-like cache with the same interface as lru_cache which keeps its
+    items in an SQLite database file (in WAL mode) so that they are shared by every process which
+    uses the same file, e.g. every child of a prefork Apache server. The total size of the items of
+    all the caches in the file is at most max_bytes; when it would be exceeded, the least recently
+    used items are discarded. Items must be picklable. Any database errors (e.g. lock timeouts) are
+    treated as cache misses.
+    """
+
+    def __init__(self, path, max_bytes, namespace="", touch_interval=1.0, timeout=5.0):
+        """
+        shared_cache constructor. Creates the database file if it doesn't exist.
+
+        @path: the path of the database file; it should be on a local disk
+        @max_bytes: the maximum total size (in bytes) of the pickled items in the file
+        @namespace: a string which distinguishes this cache's items from those of other caches in the
+                    same file. Optional
+        @touch_interval: the minimum number of seconds between updates of an item's last use time.
+                         Optional
+        @timeout: the number of seconds to wait for another process's lock on the file. Optional
+        """
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.touch_interval = touch_interval
+        self.timeout = timeout
+
+        self.local = threading.local() # holds each thread's connection and the process it was made in
+        self.connection()
+
+    def connection(self):
+        """
+        Returns the current thread's connection to the database file. SQLite connections can't be shared
+        by threads or inherited by forked processes, so each thread of each process has its own.
+        """
+
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, namespace TEXT NOT NULL, "
+                         "value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS items_used ON items (used)")
+
+            # the total size of the items is kept up to date by triggers so that it needn't be summed
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) "
+                         "SELECT 'total_size', COALESCE(SUM(size), 0) FROM items")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS items_insert AFTER INSERT ON items BEGIN "
+                         "UPDATE meta SET value = value + new.size WHERE name = 'total_size'; END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS items_delete AFTER DELETE ON items BEGIN "
+                         "UPDATE meta SET value = value - old.size WHERE name = 'total_size'; END")
+
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+
+        return conn
+
+    def _key(self, key):
+        return hashlib.md5(repr((self.namespace, key))).hexdigest()
+
+    def get(self, key, default=None):
+        """
+        Returns the item stored under the given key (marking it as recently used) or default if there is
+        no such item.
+        """
+
+        k = self._key(key)
+        try:
+            conn = self.connection()
+            row = conn.execute("SELECT value, used FROM items WHERE key = ?", (k,)).fetchone()
+            if row is None:
+                return default
+
+            # the last use time is only updated occasionally so that most reads needn't lock the file
+            now = time.time()
+            if now - row[1] >= self.touch_interval:
+                conn.execute("UPDATE items SET used = ? WHERE key = ?", (now, k))
+        except sqlite3.Error:
+            return default
+
+        try:
+            return cPickle.loads(str(row[0]))
+        except (cPickle.UnpicklingError, EOFError, ImportError, AttributeError, ValueError):
+            return default
+
+    def put(self, key, value, size):
+        """
+        Stores the given value under the given key, discarding the least recently used items (of any
+        cache in the file) if necessary. Returns False if the value can't be cached.
+
+        @key: the key for the item
+        @value: the item
+        @size: the size of the item (in bytes); the size of the pickled item is used to enforce max_bytes
+        """
+
+        try:
+            data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError):
+            return False
+
+        if len(data) > self.max_bytes:
+            return False
+
+        k = self._key(key)
+        try:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # the old item is deleted first (rather than replaced) so that the triggers see it go
+                conn.execute("DELETE FROM items WHERE key = ?", (k,))
+                conn.execute("INSERT INTO items (key, namespace, value, size, used) VALUES (?, ?, ?, ?, ?)",
+                             (k, self.namespace, sqlite3.Binary(data), len(data), time.time()))
+
+                excess = conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0] -\
+                         self.max_bytes
+                while excess > 0:
+                    # discard the least recently used items a few at a time, rather than reading them all
+                    rows = conn.execute("SELECT key, size FROM items WHERE key != ? ORDER BY used LIMIT ?",
+                                        (k, EVICTION_BATCH)).fetchall()
+                    if len(rows) == 0:
+                        break
+                    for (old_k, old_size) in rows:
+                        if excess <= 0:
+                            break
+                        conn.execute("DELETE FROM items WHERE key = ?", (old_k,))
+                        excess -= old_size
+
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            return False
+
+        return True
+
+    def remove(self, key):
+        """
+        Discards the item stored under the given key (if there is one).
+        """
+
+        try:
+            self.connection().execute("DELETE FROM items WHERE key = ?", (self._key(key),))
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        """
+        Discards all the items of this cache (but not those of other caches in the same file).
+        """
+
+        try:
+            self.connection().execute("DELETE FROM items WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error:
+            pass
+
+    def __len__(self):
+        try:
+            return self.connection().execute("SELECT COUNT(*) FROM items WHERE namespace = ?",
+                                             (self.namespace,)).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def has_key(self, key):
+        try:
+            return self.connection().execute("SELECT 1 FROM items WHERE key = ?",
+                                             (self._key(key),)).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+class cached_response(object):
+    """
+    cached_response holds a fully serialized response from the sitemap's requests cache or
+    pipeline cache.
+    """
+
+    def __init__(self, body, mime, status, dependencies={}, vary=[], validator=None, volatile=False, encoding=None):
+        """
+        cached_response constructor.
+
+        @body: the serialized response string
+        @mime: the response's MIME type
+        @status: the response's HTTP status code
+        @dependencies: a dictionary of the modification times of the files which the response
+                       depends on (indexed by path). Optional
+        @vary: a list of the names of the request headers which the response depends on. Optional
+        @validator: the response's response_validator (if it has one). Optional
+        @volatile: True if the response depends on something other than files, so that it may only be
+                   cached for a limited time (see the pipeline's max_age). Optional
+        @encoding: the content coding of the body ('gzip') or None if it isn't compressed. Optional
+        """
+
+        self.body = body
+        self.mime = mime
+        self.status = status
+        self.dependencies = dict(dependencies)
+        self.vary = list(vary)
+        self.validator = validator
+        self.volatile = volatile
+        self.encoding = encoding
+        self.created = time.time()
+
+    def valid(self):
+        """
+        Returns True if none of the response's dependencies have changed since it was cached.
+        """
+
+        return dependencies_valid(self.dependencies)
+
+    def age(self):
+        """
+        Returns the number of seconds since the response was cached.
+        """
+
+        return time.time() - self.created
+
+class cached_file(object):
+    """
+    cached_file holds the contents of a file in the files cache along with the details used to
+    validate them.
+    """
+
+    def __init__(self, data, mtime, size, checked):
+        """
+        cached_file constructor.
+
+        @data: the contents of the file
+        @mtime: the modification time of the file when it was read
+        @size: the size of the file when it was read
+        @checked: the time at which the file's mtime and size were last checked
+        """
+
+        self.data = data
+        self.mtime = mtime
+        self.size = size
+        self.checked = checked
+
+class files_cache(object):
+    """
+    files_cache keeps the contents of recently read files in memory. A cached file is re-read if its
+    mtime or size has changed, but its details are only checked once every stat_interval seconds.
+    """
+
+    def __init__(self, max_files, max_file_size, stat_interval):
+        """
+        files_cache constructor.
+
+        @max_files: the maximum number of cached files
+        @max_file_size: the maximum size (in bytes) of files that can be cached
+        @stat_interval: the minimum number of seconds between checks of a cached file's details
+        """
+
+        self.max_file_size = max_file_size
+        self.stat_interval = stat_interval
+
+        self.files = lru_cache(max_files, max_files * max_file_size) # an lru_cache of cached_file objects
+                                                                     # (indexed by path)
+
+    def read(self, path):
+        """
+        Returns the contents of the file with the given path as a string or, if the file is too big to be
+        cached, as an open file object so that it can be streamed. Raises IOError or OSError if the file
+        can't be read.
+
+        @path: the absolute path of the file
+        """
+
+        now = time.time()
+
+        f = self.files.get(path)
+        if f is not None and now - f.checked < self.stat_interval:
+            return f.data
+
+        st = os.stat(path)
+        if f is not None and f.mtime == st.st_mtime and f.size == st.st_size:
+            f.checked = now
+            return f.data
+
+        if st.st_size > self.max_file_size:
+            self.files.remove(path)
+            return file(path, 'r')
+
+        data = file(path, 'r').read()
+        self.files.put(path, cached_file(data, st.st_mtime, st.st_size, now), len(data))
+
+        return data
+
+class documents_cache(object):
+    """
+    documents_cache keeps recently parsed XML (or HTML) documents in memory. A cached document is
+    re-parsed if its file's mtime or size has changed. The cached trees are shared by every request,
+    so they must never be modified: copy any part of a tree which is to be passed on through a
+    pipeline.
+    """
+
+    def __init__(self, max_documents, max_bytes, parse):
+        """
+        documents_cache constructor.
+
+        @max_documents: the maximum number of cached documents
+        @max_bytes: the maximum total size (in bytes) of the files of the cached documents
+        @parse: a function which takes a path and a content type [xml|html] and returns the parsed
+                document
+        """
+
+        self.parse_file = parse
+        self.documents = lru_cache(max_documents, max_bytes) # an lru_cache of cached_file objects
+                                                             # (indexed by (path, content type))
+
+    def parse(self, path, content="xml"):
+        """
+        Returns the parsed document of the file with the given path. Raises IOError or OSError if
+        the file can't be read.
+
+        @path: the absolute path of the file
+        @content: the type of content in the file [xml|html]. Optional; xml is default
+        """
+
+        st = os.stat(path)
+
+        d = self.documents.get((path, content))
+        if d is not None and d.mtime == st.st_mtime and d.size == st.st_size:
+            return d.data
+
+        tree = self.parse_file(path, content)
+        self.documents.put((path, content), cached_file(tree, st.st_mtime, st.st_size, time.time()), st.st_size)
+
+        return tree
+
+class compiled_stylesheet(object):
+    """
+    compiled_stylesheet holds a compiled stylesheet in the stylesheets cache along with the details
+    used to validate it.
+    """
+
+    def __init__(self, transform, dependencies):
+        """
+        compiled_stylesheet constructor.
+
+        @transform: the compiled stylesheet (e.g. an lxml.etree.XSLT object)
+        @dependencies: a dictionary of the modification times of the stylesheet file and of every file
+                       it uses (indexed by path)
+        """
+
+        self.transform = transform
+        self.dependencies = dependencies
+
+class stylesheets_cache(object):
+    """
+    stylesheets_cache keeps recently compiled stylesheets in memory. A cached stylesheet is recompiled
+    if its file, or any file it uses, has changed. Compiled stylesheets aren't safe to share between
+    threads, so each thread has its own cache.
+    """
+
+    def __init__(self, max_stylesheets, compile):
+        """
+        stylesheets_cache constructor.
+
+        @max_stylesheets: the maximum number of cached stylesheets (in each thread)
+        @compile: a function which takes a path and returns a compiled_stylesheet
+        """
+
+        self.max_stylesheets = max_stylesheets
+        self.compile = compile
+        self.local = threading.local() # holds each thread's lru_cache of compiled_stylesheet objects
+                                       # (indexed by path)
+
+    def get(self, path):
+        """
+        Returns the compiled_stylesheet for the stylesheet file with the given path.
+
+        @path: the absolute path of the stylesheet
+        """
+
+        try:
+            stylesheets = self.local.stylesheets
+        except AttributeError:
+            stylesheets = lru_cache(self.max_stylesheets, self.max_stylesheets)
+            self.local.stylesheets = stylesheets
+
+        s = stylesheets.get(path)
+        if s is not None and dependencies_valid(s.dependencies):
+            return s
+
+        s = self.compile(path)
+        stylesheets.put(path, s, 1)
+
+        return s
+
+class response_validator(object):
+    """
+    response_validator holds the ETag and Last-Modified values of a response along with the
+    dependencies they were derived from.
+    """
+
+    def __init__(self, etag, last_modified, dependencies):
+        """
+        response_validator constructor.
+
+        @etag: the response's entity tag (including its quotes)
+        @last_modified: the latest modification time of the response's dependencies or None if
+                        it has none
+        @dependencies: a dictionary of the modification times of the files which the response
+                       depends on (indexed by path)
+        """
+
+        self.etag = etag
+        self.last_modified = last_modified
+        self.dependencies = dict(dependencies)
+
+    def valid(self):
+        """
+        Returns True if none of the response's dependencies have changed since the validator was made.
+        """
+
+        return dependencies_valid(self.dependencies)
+
+def make_validator(inputs, dependencies):
+    """
+    Returns a response_validator for a response made from the given request inputs and files.
+
+    @inputs: the request inputs which the response depends on (e.g. a pipeline.cache_key)
+    @dependencies: a dictionary of the modification times of the files which the response
+                   depends on (indexed by path)
+    """
+
+    items = dependencies.items()
+    items.sort()
+    etag = "\"%s\"" % hashlib.md5(repr((inputs, items))).hexdigest()
+
+    mtimes = [mtime for mtime in dependencies.values() if mtime is not None]
+    if len(mtimes) > 0:
+        last_modified = max(mtimes)
+    else:
+        last_modified = None
+
+    return response_validator(etag, last_modified, dependencies)
+
+# the number of lock files used by single_flight
+LOCK_FILES = 1024
+
+class flight(object):
+    """
+    flight represents the computation of an item by the single_flight leader for its key.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()  # set when the computation is finished
+        self.lock_file = None          # the open lock file held for the computation (if it is shared by processes)
+        self.result = None             # the item, if the leader gives it to the waiting requests of this process
+                                       # directly (e.g. because it can't be cached)
+
+class single_flight(object):
+    """
+    single_flight ensures that only one of the concurrent requests which need the same item (e.g. a
+    pipeline result with the same cache key) computes it. The first request becomes the leader; the
+    others wait until it has finished and then look for the item in the cache. If lock_dir is given,
+    the leader also holds a lock file for the key (one of LOCK_FILES, chosen by the key's hash) so that
+    the requests of other processes (sharing a shared_cache) wait for it too.
+    """
+
+    def __init__(self, lock_dir=None, timeout=30.0, poll_interval=0.05):
+        """
+        single_flight constructor.
+
+        @lock_dir: the directory of the lock files used across processes. Optional; without it (or
+                   without the fcntl module) only the threads of this process wait for each other
+        @timeout: the maximum number of seconds to wait for a leader. Optional
+        @poll_interval: the number of seconds between attempts to take a lock file. Optional
+        """
+
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+        if lock_dir is not None and fcntl is not None:
+            try:
+                os.makedirs(lock_dir)
+            except OSError:
+                # it already exists
+                pass
+            self.lock_dir = lock_dir
+        else:
+            self.lock_dir = None
+
+        self.flights = {}              # dictionary of the flights in progress in this process (indexed by key)
+        self.lock = threading.Lock()
+
+    def begin(self, key):
+        """
+        Returns a tuple of a flag which is True if the caller is the leader for the given key (and so must
+        compute the item and then call end()) and the key's flight. If the item is shared by processes, the
+        leader waits for the leaders of other processes first.
+        """
+
+        self.lock.acquire()
+        try:
+            f = self.flights.get(key)
+            if f is not None:
+                return (False, f)
+
+            f = flight()
+            self.flights[key] = f
+        finally:
+            self.lock.release()
+
+        if self.lock_dir is not None:
+            f.lock_file = self._lock_file(key)
+
+        return (True, f)
+
+    def wait(self, f):
+        """
+        Waits until the leader of the given flight has finished (or the timeout has passed).
+        """
+
+        f.done.wait(self.timeout)
+
+    def end(self, key, f):
+        """
+        Finishes the given flight for the given key, releasing the requests which are waiting for it.
+        """
+
+        if f.lock_file is not None:
+            fcntl.flock(f.lock_file.fileno(), fcntl.LOCK_UN)
+            f.lock_file.close()
+
+        self.lock.acquire()
+        try:
+            if self.flights.get(key) is f:
+                del self.flights[key]
+        finally:
+            self.lock.release()
+
+        f.done.set()
+
+    def _lock_file(self, key):
+        """
+        Returns the lock file for the given key once this process holds its lock, or None if the lock
+        couldn't be taken before the timeout.
+        """
+
+        # keys share a fixed set of lock files so that the directory doesn't grow (a collision only makes
+        # the leaders of two keys wait for each other)
+        path = os.path.join(self.lock_dir, "%x" % (int(hashlib.md5(repr(key)).hexdigest(), 16) % LOCK_FILES))
+        try:
+            lock_file = open(path, "a")
+        except IOError:
+            return None
+
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except IOError:
+                if time.time() >= deadline:
+                    lock_file.close()
+                    return None
+                time.sleep(self.poll_interval)
@@ -8,6 +8,7 @@ used in the Pycoon system.
 """
 
 import os, string
+import lxml.etree
 from pycoon import PycoonConfigurationError
 from pycoon.interpolation import interpolate
 
@@ -20,6 +21,107 @@ COMPONENT_TYPES = {"stream": {"generator": {"module": "pycoon.generators", "supe
 
 class ComponentError(PycoonConfigurationError): pass
 
+class event_stream(object):
+    """
+    event_stream is the result of a streaming stream component (e.g. a generator with stream="yes"). It
+    represents a document whose root element's children are produced one at a time as the stream is
+    read, so that the whole document never has to be held in memory. Components whose streaming
+    property is True may be given an event_stream in place of an Element; any other component is given
+    the Element built from it (see to_tree). The children can only be read once.
+    """
+
+    def __init__(self, root, children):
+        """
+        event_stream constructor.
+
+        @root: the root Element; only its name, attributes, namespaces and text are used (its text need
+               not be known until the first child has been produced)
+        @children: an iterable of the root's child nodes (with their tails), detached from the root
+        """
+
+        self.root = root
+        self.children = iter(children)
+        self.lookahead = None          # a list of the children read by prime() before the stream is iterated
+
+    @classmethod
+    def from_tree(cls, root):
+        """
+        Returns an event_stream of the children of the given Element (which are removed from it as they
+        are read).
+        """
+
+        def children():
+            for c in list(root):
+                root.remove(c)
+                yield c
+
+        return cls(root, children())
+
+    def prime(self):
+        """
+        Reads the first child (if it hasn't been read), so that the root's text is known and any error
+        at the start of the stream is raised now rather than when the stream is iterated.
+        """
+
+        if self.lookahead is None:
+            self.lookahead = []
+            for c in self.children:
+                self.lookahead.append(c)
+                break
+
+    def shell(self):
+        """
+        Returns a new Element with the root's name, attributes, namespaces and text but no children.
+        """
+
+        # the root's text is only certain to have been read once its first child has been
+        self.prime()
+
+        e = lxml.etree.Element(self.root.tag, nsmap=self.root.nsmap)
+        for name, value in self.root.items():
+            e.set(name, value)
+        e.text = self.root.text
+
+        return e
+
+    def __iter__(self):
+        if self.lookahead is not None:
+            while len(self.lookahead) > 0:
+                yield self.lookahead.pop(0)
+
+        for c in self.children:
+            yield c
+
+    def map(self, func):
+        """
+        Returns a new event_stream with the same root whose children are the results of the given
+        function for each of this stream's children: an Element, a list of Elements or None.
+        """
+
+        def children():
+            for c in self:
+                result = func(c)
+                if result is None:
+                    continue
+                elif isinstance(result, list):
+                    for r in result:
+                        yield r
+                else:
+                    yield result
+
+        return event_stream(self.root, children())
+
+    def to_tree(self):
+        """
+        Reads the whole stream and returns the document as an Element.
+        """
+
+        e = self.shell()
+        for c in self:
+            e.append(c)
+
+        return e
+
 def register_component(server, super_type, attrs):
     """
     Reads a component described by the content of the given XML element attributes object and
@@ -118,6 +220,14 @@ class component(object):
     # corresponds to classes immediately derived from stream_component and syntax_component
     # and to component's invokation element name
     function = "none"
+
+    # streaming class property is True for stream components which accept an event_stream as their
+    # previous sibling result (and child results); other stream components are given Elements
+    streaming = False
+
+    # reads_input_only class property is True for stream components which never modify (or move nodes
+    # out of) their previous sibling result, so they may be given trees which are shared by requests
+    reads_input_only = False
         
     def __init__(self, parent, root_path=""):
         """
@@ -167,6 +277,9 @@ class component(object):
 
         # a list of child components
         self.children = []
+
+        # dictionary of compiled interpolation_template objects (indexed by attribute string)
+        self.templates = {}
         
         self.description = "Component base class"
 
@@ -178,7 +291,9 @@ class component(object):
         __call__ returns a tuple whose first member is a flag indicating whether execution was 'successful'
         and whose second is the 'result'.
 
-        @req: is the current apache request object
+        @req: is the request_context of the current request (which wraps the Apache request object). Components
+        must keep any per-request data in it rather than in their own properties because a component is shared
+        by every request the sitemap handles.
         @p_sibling_result: is the result of the pipeline so far (i.e. up to the previous sibling
         component) (optional)
         @child_results: is the result of the child pipelines of this component (optional)
@@ -192,9 +307,18 @@ class component(object):
         if self._descend(req, p_sibling_result):
             for comp in self.children:
                 if len(c_tree) > 0:
-                    (success, result) = comp(req, c_tree[-1])
+                    input = c_tree[-1]
                 else:
-                    (success, result) = comp(req, p_sibling_result)
+                    input = p_sibling_result
+
+                if isinstance(input, event_stream) and comp.role == "stream" and not comp.streaming:
+                    # the tree is only built for components which need it
+                    input = input.to_tree()
+                    if len(c_tree) > 0:
+                        # the stream can only be read once
+                        c_tree[-1] = input
+
+                (success, result) = comp(req, input)
                 
                 if success:
                     c_tree.append(result)
@@ -204,6 +328,11 @@ class component(object):
                 if not comp._continue(req, p_sibling_result):
                     break
 
+        if self.role == "stream" and not self.streaming:
+            for i in range(len(c_tree)):
+                if isinstance(c_tree[i], event_stream):
+                    c_tree[i] = c_tree[i].to_tree()
+
         if self.server.log_debug:
             self.server.error_log.write("%s about to call _result(\"%s\", %s, %s)" %\
                                         (self.description, req.unparsed_uri, p_sibling_result, c_tree))
@@ -247,6 +376,67 @@ class component(object):
 
         raise NotImplemented()
     
+    def constant_value(self, string_arg, as_filename=False):
+        """
+        Returns the interpolated value of the given attribute string if it includes no interpolation
+        instructions (i.e. if it is the same for every request), or None otherwise.
+
+        @string_arg: one of the component's attribute strings
+        @as_filename: if True, the result will be an absolute path name (relative to the component's
+                      root_path). Optional
+        """
+
+        t = self.templates.get(string_arg)
+        if t is None or not t.constant or t.uri_matcher is None:
+            return None
+
+        return t(None, as_filename, self.root_path)
+
+    def warm_up(self):
+        """
+        Called once the sitemap has been loaded (before it handles any requests) to allow the component
+        to do any expensive preparation which doesn't depend on the request (e.g. compiling stylesheets
+        with constant paths). The default behaviour is to do nothing.
+        """
+
+        pass
+
+    def cache_key(self, req):
+        """
+        Returns a tuple of the request inputs which this component's result depends on, for use in the
+        keys of cached pipeline results (see pipeline.cache_key). By default these are the values of the
+        component's attribute strings which include interpolation instructions; components which use
+        other request inputs (e.g. request headers) should add them.
+        """
+
+        return tuple([t(req) for t in self.templates.values() if not t.constant])
+
+    def data_sources(self):
+        """
+        Returns a set of the names of the sitemap data sources which this component and its child
+        components use. Data sources are shared, so components which use the same one aren't called
+        concurrently by parallel aggregates. Components which use a data source must add its name.
+        """
+
+        names = set()
+        for c in self.children:
+            names.update(c.data_sources())
+
+        return names
+
+    def next_sibling(self):
+        """
+        Returns the component which follows this one in its parent's children (and so is given this
+        component's result as its previous sibling result), or None if this is the last child.
+        """
+
+        siblings = getattr(self.parent, "children", [])
+        for i in range(len(siblings) - 1):
+            if siblings[i] is self:
+                return siblings[i + 1]
+
+        return None
+
     def add_component(self, c, pos=None):
         if c is None:
             raise TypeError("component argument to add_component was None: %s" % str(c))
@@ -269,12 +459,15 @@ class component(object):
 
         return parameters
 
-    def find_components(self, class_name, found=[]):
+    def find_components(self, class_name, found=None):
         """
         Searches this component's child components for any components with the given class name.
         Either returns the component(s) or [].
         """
 
+        if found is None:
+            found = []
+
         if self.__class__.__name__ == class_name:
             found.append(self)
 
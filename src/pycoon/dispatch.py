@@ -0,0 +1,315 @@
+"""
+Copyright (C) Richard Lewis 2006
+
+This software is licensed under the terms of the GNU GPL.
+
+The dispatch module contains the uri_dispatch_index and uri_dispatch_regex classes which
+allow a sitemap to narrow down the pipelines which could possibly handle a request URI
+without executing each of them in turn.
+"""
+
+import re
+from pycoon import apache
+
+# this compiled regex is used to collapse repeated '/' characters in request paths
+_collapse_slashes = re.compile("/{2,}")
+
+# the maximum number of groups in each of uri_dispatch_regex's combined regular expressions
+# (some versions of Python's re module refuse to compile patterns with 100 or more groups)
+MAX_REGEX_GROUPS = 99
+
+def collapse_slashes(path):
+    """
+    Replaces any repeated '/' characters in the given path with a single '/'. (uri_matcher patterns
+    allow '/' to be matched one or more times.)
+    """
+
+    return _collapse_slashes.sub("/", path)
+
+# this compiled regex finds backreferences, which refer to groups by number
+_backreference = re.compile(r"\\[1-9]")
+
+def combinable(pattern):
+    """
+    Returns True if the given regular expression pattern can be made an alternative of a combined
+    regular expression (see uri_dispatch_regex): it mustn't have backreferences (the group numbers
+    change) or alternatives outside parentheses (the anchors would then only apply to some of them).
+    """
+
+    if _backreference.search(pattern) is not None:
+        return False
+
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            # skip the escaped character
+            i += 1
+        elif in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return False
+        i += 1
+
+    return True
+
+class _trie_node(object):
+    """
+    _trie_node is a single node of the literal prefix trie used by uri_dispatch_index.
+    """
+
+    def __init__(self):
+        self.children = {}   # dictionary of child nodes (indexed by character)
+        self.positions = []  # list of the positions of the pipelines whose prefix ends at this node
+
+class uri_dispatch_index(object):
+    """
+    uri_dispatch_index is a trie of the literal prefixes of the URI patterns of the top-level
+    uri_matcher components of a list of pipelines. Looking up a request path in it returns the
+    pipelines which could match the path, in their original order, so that the cost of finding
+    the handling pipeline is roughly proportional to the length of the path rather than to the
+    number of pipelines. The matchers' own regular expressions are still used to decide whether
+    the candidate pipelines actually match.
+    """
+
+    def __init__(self, pipelines):
+        """
+        uri_dispatch_index constructor. Builds the index immediately.
+
+        @pipelines: a list of pipeline objects (usually sitemap_config.pipelines)
+        """
+
+        self.pipelines = pipelines
+        self.root = _trie_node()
+        self.unindexed = []  # positions of pipelines which must always be tried
+
+        for pos in range(len(self.pipelines)):
+            self.add_pipeline(pos, self.pipelines[pos])
+
+    def add_pipeline(self, pos, p):
+        """
+        Adds the given pipeline to the index under the prefixes of its top-level matchers. A pipeline
+        with any top-level component which is not a prefix-indexable matcher is tried for every request.
+
+        @pos: the position of the pipeline in the sitemap
+        @p: a pipeline object
+        """
+
+        prefixes = []
+        for c in p.children:
+            # components which can be indexed by prefix provide a dispatch_prefix() method
+            # (see uri_matcher) which returns None if they can't be indexed after all
+            get_prefix = getattr(c, "dispatch_prefix", None)
+            if get_prefix is not None:
+                prefix = get_prefix()
+            else:
+                prefix = None
+
+            if prefix is None:
+                self.unindexed.append(pos)
+                return
+            prefixes.append(prefix)
+
+        for prefix in prefixes:
+            node = self.root
+            for ch in prefix:
+                node = node.children.setdefault(ch, _trie_node())
+            if pos not in node.positions:
+                node.positions.append(pos)
+
+    def lookup(self, path):
+        """
+        Returns the list of pipelines which may match the given request path, in sitemap order.
+
+        @path: the path portion of a request URI
+        """
+
+        positions = list(self.unindexed)
+
+        node = self.root
+        positions.extend(node.positions)
+        for ch in collapse_slashes(path):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            positions.extend(node.positions)
+
+        positions = list(set(positions))
+        positions.sort()
+
+        return [self.pipelines[pos] for pos in positions]
+
+    def candidates(self, req):
+        """
+        Returns the list of pipelines which may handle the given request, in sitemap order.
+
+        @req: a request_context
+        """
+
+        path = req.parsed_uri[apache.URI_PATH]
+        if path is None:
+            # there's nothing to look up, so let every pipeline have a go
+            return self.pipelines
+
+        return self.lookup(path)
+
+class alternative_match(object):
+    """
+    alternative_match presents the part of a uri_dispatch_regex match object which belongs to one
+    matcher's pattern as if it were the match object of that matcher's own regular expression, so
+    that group numbers (as used by the '{$n}' interpolation syntax) are unchanged.
+    """
+
+    def __init__(self, match_obj, group_index, group_count):
+        """
+        alternative_match constructor.
+
+        @match_obj: the match object of the combined regular expression
+        @group_index: the index of the named group which encloses the matcher's pattern
+        @group_count: the number of groups in the matcher's own pattern
+        """
+
+        self.match_obj = match_obj
+        self.group_index = group_index
+        self.group_count = group_count
+
+    def group(self, n=0):
+        if n < 0 or n > self.group_count:
+            raise IndexError("no such group")
+
+        return self.match_obj.group(self.group_index + n)
+
+    def groups(self, default=None):
+        groups = []
+        for n in range(1, self.group_count + 1):
+            g = self.match_obj.group(self.group_index + n)
+            if g is None: g = default
+            groups.append(g)
+
+        return tuple(groups)
+
+class uri_dispatch_regex(object):
+    """
+    uri_dispatch_regex combines the regular expressions of the top-level uri_matcher and special_matcher
+    components of a list of pipelines into alternations of named groups so that the first matching
+    pattern is found by a single scan of the request path (or a few scans for very large sitemaps).
+    The match is handed to the matcher which owns the pattern so that it need not run its own regular
+    expression again.
+    """
+
+    def __init__(self, pipelines):
+        """
+        uri_dispatch_regex constructor. Compiles the combined regular expressions immediately.
+
+        @pipelines: a list of pipeline objects (usually sitemap_config.pipelines)
+        """
+
+        self.pipelines = pipelines
+        self.unindexed = []    # positions of pipelines which must always be tried
+        self.alternatives = [] # list of (pipeline position, matcher) tuples; indexed by alternative number
+        self.regexes = []      # list of compiled combined regular expressions
+
+        for pos in range(len(self.pipelines)):
+            self.add_pipeline(pos, self.pipelines[pos])
+
+        self.compile_regexes()
+
+    def add_pipeline(self, pos, p):
+        """
+        Adds the top-level matchers of the given pipeline to the list of alternatives. A pipeline with
+        any top-level component which does not provide a regular expression to match against the
+        request path (or whose regular expression can't be combined with the others) is tried for every
+        request, with its own regular expression.
+
+        @pos: the position of the pipeline in the sitemap
+        @p: a pipeline object
+        """
+
+        matchers = []
+        for c in p.children:
+            # components which can be dispatched by regex provide a dispatch_regex() method
+            # (see uri_matcher) which returns None if they can't be after all
+            get_regex = getattr(c, "dispatch_regex", None)
+            if get_regex is None or get_regex() is None or not combinable(get_regex().pattern):
+                self.unindexed.append(pos)
+                return
+            matchers.append(c)
+
+        for m in matchers:
+            self.alternatives.append((pos, m))
+
+    def compile_regexes(self):
+        """
+        Compiles the alternatives into as few combined regular expressions as the group limit allows.
+        """
+
+        parts = []
+        groups = 0
+        for n in range(len(self.alternatives)):
+            regex = self.alternatives[n][1].dispatch_regex()
+            if groups + regex.groups + 1 > MAX_REGEX_GROUPS and len(parts) > 0:
+                self.regexes.append(re.compile("^(?:%s)$" % "|".join(parts)))
+                parts = []
+                groups = 0
+
+            # strip the anchors from the matcher's pattern; the combined pattern has its own
+            pattern = regex.pattern
+            if pattern.startswith("^"): pattern = pattern[1:]
+            if pattern.endswith("$"): pattern = pattern[:-1]
+
+            parts.append("(?P<a%d>%s)" % (n, pattern))
+            groups += regex.groups + 1
+
+        if len(parts) > 0:
+            self.regexes.append(re.compile("^(?:%s)$" % "|".join(parts)))
+
+    def first_match(self, path):
+        """
+        Returns a tuple of the number of the first alternative which matches the given path and an
+        alternative_match for it, or None if no alternative matches.
+
+        @path: the path portion of a request URI
+        """
+
+        for regex in self.regexes:
+            match_obj = regex.match(path)
+            if match_obj is not None:
+                name = match_obj.lastgroup
+                n = int(name[1:])
+                return (n, alternative_match(match_obj, regex.groupindex[name], self.alternatives[n][1].dispatch_regex().groups))
+
+        return None
+
+    def candidates(self, req):
+        """
+        Returns the list of pipelines which may handle the given request, in sitemap order. If one of the
+        alternatives matches, its matcher is given the match for this request.
+
+        @req: a request_context
+        """
+
+        path = req.parsed_uri[apache.URI_PATH]
+        if path is None:
+            return self.pipelines
+
+        first = self.first_match(path)
+        if first is None:
+            return [self.pipelines[pos] for pos in self.unindexed]
+
+        (n, match_obj) = first
+        (first_pos, m) = self.alternatives[n]
+        req.dispatch_matches[m] = match_obj
+
+        # none of the alternatives before the first match can match, so only the pipelines
+        # which must always be tried need to be executed until the first matching pipeline;
+        # after that the pipelines are tried in turn as usual
+        return [self.pipelines[pos] for pos in self.unindexed if pos < first_pos] + self.pipelines[first_pos:]
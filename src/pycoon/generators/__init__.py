@@ -7,8 +7,10 @@ The generators module provides the generator class which is the base class of al
 generator classes.
 """
 
-from pycoon.components import stream_component, invokation_syntax, ComponentError
+from pycoon.components import stream_component, invokation_syntax, ComponentError, event_stream
 from pycoon.interpolation import interpolate
+from pycoon.resources import resource, RELOAD_POLICIES
+import lxml.etree
 
 class GeneratorError(ComponentError): pass
 
@@ -29,6 +31,76 @@ def register_invokation_syntax(server):
     server.component_syntaxes[("generate", None)] = invk_syn
     return invk_syn
 
+def parse_file(path, content="xml"):
+    """
+    Parses the file with the given path and returns an ElementTree.
+
+    @path: the absolute path of the file
+    @content: the type of content in the file [xml|html]. Optional; xml is default
+    """
+
+    if content == "html":
+        return lxml.etree.parse(open(path, "r"), lxml.etree.HTMLParser())
+    else:
+        return lxml.etree.parse(open(path, "r"))
+
+def iterparse_file(path, content="xml"):
+    """
+    Parses the file with the given path incrementally and returns an event_stream of its root element's
+    children. Each child is produced (and removed from the root) once it and its tail have been parsed,
+    so only one child is held in memory at a time. The document is parsed up to its first child at once,
+    so that a missing or malformed file is found before the stream is returned; syntax errors found
+    later are raised as GeneratorErrors while the stream is read.
+
+    @path: the absolute path of the file
+    @content: the type of content in the file [xml|html]. Optional; xml is default
+    """
+
+    events = iter(lxml.etree.iterparse(open(path, "r"), events=("start", "end", "comment", "pi"),
+                                       html=(content == "html")))
+
+    # the first event is the start of the root element
+    for event, root in events:
+        if event == "start":
+            break
+    else:
+        raise lxml.etree.XMLSyntaxError("no root element", None, 0, 0)
+
+    def parsed_events():
+        try:
+            for item in events:
+                yield item
+        except lxml.etree.XMLSyntaxError, e:
+            raise GeneratorError("syntax error in XML source, \"%s\": \"%s\"" % (path, str(e)))
+
+    def children():
+        depth = 1
+        pending = None     # the last child of the root, which is produced once its tail has been parsed
+        for event, node in parsed_events():
+            if event == "start":
+                depth += 1
+                if depth > 2:
+                    continue
+            elif event == "end":
+                depth -= 1
+                if depth > 0:
+                    # the end of a descendant (or of a child, whose tail isn't known until the next child)
+                    continue
+            elif depth > 1:
+                # a comment or processing instruction below the root's children
+                continue
+
+            # the root's next child has started (or the root has ended), so the pending child is complete
+            if pending is not None:
+                root.remove(pending)
+                yield pending
+            pending = node
+
+    stream = event_stream(root, children())
+    stream.prime()
+
+    return stream
+
 class generator(stream_component):
     """
     generator is the base class for all classes which are intended to be used as generator objects
@@ -46,3 +118,65 @@ class generator(stream_component):
         stream_component.__init__(self, parent, root_path="")
 
         self.description = "Generator base class"
+
+    def parse_document(self, path, content="xml"):
+        """
+        Returns a tuple of the parsed ElementTree of the file with the given path and a flag which is True
+        if the tree was taken from the sitemap's documents cache. Cached trees are shared by every request
+        so they must not be modified (or have nodes moved out of them); copy.deepcopy any part which is to
+        be returned, unless it is only given to a component whose reads_input_only property is True (see
+        component.next_sibling).
+
+        @path: the absolute path of the file
+        @content: the type of content in the file [xml|html]. Optional; xml is default
+        """
+
+        if self.sitemap is not None and self.sitemap.documents_cache is not None:
+            return (self.sitemap.documents_cache.parse(path, content), True)
+        else:
+            return (parse_file(path, content), False)
+
+    def set_reload_policy(self, reload_policy, interval, repeats):
+        """
+        Sets the options of the resource used by the generator (see get_resource).
+
+        @reload_policy: on what condition the resource should be reloaded;
+                        ['always', 'modified', 'wait', 'repeated', 'never']
+        @interval: the number of seconds after which the resource is reloaded under the 'wait' policy
+        @repeats: the number of times a result is used before the resource is reloaded under the
+                  'repeated' policy
+        """
+
+        if reload_policy not in RELOAD_POLICIES:
+            raise GeneratorError("%s: reload must be one of: %s" % (self.description, ", ".join(RELOAD_POLICIES)))
+
+        try:
+            self.reload_interval = float(interval)
+            self.reload_repeats = int(repeats)
+        except ValueError:
+            raise GeneratorError("%s: reload-interval and reload-repeats must be numbers" % self.description)
+
+        self.reload_policy = reload_policy
+        self.resource = None
+
+    def get_resource(self, rtype, src, query="", src_lock=None):
+        """
+        Returns the generator's resource, creating it with the generator's reload policy (see
+        set_reload_policy) and the sitemap's resource_store the first time it is needed.
+
+        @rtype: the type of resource; ['file', 'db', 'exec']
+        @src: the source for the resource (see resource.__init__)
+        @query: a query template needed to access the resource. Optional
+        @src_lock: the lock held while a 'db' resource uses its cursor (see resource.__init__). Optional
+        """
+
+        if self.resource is None:
+            if self.sitemap is not None:
+                store = self.sitemap.resource_store
+            else:
+                store = None
+
+            self.resource = resource(rtype, src, query, reload_policy=self.reload_policy, interval=self.reload_interval,
+                                     repeats=self.reload_repeats, store=store, src_lock=src_lock)
+
+        return self.resource
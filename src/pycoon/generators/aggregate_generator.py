@@ -6,7 +6,8 @@ This software is licensed under the terms of the GNU GPL.
 
 import pycoon.generators
 from pycoon.interpolation import interpolate
-from pycoon.components import invokation_syntax
+from pycoon.components import invokation_syntax, ComponentError, event_stream
+from pycoon.helpers import worker_pool_timeout
 import lxml.etree
 from StringIO import StringIO
 
@@ -21,7 +22,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["pipeline", "match", "select"]
     invk_syn.required_attribs = []
     invk_syn.required_attrib_values = {}
-    invk_syn.optional_attribs = ["root-node"]
+    invk_syn.optional_attribs = ["root-node", "parallel", "timeout"]
     invk_syn.allowed_child_components = ["generate", "select"]
 
     server.component_syntaxes[("aggregate", None)] = invk_syn
@@ -34,21 +35,118 @@ class aggregate_generator(pycoon.generators.generator):
 
     function = "aggregate"
     
-    def __init__(self, parent, root_node="aggregation", root_path=""):
+    def __init__(self, parent, root_node="aggregation", parallel="no", timeout=None, root_path=""):
         """
         aggregate_generator constructor.
 
         @root_node: the name of the root node of the aggregated document. Optional.
+        @parallel: if "yes", the child components are called concurrently (if the server uses parallel
+                   aggregates); their results are still aggregated in document order. Optional; "no" is
+                   default.
+        @timeout: the number of seconds to wait for each child component (or group of child components which
+                  use the same data source) when they are called concurrently, from when it starts. The first
+                  group is called in the request's own thread, so it isn't limited. Optional; the server's
+                  aggregate-timeout is default.
         """
 
         self.root_node = root_node
+        self.parallel = (parallel.lower() == "yes")
+        if timeout is not None:
+            try:
+                self.timeout = float(timeout)
+            except ValueError:
+                raise ComponentError("aggregate_generator: invalid timeout \"%s\"" % timeout)
+        else:
+            self.timeout = None
+
         pycoon.generators.generator.__init__(self, parent, root_path)
         self.description = "aggregate_generator(\"%s\")" % self.root_node
 
+    def worker_pool(self):
+        """
+        Returns the worker_pool in which the child components are called or None if they are called
+        one after another.
+        """
+
+        if self.parallel and self.sitemap is not None and len(self.children) > 1:
+            return self.sitemap.aggregate_pool
+        else:
+            return None
+
     def _descend(self, req, p_sibling_result=None):
-        return True
+        # the children of a parallel aggregate are called by _result
+        return self.worker_pool() is None
+
+    def child_groups(self):
+        """
+        Returns a list of lists of child components which are called one after another (in the same pool
+        thread), in document order. Children which use the same data source (see
+        component.data_sources) are in the same group, because a data source mustn't be used by two
+        threads at once; every other child is in a group of its own.
+        """
+
+        groups = []                    # list of (data source names, children) tuples
+        for comp in self.children:
+            names = comp.data_sources()
+            group = (names, [comp])
+            for other in [g for g in groups if len(g[0] & names) > 0]:
+                # this child joins every group which shares a data source with it
+                groups.remove(other)
+                group = (group[0] | other[0], other[1] + group[1])
+            groups.append(group)
+
+        return [[comp for comp in self.children if comp in children] for (names, children) in groups]
+
+    def call_children(self, comps, req, p_sibling_result):
+        """
+        Calls the given child components one after another (in a pool thread) and returns a list of
+        their (success, result) tuples, stopping at the first which fails. Event_stream results are read into trees in the same thread.
+        """
+
+        results = []
+        for comp in comps:
+            (success, result) = comp(req, p_sibling_result)
+            if success and isinstance(result, event_stream):
+                result = result.to_tree()
+
+            results.append((success, result))
+            if not success:
+                # the aggregate fails, so the rest of the group needn't be called
+                break
+
+        return results
 
     def _result(self, req, p_sibling_result=None, child_results=[]):
+        pool = self.worker_pool()
+        if pool is not None:
+            if self.timeout is not None:
+                timeout = self.timeout
+            else:
+                timeout = self.server.AGGREGATE_TIMEOUT
+
+            groups = self.child_groups()
+            try:
+                group_results = pool.map(self.call_children, [(comps, req, p_sibling_result) for comps in groups],
+                                         timeout)
+            except worker_pool_timeout, e:
+                raise pycoon.generators.GeneratorError("aggregate_generator: %s didn't finish within %s seconds" %\
+                                                       (", ".join([c.description for c in groups[e.position]]),
+                                                        timeout))
+
+            # put the results back in document order
+            results = {}
+            for (comps, comp_results) in zip(groups, group_results):
+                for (comp, result) in zip(comps, comp_results):
+                    results[comp] = result
+
+            child_results = []
+            for comp in self.children:
+                (success, result) = results[comp]
+                if success:
+                    child_results.append(result)
+                else:
+                    return (False, result)
+
         root = lxml.etree.Element(self.root_node)
 
         for c in child_results:
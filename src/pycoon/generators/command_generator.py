@@ -22,7 +22,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["pipeline", "aggregate", "match", "when", "otherwise"]
     invk_syn.required_attribs = ["type", "src"]
     invk_syn.required_attrib_values = {"type": "command"}
-    invk_syn.optional_attribs = []
+    invk_syn.optional_attribs = ["reload", "reload-interval", "reload-repeats"]
     invk_syn.allowed_child_components = ["parameter"]
 
     server.component_syntaxes[("generate", "command")] = invk_syn
@@ -34,16 +34,26 @@ class command_generator(generator):
     string. It implements the generator interface and can be used as a generator component in a pipeline.
     """
 
-    def __init__(self, parent, src, root_path=""):
+    def __init__(self, parent, src, reload="always", reload_interval="60", reload_repeats="10", root_path=""):
         """
         command_generator constructor. Requires 'pwd' (present working directory) and command string. Commands
         may use named string formatting to integrate request parameters when executed.
+
+        @reload: on what condition the command should be executed again for the same parameters rather
+                 than its stored output being used; ['always', 'modified', 'wait', 'repeated', 'never'].
+                 Optional; 'always' is default. 'modified' only watches the command's executable (e.g. a
+                 script), not the files it reads
+        @reload_interval: the number of seconds between executions under the 'wait' policy. Optional
+        @reload_repeats: the number of times the output is used before the command is executed again
+                         under the 'repeated' policy. Optional
         """
 
         self.command = src
         generator.__init__(self, parent, root_path)
         self.description = "command_generator(\"%s\")" % self.command
 
+        self.set_reload_policy(reload, reload_interval, reload_repeats)
+
     def _descend(self, req, p_sibling_result=None):
         return True
 
@@ -52,10 +62,13 @@ class command_generator(generator):
         Execute the command and parse the output stream as an lxml.etree.
         """
 
+        # the command's output may change at any time, so the response can't be cached
+        req.volatile = True
+
         try:
             parameters = self.parameter_children(child_results)
 
-            ostream = os.popen(self.command % parameters)
+            ostream = self.get_resource("exec", self.command)(**parameters)
         
             # for some reason it won't accept the ostream file object here,
             # so convert it to a StringIO instead
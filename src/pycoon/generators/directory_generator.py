@@ -45,11 +45,12 @@ class directory_generator(generator):
 
     def list_path(self, path):
         """
-        Begin listing the path, calls a recursive function.
+        Begin listing the path, calls a recursive function. Returns the listing as an Element object.
         """
 
-        self.dirlist = lxml.etree.Element("dirlist")
-        self.descend_path(path, self.dirlist)
+        dirlist = lxml.etree.Element("dirlist")
+        self.descend_path(path, dirlist)
+        return dirlist
 
     def descend_path(self, path, parent):
         """
@@ -83,11 +84,17 @@ class directory_generator(generator):
         Generate the directory list and return the result as an Element object.
         """
 
-        path = interpolate(self, self.path, as_filename=True, root_path=self.root_path)
+        path = interpolate(self, req, self.path, as_filename=True, root_path=self.root_path)
+        req.add_dependency(path)
         
         if os.stat(path):
-            self.list_path(path)
-            return (True, self.dirlist)
+            dirlist = self.list_path(path)
+
+            # the listing also depends on each of the directories it descended into
+            for d in dirlist.iter("d"):
+                req.add_dependency(d.attrib["name"])
+
+            return (True, dirlist)
         else:
             raise GeneratorError("directory_generator: path not found \"%s\"" % path)
             #return (False, apache.HTTP_NOT_FOUND)
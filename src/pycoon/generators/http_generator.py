@@ -10,8 +10,10 @@ retrieve using an HTTP request.
 from pycoon.generators import generator, GeneratorError
 from pycoon.interpolation import interpolate
 from pycoon.components import invokation_syntax
+from pycoon.resources import http_pool
+from pycoon.helpers import gzip_decompress
 import lxml.etree
-import httplib, urllib, urlparse
+import httplib, urllib, urlparse, socket, zlib
 from StringIO import StringIO
 
 def register_invokation_syntax(server):
@@ -57,37 +59,57 @@ class http_generator(generator):
     def _descend(self, req, p_sibling_result=None):
         return True
 
+    def connection_pool(self):
+        """
+        Returns the http_pool on which requests are made: the sitemap's (whose connections may be kept
+        open) or, for server pipelines, a new one whose connection is closed after the request.
+        """
+
+        if self.sitemap is not None and self.sitemap.http_pool is not None:
+            return self.sitemap.http_pool
+        else:
+            return http_pool(self.server.MAX_HTTP_CONNECTIONS, self.server.HTTP_CONNECT_TIMEOUT,
+                             self.server.HTTP_READ_TIMEOUT, self.server.HTTP_IDLE_TIMEOUT, keep_alive=False)
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         Attempts to retrieve XML from the URI and return an ElementTree representation of it.
         """
 
+        # the remote resource may change at any time, so the response can't be cached
+        req.volatile = True
+
         try:
-            uri = interpolate(self, self.src)
+            uri = interpolate(self, req, self.src)
             (protocol, host, path, p, q, f) = urlparse.urlparse(uri)
             
             parameters = urllib.urlencode(self.parameter_children(child_results)) + q
 
-            conn = httplib.HTTPConnection(host)
+            headers = {"Accept-Encoding": "gzip"}
 
             if self.method == "GET":
-                conn.request("GET", urlparse.urlunparse((protocol, host, path, p, parameters, f)))
-                response = conn.getresponse()
+                (response, data) = self.connection_pool().request(protocol, host, "GET",
+                                                                  urlparse.urlunparse((protocol, host, path, p, parameters, f)),
+                                                                  headers=headers)
             elif self.method == "POST":
-                conn.request("POST", urlparse.urlunparse((protocol, host, path, p, "", f)), parameters)
-                response = conn.getresponse()
+                (response, data) = self.connection_pool().request(protocol, host, "POST",
+                                                                  urlparse.urlunparse((protocol, host, path, p, "", f)),
+                                                                  parameters, headers)
 
             if response.status == 200:
+                if (response.getheader("Content-Encoding") or "").strip().lower() == "gzip":
+                    data = gzip_decompress(data)
+
                 if self.content == "xml":
-                    return (True, lxml.etree.parse(StringIO(response.read())).getroot())
+                    return (True, lxml.etree.parse(StringIO(data)).getroot())
                 elif self.content == "html":
-                    return (True, lxml.etree.parse(StringIO(response.read()), lxml.etree.HTMLParser()).getroot())
+                    return (True, lxml.etree.parse(StringIO(data), lxml.etree.HTMLParser()).getroot())
             else:
                 raise GeneratorError("http_generator: request \"%s\" returned error code: %s" % (uri, response.status))
 
-        except (httplib.HTTPException, httplib.socket.gaierror), e:
+        except (httplib.HTTPException, socket.error, zlib.error), e:
             raise GeneratorError("http_generator: exception occured during HTTP request: \"%s\"" % str(e))
         
         except lxml.etree.XMLSyntaxError, e:
             raise GeneratorError("http_generator: syntax error in XML source, \"%s\": \"%s\"" %\
-                                 (interpolate(self, self.src, as_filename=True, root_path=self.root_path), str(e)))
+                                 (interpolate(self, req, self.src, as_filename=True, root_path=self.root_path), str(e)))
@@ -51,6 +51,9 @@ class request_generator(generator):
         Reads the headers of the give request object and returns them in an Element object.
         """
 
+        # the result depends on every request header, so the response mustn't be cached
+        req.volatile = True
+
         headers_tree = lxml.etree.Element("request-headers")
 
         for name, value in req.headers_in.items():
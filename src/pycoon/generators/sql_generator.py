@@ -26,7 +26,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["pipeline", "aggregate", "match", "when", "otherwise"]
     invk_syn.required_attribs = ["type", "src", "query"]
     invk_syn.required_attrib_values = {"type": "sql"}
-    invk_syn.optional_attribs = ["template"]
+    invk_syn.optional_attribs = ["template", "reload", "reload-interval", "reload-repeats"]
     invk_syn.allowed_child_components = ["parameter"]
 
     server.component_syntaxes[("generate", "sql")] = invk_syn
@@ -59,34 +59,53 @@ class sql_generator(generator):
     sql_generator encapsulates an SQL query to be executed against the given SQL cursor.
     """
 
-    def __init__(self, parent, src, query, template="", root_path=""):
+    def __init__(self, parent, src, query, template="", reload="always", reload_interval="60", reload_repeats="10",
+                 root_path=""):
         """
         sql_generator constructor.
 
         @src: the name of a data source from the server_config.data_sources dictionary
         @query: file name of a SQL statement
         @template: file name of an XML template for the result. Optional [not implemented].
+        @reload: on what condition the query should be executed again for the same statement rather than
+                 its stored result being used; ['always', 'wait', 'repeated', 'never']. Optional; 'always'
+                 is default
+        @reload_interval: the number of seconds between executions under the 'wait' policy. Optional
+        @reload_repeats: the number of times the result is used before the query is executed again under
+                         the 'repeated' policy. Optional
         """
         
         self.datasource_name = src
         self.sql_filename = query
-        self.template_filename = template_filename
+        self.template_filename = template
         generator.__init__(self, parent, root_path)
-        self.description = "sql_generator(\"%s\", \"%s\")" % (self.db_name, self.sql_filename)
+        self.description = "sql_generator(\"%s\", \"%s\")" % (self.datasource_name, self.sql_filename)
+
+        if reload == "modified":
+            # there's no way to tell whether the database has been modified
+            raise GeneratorError("%s: the 'modified' reload policy can't be used with SQL queries" % self.description)
+        self.set_reload_policy(reload, reload_interval, reload_repeats)
 
     def _descend(self, req, p_sibling_result=None):
         return True
 
+    def data_sources(self):
+        return set([self.datasource_name])
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
+        # the database may change at any time, so the response can't be cached
+        req.volatile = True
+
         try:
-            sql_file = open(interpolate(self, self.sql_filename, as_filename=True, root_path=self.root_path), "r")
+            sql_file = open(interpolate(self, req, self.sql_filename, as_filename=True, root_path=self.root_path), "r")
             sql_str = sql_file.read()
             sql_file.close()
             
-            parameters = self.parameter_children(self.child_results)
+            parameters = self.parameter_children(child_results)
 
-            cursor = self.sitemap.data_sources[self.datasource_name]
-            cursor.execute(sql_str % parameters)
+            # the statement is a parameter of the resource so that each statement's result is stored separately
+            cursor = self.get_resource("db", self.sitemap.data_sources[self.datasource_name], "%(sql)s",
+                                       self.sitemap.data_source_lock(self.datasource_name))(sql=sql_str % parameters)
 
             result = lxml.etree.Element("result")
             result.attrib["query"] = sql_str
@@ -73,11 +73,17 @@ class swishe_generator(generator):
     def _descend(self, req, p_sibling_result=None):
         return True
 
+    def data_sources(self):
+        return set([self.datasource_name])
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         Perform the search and return an Element object.
         """
 
+        # the index may be rebuilt at any time, so the response can't be cached
+        req.volatile = True
+
         try:
             parameters = self.parameter_children(child_results)
 
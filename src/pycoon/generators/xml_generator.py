@@ -7,10 +7,11 @@ This module implements the xml (or file) generator which uses the content of an
 file to generate the source for a pipeline.
 """
 
-from pycoon.generators import generator, GeneratorError
+from pycoon.generators import generator, GeneratorError, iterparse_file
 from pycoon.interpolation import interpolate
 from pycoon.components import invokation_syntax
 import lxml.etree
+import copy
 
 def register_invokation_syntax(server):
     """
@@ -23,7 +24,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["pipeline", "aggregate", "match", "when", "otherwise"]
     invk_syn.required_attribs = ["type", "src"]
     invk_syn.required_attrib_values = {"type": "file"}
-    invk_syn.optional_attribs = ["content"]
+    invk_syn.optional_attribs = ["content", "stream"]
     invk_syn.allowed_child_components = []
 
     server.component_syntaxes[("generate", "file")] = invk_syn
@@ -34,16 +35,20 @@ class xml_generator(generator):
     xml_generator encapsulates an XML source file using the generator interface.
     """
 
-    def __init__(self, parent, src, content="xml", root_path=""):
+    def __init__(self, parent, src, content="xml", stream="no", root_path=""):
         """
         xml_generator constructor.
 
         @src: the source file path (can be a string to be interpolated upon requests).
         @content: the type of content in the source file [xml|html]. Optional; xml is default.
+        @stream: if "yes", the document is parsed incrementally as the pipeline reads it (see
+                 iterparse_file) rather than all at once, and it isn't kept in the documents cache.
+                 Optional; "no" is default.
         """
 
         self.src = src
         self.content = content.lower()
+        self.stream = (stream.lower() == "yes")
         
         generator.__init__(self, parent, root_path)
 
@@ -52,18 +57,37 @@ class xml_generator(generator):
     def _descend(self, req, p_sibling_result=None):
         return False
 
+    def warm_up(self):
+        """
+        Parses the source document into the documents cache if its path is constant.
+        """
+
+        path = self.constant_value(self.src, as_filename=True)
+        if path is not None and self.content in ["xml", "html"] and not self.stream and self.sitemap is not None\
+               and self.sitemap.documents_cache is not None:
+            self.sitemap.documents_cache.parse(path, self.content)
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         Returns an ElementTree representation of the XML document.
         """
 
         try:
-            path = interpolate(self, self.src, as_filename=True, root_path=self.root_path)
+            path = interpolate(self, req, self.src, as_filename=True, root_path=self.root_path)
+            req.add_dependency(path)
             
-            if self.content == "xml":
-                return (True, lxml.etree.parse(open(path, "r")).getroot())
-            elif self.content == "html":
-                return (True, lxml.etree.parse(open(path, "r"), lxml.etree.HTMLParser()).getroot())
+            if self.content in ["xml", "html"] and self.stream:
+                return (True, iterparse_file(path, self.content))
+
+            elif self.content in ["xml", "html"]:
+                (tree, shared) = self.parse_document(path, self.content)
+
+                # a shared tree is copied unless the next component only reads it
+                next_comp = self.next_sibling()
+                if shared and (next_comp is None or not next_comp.reads_input_only):
+                    return (True, copy.deepcopy(tree.getroot()))
+                else:
+                    return (True, tree.getroot())
             
         except (IOError, OSError):
             raise GeneratorError("xml_generator: source file not found \"%s\"" % path)
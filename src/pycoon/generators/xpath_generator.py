@@ -8,7 +8,7 @@ from pycoon.generators import generator, GeneratorError
 from pycoon.components import invokation_syntax
 from pycoon.interpolation import interpolate
 import lxml.etree
-import string
+import string, copy
 
 def register_invokation_syntax(server):
     """
@@ -47,34 +47,59 @@ class xpath_generator(generator):
 
         self.source_file = src
         self.xpath_expr = query
+        self.xpath = None  # the compiled XPath expression if it is constant (see warm_up)
         generator.__init__(self, parent, root_path)
         self.description = "xpath_generator(\"%s\", \"%s\")" % (self.source_file, self.xpath_expr)
 
     def _descend(self, req, p_sibling_result=None):
         return False
 
+    def warm_up(self):
+        """
+        Compiles the XPath expression if it is constant and parses the source document into the
+        documents cache if its path is constant.
+        """
+
+        expr = self.constant_value(self.xpath_expr)
+        if expr is not None:
+            self.xpath = lxml.etree.XPath(expr)
+
+        path = self.constant_value(self.source_file, as_filename=True)
+        if path is not None and self.sitemap is not None and self.sitemap.documents_cache is not None:
+            self.sitemap.documents_cache.parse(path)
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         Execute the XPath expression and return the results in an Element object.
         """
 
         try:
-            source_tree = lxml.etree.parse(open(interpolate(self, self.source_file, as_filename=True, root_path=self.root_path), 'r'))
-            xpath = interpolate(self, self.xpath_expr)
-            nodes = source_tree.xpath(xpath)
+            path = interpolate(self, req, self.source_file, as_filename=True, root_path=self.root_path)
+            req.add_dependency(path)
+            (source_tree, shared) = self.parse_document(path)
+            if self.xpath is not None:
+                xpath = self.xpath.path
+                nodes = self.xpath(source_tree)
+            else:
+                xpath = interpolate(self, req, self.xpath_expr)
+                nodes = source_tree.xpath(xpath)
 
             ret_tree = lxml.etree.Element("result")
 
+            # appending a node moves it out of its source tree, so the nodes of a shared tree are copied
             for n in nodes:
-                ret_tree.append(n)
+                if shared:
+                    ret_tree.append(copy.deepcopy(n))
+                else:
+                    ret_tree.append(n)
 
             return (True, ret_tree)
 
-        except OSError:
-            raise GeneratorError("xpath_generator: source file not found \"%s\"" % interpolate(self, self.source_file, as_filename=True, root_path=self.root_path))
+        except (IOError, OSError):
+            raise GeneratorError("xpath_generator: source file not found \"%s\"" % interpolate(self, req, self.source_file, as_filename=True, root_path=self.root_path))
             #return (False, apache.HTTP_NOT_FOUND)
         except lxml.etree.XMLSyntaxError, e:
             raise GeneratorError("xpath_generator: syntax error in XML source, \"%s\": \"%s\"" %\
-                                 (interpolate(self, self.source_file, as_filename=True, root_path=self.root_path), str(e)))
+                                 (interpolate(self, req, self.source_file, as_filename=True, root_path=self.root_path), str(e)))
         except lxml.etree.XPathSyntaxError:
             raise GeneratorError("xpath_generator: XPath syntax error: \"%s\"" % xpath)
@@ -81,13 +81,19 @@ class xquery_generator(generator):
     def _descend(self, req, p_sibling_result=None):
         return True
 
+    def data_sources(self):
+        return set([self.datasource_name])
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         Perform the xquery and return the result as an ElementTree.
         """
 
+        # the database may change at any time, so the response can't be cached
+        req.volatile = True
+
         try:
-            xq_file = open(interpolate(self, self.xq_filename, as_filename=True, root_path=self.root_path), "r")
+            xq_file = open(interpolate(self, req, self.xq_filename, as_filename=True, root_path=self.root_path), "r")
             xq_str = xq_file.read()
             xq_file.close()
 
@@ -7,7 +7,13 @@ The helpers module contains some general functions which are used in various par
 the Pycoon system.
 """
 
-import re, string, datetime
+import re, string, datetime, time, os, sys, zlib, threading, itertools
+
+try:
+    from multiprocessing.pool import ThreadPool
+except ImportError:
+    # worker_pool calls are made in the calling thread
+    ThreadPool = None
 from htmlentitydefs import entitydefs
 from xml.sax.handler import ContentHandler
 
@@ -20,6 +26,8 @@ class fake_apache:
         self.HTTP_INTERNAL_SERVER_ERROR = 500
         self.HTTP_NOT_FOUND = 404
         self.OK = 200
+        self.HTTP_OK = 200
+        self.HTTP_NOT_MODIFIED = 304
         self.DONE = 1000
         self.SERVER_RETURN = Exception
         self.URI_SCHEME=0
@@ -80,6 +88,38 @@ class fake_util(object):
         else:
             return 302
         
+class fake_request(object):
+    """
+    A pretend Apache request object for a GET request of the given URI which writes the response to the
+    given file-like object. It is used to execute pipelines outside of real requests (e.g. to warm up a
+    sitemap's caches).
+    """
+
+    def __init__(self, ostream, uri, server_hostname=""):
+        self.write = ostream.write
+
+        pos_qm = uri.find("?")
+        if pos_qm == -1: pos_qm = len(uri)
+        pos_hash = uri.find("#")
+        if pos_hash == -1: pos_hash = len(uri)
+
+        self.path = uri[:pos_qm]
+        self.query = uri[pos_qm+1:pos_hash]
+        self.fragment = uri[pos_hash+1:]
+
+        self.method = "GET"
+        self.uri = uri
+        self.unparsed_uri = uri
+        self.parsed_uri = ("context", "", "", "", server_hostname, 80, self.path, self.query, self.fragment)
+
+        self.headers_in = fake_table()
+        self.headers_out = fake_table()
+        self.content_type = None
+        self.status = 200
+
+    def set_content_length(self, l): pass
+    def sendfile(self, fn): pass
+
 class pycoon_sax_handler(ContentHandler):
     """
     Used as a base class for user-defined classes intented to be used with the sax_handler_transformer.
@@ -138,6 +178,34 @@ def uri_pattern2regex(pattern):
     # return a compiled regular expression object
     return re.compile(regex)
 
+# these characters end the literal prefix of a URI pattern: '*' is a wildcard and the rest are
+# not escaped by uri_pattern2regex so they keep their regular expression meanings ('|' is handled
+# separately, see uri_pattern_prefix)
+_prefix_end_chars = ["*", "^", "$", "\\"]
+
+def uri_pattern_prefix(pattern):
+    """
+    Returns the literal prefix of the given URI pattern string (i.e. the part before the first
+    wildcard) with any repeated '/' replaced by a single '/'. Any path matched by the pattern's
+    regular expression (see uri_pattern2regex) starts with this prefix once its own repeated '/'
+    have been collapsed. Returns None if the pattern contains a '|': uri_pattern2regex doesn't escape
+    it, so the pattern's regular expression has alternatives which needn't share any prefix.
+    """
+
+    if pattern.find("|") >= 0:
+        return None
+
+    if not pattern.startswith("/"):
+        pattern = "/" + pattern
+
+    end = len(pattern)
+    for c in _prefix_end_chars:
+        pos = pattern.find(c)
+        if pos >= 0 and pos < end:
+            end = pos
+
+    return re.sub("/{2,}", "/", pattern[:end])
+
 # this compiled regex is used by the strip_amps function
 _strip_amps_regex = re.compile("&(?!(#[0-9]*|" + string.join(entitydefs.keys(), "|") + "))")
 
@@ -181,6 +249,24 @@ def unescape_url(s):
 
     return find_hex_codes.sub(repl_hex_with_char, s)
 
+def normalize_uri(uri):
+    """
+    Returns the given URI with its query parameters sorted by name (parameters with the same name keep
+    their order), so that URIs which differ only in the order of their parameters have the same key in
+    the sitemap's caches.
+    """
+
+    pos = uri.find("?")
+    if pos < 0:
+        return uri
+
+    params = [p for p in uri[pos+1:].split("&") if len(p) > 0]
+    if len(params) == 0:
+        return uri
+
+    params.sort(key=lambda p: p.split("=", 1)[0])
+    return uri[:pos+1] + string.join(params, "&")
+
 class log_buffer:
     """
     log_buffer class just implements a write method which writes to standard error
@@ -195,6 +281,321 @@ class log_buffer:
         self.stream.write("[%s]: [\"%s\"] %s\n" % (str(datetime.datetime.today()), self.server_name, data))
         self.stream.flush()
 
+class result_chunks(object):
+    """
+    result_chunks holds a pipeline result as an iterator of byte string chunks which are produced as the
+    result is written (e.g. by the xml serializer), so that the whole result never has to be held in
+    memory. The iterator can only be used once.
+    """
+
+    def __init__(self, chunks):
+        """
+        result_chunks constructor.
+
+        @chunks: an iterable of byte strings
+        """
+
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def join(self):
+        """
+        Returns the whole result as one string, for when it has to be kept (e.g. in a cache).
+        """
+
+        return string.join(list(self.chunks), "")
+
+    def prefetch(self):
+        """
+        Produces the first chunk now, so that an error at the start of the result is raised before any
+        of it has been written.
+        """
+
+        chunks = iter(self.chunks)
+        try:
+            first = chunks.next()
+        except StopIteration:
+            self.chunks = []
+        else:
+            self.chunks = itertools.chain([first], chunks)
+
+def write_result(req, result, chunk_size=64 * 1024):
+    """
+    Writes the given pipeline result to the given request, setting the content length. If the result
+    is a file object (see the read component) it is written in chunks of chunk_size bytes and closed.
+    If it is a result_chunks, each chunk is written as it is produced; the content length isn't known
+    in advance, so Apache sends the response with chunked transfer coding.
+    """
+
+    if isinstance(result, file):
+        try:
+            req.set_content_length(os.fstat(result.fileno()).st_size)
+            data = result.read(chunk_size)
+            while data:
+                req.write(data)
+                data = result.read(chunk_size)
+        finally:
+            result.close()
+    elif isinstance(result, result_chunks):
+        for data in result:
+            req.write(data)
+    else:
+        req.set_content_length(len(result))
+        req.write(result)
+
+def accepted_encodings(accept_encoding):
+    """
+    Returns a dictionary of the quality values of the content codings in the given Accept-Encoding header
+    value (indexed by lower case coding name).
+    """
+
+    encodings = {}
+    for part in accept_encoding.split(","):
+        params = part.split(";")
+        name = params[0].strip().lower()
+        if len(name) == 0:
+            continue
+
+        q = 1.0
+        for param in params[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        encodings[name] = q
+
+    return encodings
+
+def choose_encoding(accept_encoding):
+    """
+    Returns the content coding ('gzip' or 'deflate') which should be used for a response to a request
+    with the given Accept-Encoding header value, or None if the response shouldn't be compressed. gzip
+    is preferred when the client accepts both equally.
+    """
+
+    encodings = accepted_encodings(accept_encoding)
+    best = None
+    best_q = 0.0
+    for name in ["gzip", "deflate"]:
+        q = encodings.get(name, encodings.get("*", 0.0))
+        if name == "gzip" and encodings.has_key("x-gzip"):
+            q = max(q, encodings["x-gzip"])
+        if q > best_q:
+            best = name
+            best_q = q
+
+    return best
+
+# these MIME types (and any text/*, */*+xml or */*+json types) are worth compressing
+_compressible_mimes = ["application/xml", "application/javascript", "application/x-javascript", "application/json"]
+
+def compressible_mime(mime):
+    """
+    Returns True if responses with the given MIME type should be compressed.
+    """
+
+    if mime is None:
+        return False
+
+    mime = mime.split(";")[0].strip().lower()
+    return mime.startswith("text/") or mime.endswith("+xml") or mime.endswith("+json") or mime in _compressible_mimes
+
+def gzip_compress(data, level=6):
+    """
+    Returns the given string compressed in the gzip format.
+    """
+
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+def compress_chunks(chunks, encoding, level=6):
+    """
+    Returns a result_chunks of the given result_chunks compressed in the given content coding ('gzip' or
+    'deflate') as its chunks are produced.
+    """
+
+    if encoding == "gzip":
+        wbits = 16 + zlib.MAX_WBITS
+    else:
+        wbits = zlib.MAX_WBITS
+
+    def compressed():
+        c = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        for data in chunks:
+            data = c.compress(data)
+            if data:
+                yield data
+        yield c.flush()
+
+    return result_chunks(compressed())
+
+class worker_pool_map(object):
+    """
+    worker_pool_map holds the state of one worker_pool.map: when each of its calls started and whether
+    the map has failed (in which case the calls which haven't started yet are skipped).
+    """
+
+    def __init__(self, count):
+        self.started = [None] * count  # the time at which each call started (or None if it hasn't)
+        self.failed = False
+
+class worker_pool(object):
+    """
+    worker_pool runs functions in a bounded pool of threads which is shared by concurrent requests. The
+    threads are started when the first function is run in each process (so that a pool made before the
+    server forks is still usable). A function which is run by a pool thread runs any functions it gives
+    the pool itself, so that nested calls can't wait for threads which are all waiting for them.
+    """
+
+    def __init__(self, max_threads):
+        """
+        worker_pool constructor.
+
+        @max_threads: the maximum number of threads in the pool
+        """
+
+        self.max_threads = max_threads
+
+        self.pool = None               # the ThreadPool of the current process
+        self.pid = None                # the process in which the ThreadPool was made
+        self.lock = threading.Lock()
+        self.local = threading.local() # holds the flag which marks the pool's threads
+
+    def get_pool(self):
+        """
+        Returns the current process's ThreadPool or None if functions must be run in the calling thread.
+        """
+
+        if ThreadPool is None or self.max_threads < 1 or getattr(self.local, "in_pool", False):
+            return None
+
+        self.lock.acquire()
+        try:
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = ThreadPool(self.max_threads)
+                self.pid = os.getpid()
+            return self.pool
+        finally:
+            self.lock.release()
+
+    def _call(self, func, args, m, i):
+        """
+        Makes call i of the given worker_pool_map (in a pool thread, or in the thread which made the map).
+        Returns a tuple of (True, result) or of (False, sys.exc_info()) so that the exception can be
+        raised again with its traceback, or None if the call was skipped because the map has failed.
+        """
+
+        if m.failed:
+            return None
+        m.started[i] = time.time()
+
+        self.local.in_pool = True
+        try:
+            try:
+                return (True, func(*args))
+            except:
+                return (False, sys.exc_info())
+        finally:
+            self.local.in_pool = False
+
+    def map(self, func, args_list, timeout=None):
+        """
+        Calls the given function with each of the given tuples of arguments concurrently and returns a
+        list of their results in the same order. The first call is made in the calling thread (while the
+        pool threads make the others). If a call raises an exception, it is raised again once the earlier
+        calls have finished. Raises worker_pool_timeout (with the position of the call) if a call hasn't
+        finished within timeout seconds of starting; the call is left to finish in its thread. Once the
+        map has failed, the calls which haven't started are skipped.
+
+        @func: a callable
+        @args_list: a list of argument tuples
+        @timeout: the maximum number of seconds to wait for each call made by a pool thread (time spent
+                  waiting for a free thread doesn't count). Optional; calls are waited for until they
+                  finish by default
+        """
+
+        pool = self.get_pool()
+        if pool is None or len(args_list) < 2:
+            return [func(*args) for args in args_list]
+
+        m = worker_pool_map(len(args_list))
+        pending = [pool.apply_async(self._call, (func, args_list[i], m, i)) for i in range(1, len(args_list))]
+
+        try:
+            results = []
+            (success, result) = self._call(func, args_list[0], m, 0)
+            for i in range(len(args_list)):
+                if i > 0:
+                    (success, result) = self._wait(pending[i - 1], m, i, timeout)
+
+                if success:
+                    results.append(result)
+                else:
+                    raise result[0], result[1], result[2]
+
+            return results
+        except:
+            m.failed = True
+            raise
+
+    def _wait(self, pending, m, i, timeout):
+        """
+        Waits for call i of the given worker_pool_map, whose pending result is given, to finish and
+        returns its (success, result) tuple. Raises worker_pool_timeout if it doesn't finish within
+        timeout seconds of starting.
+        """
+
+        if timeout is None:
+            # a (very long) timeout allows the wait to be interrupted
+            return pending.get(sys.maxint)
+
+        while True:
+            if m.started[i] is None:
+                # the call is waiting for a free thread
+                remaining = timeout
+            else:
+                remaining = m.started[i] + timeout - time.time()
+                if remaining <= 0 and not pending.ready():
+                    raise worker_pool_timeout(i)
+
+            pending.wait(max(0, remaining))
+            if pending.ready():
+                return pending.get()
+
+    def close(self):
+        """
+        Stops the pool's threads (any running functions are left to finish).
+        """
+
+        self.lock.acquire()
+        try:
+            if self.pool is not None and self.pid == os.getpid():
+                self.pool.terminate()
+            self.pool = None
+        finally:
+            self.lock.release()
+
+class worker_pool_timeout(Exception):
+    """
+    worker_pool_timeout is raised by worker_pool.map when a call doesn't finish in time. Its position
+    property is the position of the call in the list of arguments.
+    """
+
+    def __init__(self, position):
+        Exception.__init__(self, "call %d didn't finish in time" % position)
+        self.position = position
+
+def gzip_decompress(data):
+    """
+    Returns the given gzip compressed string decompressed.
+    """
+
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
 def attributes2options(attrs):
     """
     attributes2options turns the given xml.sax.Attributes into a dictionary. It is used to
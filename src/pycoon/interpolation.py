@@ -7,7 +7,7 @@ This module impelements the 'interpolation' mechanism which allows sitemap compo
 attributes to include a special syntax (denoted by {}) for parameterizing their values.
 """
 
-import string, re, os, traceback, urllib
+import string, re, os, traceback, urllib, inspect, threading
 from StringIO import StringIO
 from pycoon import apache
 from pycoon.helpers import strip_amps
@@ -20,6 +20,11 @@ class interpolation_syntax(object):
     in the interpolate function.
     """
 
+    # the prefix class property is the part of an instruction which identifies this syntax (i.e. the
+    # part before the first ':', or '$'); instructions are only passed to the syntax registered for their
+    # prefix. If it is None, the syntax is tried for every instruction
+    prefix = None
+
     def __init__(self, pattern, component=None):
         """
         interpolation_syntax constructor.
@@ -34,38 +39,128 @@ class interpolation_syntax(object):
 
     def _match(self, instruction):
         """
-        test the given instruction against the object's pattern and return True if it matches or
-        False if it doesn't.
+        test the given instruction against the object's pattern and return the match object if it
+        matches or None if it doesn't. (interpolation_syntax objects are shared by every request, so
+        the match is not stored.)
         """
 
-        self.instruction = instruction
-        self.match_obj = self.pattern.match(instruction)
-        return self.match_obj != None
+        return self.pattern.match(instruction)
 
-    def __call__(self, instruction, uri_matcher, context):
+    def __call__(self, instruction, uri_match, context, req):
         """
         implements the 'action' of this interpolation syntax. Should return a tuple: first member
         is result of self._match, second is either interpolated string or None.
 
         @instruction: is the syntax to be interpolated
-        @uri_matcher: a uri_matcher instance for the request that is being processed
+        @uri_match: the uri_match of the uri_matcher (or error_matcher) for the request that is being processed
         @context: a sitemap_config or server_config instance
+        @req: the request_context of the request that is being processed
         """
 
         raise NotImplemented()
 
-def register_interpolation_syntax(server, syntax, name):
+class legacy_interpolation_syntax(object):
+    """
+    legacy_interpolation_syntax adapts an interpolation syntax written for the old interface, whose
+    __call__ method takes (instruction, uri_matcher, context), to the current one. A uri_match has the
+    same URI attributes as the uri_matcher used to have. The old _match method also left the instruction
+    and its match object on the syntax object, so the adaptor sets them before each call (holding a lock,
+    because syntax objects are shared by every request).
+    """
+
+    def __init__(self, syntax):
+        """
+        legacy_interpolation_syntax constructor.
+
+        @syntax: the old-style interpolation_syntax instance
+        """
+
+        self.syntax = syntax
+        self.prefix = getattr(syntax, "prefix", None)
+        self.lock = threading.Lock()
+
+    def _match(self, instruction):
+        return self.syntax.pattern.match(instruction)
+
+    def __call__(self, instruction, uri_match, context, req):
+        self.lock.acquire()
+        try:
+            self.syntax.instruction = instruction
+            self.syntax.match_obj = self.syntax.pattern.match(instruction)
+            return self.syntax(instruction, uri_match, context)
+        finally:
+            self.lock.release()
+
+def is_legacy_interpolation_syntax(syntax):
+    """
+    Returns True if the given interpolation syntax's __call__ method has the old signature
+    (instruction, uri_matcher, context), without the req argument.
+    """
+
+    try:
+        (args, varargs, varkw, defaults) = inspect.getargspec(syntax.__call__)
+    except TypeError:
+        return False
+
+    # the arguments include self
+    return varargs is None and len(args) == 4
+
+def register_interpolation_syntax(server, syntax, name, prefix=None):
     """
     Used to add an interpolation_syntax object to the server's interpolation_syntax
-    dictionary.
+    dictionary and to index it by its instruction prefix. Syntaxes written for the old
+    __call__(instruction, uri_matcher, context) interface are wrapped in a
+    legacy_interpolation_syntax.
 
     @server: the server_config instance
     @syntax: the interpolation_syntax instance
     @name: a unique name for the interpolation syntax
+    @prefix: the instruction prefix handled by the syntax. Optional; uses syntax.prefix by default
     """
     
-    if name not in server.interpolation_syntaxes.keys():
-        server.interpolation_syntaxes[name] = syntax
+    if name in server.interpolation_syntaxes.keys():
+        return
+
+    if is_legacy_interpolation_syntax(syntax):
+        syntax = legacy_interpolation_syntax(syntax)
+
+    if prefix is None:
+        prefix = syntax.prefix
+
+    if prefix is None:
+        server.unprefixed_interpolation_syntaxes.append(syntax)
+    elif server.interpolation_prefixes.has_key(prefix):
+        raise InterpolationException("Interpolation syntax \"%s\" conflicts with an existing syntax for the prefix \"%s\"" % (name, prefix))
+    else:
+        server.interpolation_prefixes[prefix] = syntax
+
+    server.interpolation_syntaxes[name] = syntax
+
+def instruction_prefix(instruction):
+    """
+    Returns the prefix of the given interpolation instruction (without its {} delimiters): '$' for
+    pattern match numbers or the part before the first ':'.
+    """
+
+    if instruction.startswith("$"):
+        return "$"
+    else:
+        return instruction.split(":", 1)[0]
+
+def find_interpolation_syntaxes(server, instruction):
+    """
+    Returns the list of interpolation_syntax objects which may handle the given instruction: the
+    syntax registered for its prefix (if there is one) followed by the syntaxes with no prefix.
+
+    @server: the server_config instance
+    @instruction: an interpolation instruction (without its {} delimiters)
+    """
+
+    syntax = server.interpolation_prefixes.get(instruction_prefix(instruction))
+    if syntax is not None:
+        return [syntax] + server.unprefixed_interpolation_syntaxes
+    else:
+        return list(server.unprefixed_interpolation_syntaxes)
 
 # define the basic interpolation syntax elements:
 class interpolate_pattern_match_number(interpolation_syntax):
@@ -73,14 +168,16 @@ class interpolate_pattern_match_number(interpolation_syntax):
     interpolate_pattern_match_number interprets the '{$n}' syntax, where the number
     'n' is the n'th '*' denoted portion of the URI.
     """
+
+    prefix = "$"
     
     def __init__(self):
         interpolation_syntax.__init__(self, "^\$[0-9]+$")
     
-    def __call__(self, instruction, uri_matcher, context):
+    def __call__(self, instruction, uri_match, context, req):
         if self._match(instruction):
             try:
-                return (True, uri_matcher.match_obj.group(int(instruction.replace("$", ""))))
+                return (True, uri_match.match_obj.group(int(instruction.replace("$", ""))))
             except IndexError:
                 return (False, None)
         else:
@@ -98,11 +195,13 @@ class interpolate_uri(interpolation_syntax):
     {uri:query:name} : returns the value of the query string parameter named 'name'
     {uri:fragment} : returns the fragment portion of the URI
     """
+
+    prefix = "uri"
     
     def __init__(self):
         interpolation_syntax.__init__(self, "^uri:?.*$")
 
-    def __call__(self, instruction, uri_matcher, context):
+    def __call__(self, instruction, uri_match, context, req):
         if self._match(instruction):
             try:
                 # first, split the instruction up on ':'s
@@ -111,7 +210,7 @@ class interpolate_uri(interpolation_syntax):
                 # if its just 'uri'
                 if instruction == "uri":
                     # then return the whole uri
-                    return (True, uri_matcher.uri)
+                    return (True, uri_match.uri)
 
                 # if its 'uri:path'
                 elif uri_comps[1] == "path":
@@ -119,29 +218,29 @@ class interpolate_uri(interpolation_syntax):
                     if len(uri_comps) >= 3:
                         # then return the numbered part of the path
                         # (where 0 is the left-most part)
-                        return (True, string.split(uri_matcher.path, "/")[int(uri_comps[2])])
+                        return (True, string.split(uri_match.path, "/")[int(uri_comps[2])])
                     else:
                         # if there's no argument, then return the whole path
                         # but using OS sepcific separators so that it can be a local filename
-                        return (True, uri_matcher.path)
+                        return (True, uri_match.path)
 
                 # if its 'uri:filename' then return the filename portion of the uri
                 elif uri_comps[1] == "filename":
-                    return (True, uri_matcher.filename)
+                    return (True, uri_match.filename)
 
                 # if its 'uri:query'
                 elif uri_comps[1] == "query":
                     # and if there's a named query element:
                     if len(uri_comps) >= 3:
                         # then return the value of that query element
-                        return (True, uri_matcher.query_dict[uri_comps[2]])
+                        return (True, uri_match.query_dict[uri_comps[2]])
                     else:
                         # otherwise, format and return the whole query string
-                        return (True, "?" + uri_matcher.query)
+                        return (True, "?" + uri_match.query)
 
                 # if its 'uri:fragment' then return the fragment portion of the uri
                 elif uri_comps[1] == "fragment":
-                    return (True, uri_matcher.fragment)
+                    return (True, uri_match.fragment)
             except IndexError:
                 # do I need to catch these?
                 return (False, None)
@@ -154,11 +253,13 @@ class interpolate_context(interpolation_syntax):
     handled by the sitemap and its result will be returned. (However, note that 'nested' interpolation
     is not supported.)
     """
+
+    prefix = "context"
     
     def __init__(self):
         interpolation_syntax.__init__(self, "^context:.+$")
 
-    def __call__(self, instruction, uri_matcher, context):
+    def __call__(self, instruction, uri_match, context, req):
         if self._match(instruction):
             try:
                 # split the instruction on :'s
@@ -189,16 +290,17 @@ class interpolate_traceback(interpolation_syntax):
     """
     interpolate_traceback interprets the '{traceback}' syntax and returns the current traceback as a string.
     """
+
+    prefix = "traceback"
     
     def __init__(self):
         interpolation_syntax.__init__(self, "^traceback$")
 
-    def __call__(self, instruction, uri_matcher, context):
+    def __call__(self, instruction, uri_match, context, req):
         if self._match(instruction):
-            try:
-                exc = context.server.EXCEPTION
-            except AttributeError:
-                exc = context.EXCEPTION
+            exc = req.exception
+            if exc is None:
+                return (True, "")
                 
             tb = strip_amps(string.join(traceback.format_exception(*exc)))
             return (True, tb.replace("'", "\""))
@@ -208,82 +310,138 @@ class interpolate_traceback(interpolation_syntax):
 # this regex is used to extract the interpolation instructions from a string
 _find_instructions = re.compile("\{[^}]+\}")
 
-def interpolate(component, string_arg, as_filename=False, root_path=""):
+class interpolation_template(object):
     """
-    parses the string_arg argument using the current request uri to interpolate the special {} delimited
-    parts of string_arg with values from the uri. Returns a string.
-
-    @component: the component which has called this function
-    @string_arg: the attribute value to be processed (should contain {} delimited syntax)
-    @as_filename: if True, the result will be an absolute path name. Optional
-    @root_path: use to specify a path root other than the sitemap's document root. Optional
+    interpolation_template is the compiled form of a string which may contain {} delimited interpolation
+    instructions. The string is split up once (when the component which owns it is created) into literal
+    pieces and instructions; each instruction is bound to the interpolation_syntax objects whose patterns
+    match it (see find_interpolation_syntaxes), so that interpolating the string for a request only has to
+    call those syntaxes.
     """
 
-    # first attempt to find an active uri_matcher instance in the pipeline hierarchy
-    uri_matcher = None
-    p = component.parent
-    while p is not None:
-        if p.__class__.__name__ in ["uri_matcher", "error_matcher"]:
-            uri_matcher = p
-            break
-        try:
-            p = p.parent
-        except AttributeError:
-            p = None
-            break
-    if uri_matcher is None:
-        raise InterpolationException("interpolate called by component, \"%s\", with no uri_matcher or error_matcher instance in pipeline"
-                                     % component.description)
-        
-    if as_filename:
-        if root_path == "": root_path = component.context.document_root
-        # if its supposed to be a filename, then start the return string with the given root_path
-        return_string = root_path + os.sep
-    else:
-        # otherwise, just create an empty return string
-        return_string = ""
+    def __init__(self, component, string_arg):
+        """
+        interpolation_template constructor.
 
-    # retrieve the available interpolation syntax objects from the server_config
-    if component.context.__class__.__name__ == "sitemap_config":
-        i_syntaxes = component.context.server.interpolation_syntaxes.values()
-    elif component.context.__class__.__name__ == "server_config":
-        i_syntaxes = component.context.interpolation_syntaxes.values()
+        @component: the component to which the string belongs
+        @string_arg: the string to be compiled
+        """
 
-    # first insert the characters up to the first interpolation instruction (could be the whole string):
+        self.string_arg = string_arg
+        self.context = component.context
+        self.description = component.description
+
+        # find the active uri_matcher instance in the pipeline hierarchy (if there is one)
+        self.uri_matcher = None
+        p = component.parent
+        while p is not None:
+            if p.__class__.__name__ in ["uri_matcher", "error_matcher"]:
+                self.uri_matcher = p
+                break
+            try:
+                p = p.parent
+            except AttributeError:
+                p = None
+                break
+
+        # the interpolation syntax objects are registered with the server_config
+        if self.context.__class__.__name__ == "sitemap_config":
+            server = self.context.server
+        elif self.context.__class__.__name__ == "server_config":
+            server = self.context
+
+        # a list of literal strings and (instruction, list of interpolation_syntax objects) tuples
+        self.pieces = []
+
+        if string_arg.find("{") == -1:
+            # there are no interpolation instructions so the string is a constant
+            self.constant = True
+            self.pieces.append(string_arg)
+        else:
+            self.constant = False
 
-    last_pos = string_arg.find("{")
+            start_pos = 0
+            for instruction in _find_instructions.finditer(string_arg):
+                if instruction.start() > start_pos:
+                    self.pieces.append(string_arg[start_pos:instruction.start()])
 
-    if last_pos == -1:
-        # in this case there are no interpolation instructions in the string so just use all of string_arg
-        return_string += string_arg
+                i = instruction.group()[1:-1]
+                self.pieces.append((i, [syntax for syntax in find_interpolation_syntaxes(server, i) if syntax._match(i)]))
 
-    else:
-        # in this case there are some interpolation instructions
+                start_pos = instruction.end()
 
-        start_pos = 0
-        
-        # iterate over the interpolation instructions in the string_arg
-        for instruction in _find_instructions.finditer(string_arg):
-            last_pos = instruction.start()# - 1
-            if last_pos < 0: last_pos = 0
+            if start_pos < len(string_arg):
+                self.pieces.append(string_arg[start_pos:])
+
+        # the results of a constant template don't depend on the request, so they are kept here
+        # (indexed by (as_filename, root_path))
+        self.results = {}
+
+    def __call__(self, req, as_filename=False, root_path=""):
+        """
+        Returns the string interpolated for the given request.
+
+        @req: the request_context of the current request
+        @as_filename: if True, the result will be an absolute path name. Optional
+        @root_path: use to specify a path root other than the sitemap's document root. Optional
+        """
 
-            # first, add the characters between the previous instruction and this one to the return_string
-            return_string += string_arg[start_pos:last_pos]
+        if self.uri_matcher is None:
+            raise InterpolationException("interpolate called by component, \"%s\", with no uri_matcher or error_matcher instance in pipeline"
+                                         % self.description)
 
-            # then iterate over the interpolation syntax objects until one matches
-            for i in i_syntaxes:
-                (success, result) = i(instruction.group()[1:-1], uri_matcher, component.context)
+        if self.constant:
+            try:
+                return self.results[(as_filename, root_path)]
+            except KeyError:
+                result = self._format(self.string_arg, as_filename, root_path)
+                self.results[(as_filename, root_path)] = result
+                return result
 
-                if success:
-                    return_string += result
-                    break
+        uri_match = self.uri_matcher.match(req)
 
-            start_pos = instruction.end()
+        return_string = ""
+        for piece in self.pieces:
+            if isinstance(piece, tuple):
+                # try each of the instruction's interpolation syntax objects until one succeeds
+                (instruction, i_syntaxes) = piece
+                for i in i_syntaxes:
+                    (success, result) = i(instruction, uri_match, self.context, req)
+
+                    if success:
+                        return_string += result
+                        break
+            else:
+                return_string += piece
+
+        return self._format(return_string, as_filename, root_path)
+
+    def _format(self, s, as_filename, root_path):
+        if as_filename:
+            # if its supposed to be a filename, then start the return string with the given root_path
+            if root_path == "": root_path = self.context.document_root
+            return urllib.pathname2url(root_path + os.sep + s)
+        else:
+            return s
 
-        return_string += string_arg[start_pos:]
+def interpolate(component, req, string_arg, as_filename=False, root_path=""):
+    """
+    parses the string_arg argument using the current request uri to interpolate the special {} delimited
+    parts of string_arg with values from the uri. Returns a string.
+
+    The component's attribute strings are compiled into interpolation_template objects when the component
+    is created (see server_config.get_new_component); any other string is compiled here.
+
+    @component: the component which has called this function
+    @req: the request_context of the current request
+    @string_arg: the attribute value to be processed (should contain {} delimited syntax)
+    @as_filename: if True, the result will be an absolute path name. Optional
+    @root_path: use to specify a path root other than the sitemap's document root. Optional
+    """
 
-    if as_filename:# and os.name == "nt":
-        return_string = urllib.pathname2url(return_string)
+    try:
+        template = component.templates[string_arg]
+    except KeyError:
+        template = interpolation_template(component, string_arg)
 
-    # return the completed return string
-    return return_string
+    return template(req, as_filename, root_path)
@@ -7,6 +7,7 @@ The matchers module provides the matcher class which is the base class of all
 matcher classes.
 """
 
+from pycoon import apache
 from pycoon.components import syntax_component, invokation_syntax, ComponentError
 
 class MatcherError(ComponentError): pass
@@ -28,6 +29,77 @@ def register_invokation_syntax(server):
     server.component_syntaxes[("match", None)] = invk_syn
     return invk_syn
 
+def parse_query(query):
+    """
+    Returns a dictionary of the name/value pairs in the given query string.
+    """
+
+    query_dict = {}
+    if query != None:
+        for q in query.split("&"):
+            if q.find("=") >= 0:
+                (name, value) = q.split("=", 1)
+            else:
+                name = q
+                value = ""
+            query_dict[name] = value
+
+    return query_dict
+
+class uri_match(object):
+    """
+    uri_match holds the result of matching a request against a matcher component: whether the request
+    matched, the regular expression match object (used by the '{$n}' interpolation syntax) and the
+    constituent parts of the request URI. Matchers compute one uri_match per request and then use it for
+    descent, continuation and interpolation.
+    """
+
+    def __init__(self, req, matched=False, match_obj=None):
+        """
+        uri_match constructor. The URI is only parsed if the request matched.
+
+        @req: a request_context
+        @matched: True if the request matched
+        @match_obj: the regular expression match object of the matcher's pattern (if it has one)
+        """
+
+        self.status = req.status
+        self.matched = matched
+        self.match_obj = match_obj
+
+        self.uri = None
+        self.path = None
+        self.filename = None
+        self.query = None
+        self.query_dict = {}
+        self.fragment = None
+
+        if self.matched:
+            self.parse_uri(req)
+
+    def parse_uri(self, req):
+        """
+        Parses the request URI into its constituent parts.
+        """
+
+        self.uri = req.unparsed_uri
+
+        # store the path portion of the URI
+        path = req.parsed_uri[apache.URI_PATH]
+        self.path = path[:path.rfind("/")]
+
+        # store the filename portion of the URI
+        self.filename = path[path.rfind("/"):]
+
+        # store the query portion of the URI as a string
+        self.query = req.parsed_uri[apache.URI_QUERY]
+
+        # and as a dictionary
+        self.query_dict = parse_query(self.query)
+
+        # store the fragment portion of the URI
+        self.fragment = req.parsed_uri[apache.URI_FRAGMENT]
+
 class matcher(syntax_component):
     """
     matcher is the base class for all classes which are intended to be used as matcher objects
@@ -45,3 +117,38 @@ class matcher(syntax_component):
         syntax_component.__init__(self, parent, root_path="")
 
         self.description = "Matcher base class"
+
+    def match(self, req):
+        """
+        Returns this matcher's uri_match for the given request. It is only computed (by the _match method)
+        the first time it is asked for and is kept in the request_context.
+        """
+
+        m = req.matches.get(self)
+        if m is None:
+            m = req.matches[self] = self._match(req)
+
+        return m
+
+    def _match(self, req):
+        """
+        Given the current request, the matcher should return a uri_match indicating whether or not
+        it matches.
+        """
+
+        raise NotImplemented()
+
+    def _descend(self, req, p_sibling_result=None, child_results=[]):
+        """
+        Matchers allow their child components to execute if they match the request.
+        """
+
+        return self.match(req).matched
+
+    def _continue(self, req, p_sibling_result=None):
+        """
+        If this matcher matches the request, then don't allow following siblings to execute
+        (i.e. return False).
+        """
+
+        return not self.match(req).matched
@@ -7,7 +7,7 @@ This module provides the error_matcher class which allows pipeline execution to
 conditional on Apache error codes.
 """
 
-from pycoon.matchers import matcher, MatcherError
+from pycoon.matchers import matcher, uri_match, MatcherError
 from pycoon import apache
 from pycoon.interpolation import interpolate
 from pycoon.components import invokation_syntax
@@ -43,57 +43,27 @@ class error_matcher(matcher):
 
         self.description = "error_matcher(\"%s\")" % self.error_code
 
-    def parse_uri(self, req):
+    def match(self, req):
         """
-        Parses the request URI into its constituent parts and stores them for later use.
+        Returns this matcher's uri_match for the given request. The same request object is given to
+        the error handlers after its status has been set, so the uri_match is recomputed if the status
+        has changed.
         """
-        
-        self.req = req
-        self.uri = req.unparsed_uri
 
-        # store the path portion of the URI
-        path = self.req.parsed_uri[apache.URI_PATH]
-        self.path = path[:path.rfind("/")]
+        m = req.matches.get(self)
+        if m is None or m.status != req.status:
+            m = req.matches[self] = self._match(req)
 
-        # store the filename portion of the URI
-        self.filename = path[path.rfind("/"):]
-        
-        # store the query portion of the URI as a string
-        self.query = self.req.parsed_uri[apache.URI_QUERY]
-        
-        # and as a dictionary
-        self.query_dict = {}
-        if self.query != None:
-            for q in self.query.split("&"):
-                if q.find("=") >= 0:
-                    (name, value) = q.split("=")
-                else:
-                    name = q
-                    value = ""
-                self.query_dict[name] = value
-
-        # store the fragment portion of the URI
-        self.fragment = self.req.parsed_uri[apache.URI_FRAGMENT]
-
-    def _descend(self, req, p_sibing_result=None, child_results=[]):
-        """
-        Examines the req object's status property to determine which error code is being handled.
+        return m
 
-        The error_matcher also needs to provide information about the request URI, so it
-        repeats code from uri_matcher.
+    def _match(self, req):
         """
+        Examines the req object's status property to determine which error code is being handled. If
+        it is this matcher's error code, the matcher matches and none of the following sibling components
+        are executed.
 
-        if str(req.status) == str(self.error_code):
-            self.parse_uri(req)
-
-            return True
-        else:
-            return False
-
-    def _continue(self, req, p_sibling_result=None):
-        """
-        If the given req object's status is this matcher's error code, return False so that
-        none of the following sibling component's are executed.
+        The error_matcher also needs to provide information about the request URI, so its uri_match
+        includes the parts of the URI when it matches.
         """
-        
-        return str(req.status) != str(self.error_code)
+
+        return uri_match(req, str(req.status) == str(self.error_code))
@@ -8,11 +8,11 @@ requests made by a number of automated or common Web tools such as favicon.ico a
 robots.txt.
 """
 
-from pycoon.matchers import matcher, MatcherError
+from pycoon.matchers import matcher, uri_match, MatcherError
 from pycoon import apache
 from pycoon.interpolation import interpolate
 from pycoon.components import invokation_syntax
-from pycoon.helpers import uri_pattern2regex
+from pycoon.helpers import uri_pattern2regex, uri_pattern_prefix
 import re
 
 def register_invokation_syntax(server):
@@ -57,84 +57,76 @@ class special_matcher(matcher):
         
         self.object = object
 
+        # special objects may be requested with or without a query string
+        self.allow_query = True
+        self.required_parameters = None
+
         self.regex = uri_pattern2regex(object_uri_patterns(self.object))
-        self.match_obj = None
         
         matcher.__init__(self, parent, root_path="")
 
         self.description = "special_matcher(\"%s\")" % self.object
 
-    def parse_uri(self, req):
+    def _match(self, req):
         """
-        Parses the request URI into its constituent parts and stores them for later use. Returns
-        True if the request uri matches this object's pattern, returns False otherwise.
+        Matches the request URI against this object's pattern and returns the resulting uri_match.
         """
-        
-        self.req = req
 
         if not self.allow_query:
-            if self.req.parsed_uri[apache.URI_QUERY]:
-                self.match_obj = None
-                return False
+            if req.parsed_uri[apache.URI_QUERY]:
+                return uri_match(req)
             else:
-                self.match_obj = self.regex.match(req.parsed_uri[apache.URI_PATH])
+                match_obj = self.match_path(req)
         else:
             if self.regex.pattern.find("?") >= 0:
-                self.match_obj = self.regex.match(req.unparsed_uri)
+                match_obj = self.regex.match(req.unparsed_uri)
             else:
-                self.match_obj = self.regex.match(req.parsed_uri[apache.URI_PATH])
-
-        if self.match_obj != None:
-            self.uri = req.unparsed_uri
-            
-            # store the path portion of the URI
-            path = self.req.parsed_uri[apache.URI_PATH]
-            self.path = path[:path.rfind("/")]
-
-            # store the filename portion of the URI
-            self.filename = path[path.rfind("/"):]
-            
-            # store the query portion of the URI as a string
-            self.query = self.req.parsed_uri[apache.URI_QUERY]
-
-            # and as a dictionary
-            self.query_dict = {}
-            if self.query != None:
-                for q in self.query.split("&"):
-                    if q.find("=") >= 0:
-                        (name, value) = q.split("=")
-                    else:
-                        name = q
-                        value = ""
-                    self.query_dict[name] = value
-
-            # check whether the required parameters have been given
-            if self.allow_query and self.required_parameters is not None:
-                if len(self.query_dict) > 0:
-                    if len(set(self.required_parameters) - set(self.query_dict.keys())) > 0:
-                        return False
-                else:
-                    return False
-
-            # store the fragment portion of the URI
-            self.fragment = self.req.parsed_uri[apache.URI_FRAGMENT]
-            
-            return True
-        else:
-            return False
+                match_obj = self.match_path(req)
+
+        if match_obj is None:
+            return uri_match(req)
+
+        m = uri_match(req, True, match_obj)
+
+        # check whether the required parameters have been given
+        if self.allow_query and self.required_parameters is not None:
+            if len(m.query_dict) > 0:
+                if len(set(self.required_parameters) - set(m.query_dict.keys())) > 0:
+                    return uri_match(req)
+            else:
+                return uri_match(req)
 
-    def _descend(self, req, p_sibing_result=None, child_results=[]):
+        return m
+
+    def dispatch_prefix(self):
         """
-        Compare the given request object's URI against this pattern. Returns True
-        (i.e. allows descent) if it matches.
+        Returns the literal prefix of this matcher's pattern for use in the sitemap's uri_dispatch_index,
+        or None if its pattern has alternatives (see uri_pattern_prefix).
         """
 
-        return self.parse_uri(req)
+        return uri_pattern_prefix(object_uri_patterns(self.object))
 
-    def _continue(self, req, p_sibling_result=None):
+    def match_path(self, req):
         """
-        If this matcher matches the given request uri, then don't allow following siblings to execute
-        (i.e. return False).
+        Returns the match object of this matcher's regular expression against the path of the given
+        request. If the sitemap's uri_dispatch_regex has already matched the path to this matcher,
+        its match is used instead of matching again.
         """
 
-        return not self.parse_uri(req)
+        match_obj = req.dispatch_matches.get(self)
+        if match_obj is not None:
+            return match_obj
+
+        return self.regex.match(req.parsed_uri[apache.URI_PATH])
+
+    def dispatch_regex(self):
+        """
+        Returns this matcher's regular expression for use in the sitemap's uri_dispatch_regex, or
+        None if the matcher doesn't match against the request path (i.e. when it matches against
+        the whole unparsed URI).
+        """
+
+        if self.allow_query and self.regex.pattern.find("?") >= 0:
+            return None
+
+        return self.regex
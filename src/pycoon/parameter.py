@@ -58,4 +58,4 @@ class parameter(syntax_component):
         interpolated value.
         """
 
-        return (True, {interpolate(self, self.param_name): interpolate(self, self.param_value)})
+        return (True, {interpolate(self, req, self.param_name): interpolate(self, req, self.param_value)})
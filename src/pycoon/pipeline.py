@@ -6,11 +6,17 @@ This software is licensed under the terms of the GNU GPL.
 The pipeline module contains the pipeline class.
 """
 
-import sys, string, traceback
+import sys, string, traceback, threading
+from StringIO import StringIO
 import lxml.etree
 from pycoon import apache
 from pycoon.interpolation import interpolate
-from pycoon.components import component, invokation_syntax
+from pycoon.components import component, invokation_syntax, ComponentError
+from pycoon.request_context import get_request_context
+from pycoon.cache import cached_response, lru_cache
+from pycoon.helpers import fake_request, result_chunks
+
+class PipelineError(ComponentError): pass
 
 def register_invokation_syntax(server):
     """
@@ -23,7 +29,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["sitemap", "server"]
     invk_syn.required_attribs = []
     invk_syn.required_attrib_values = {}
-    invk_syn.optional_attribs = []
+    invk_syn.optional_attribs = ["cache-as", "max-age", "stale-while-revalidate", "stale-if-error"]
     invk_syn.allowed_child_components = ["match"]
 
     server.component_syntaxes[("component", "pipeline")] = invk_syn
@@ -45,6 +51,10 @@ def build_pipeline(server, sitemap, attrs, **kw_args):
     if attrs.has_key('cache-as'):
         pl_opts['cache_as'] = str(attrs['cache-as'])
 
+    for name in ['max-age', 'stale-while-revalidate', 'stale-if-error']:
+        if attrs.has_key(name):
+            pl_opts[name.replace("-", "_")] = str(attrs[name])
+
     # determine the parent type and create and add the new pipeline to its parent
     if sitemap != None:
         pl_opts['parent'] = sitemap
@@ -57,6 +67,9 @@ def build_pipeline(server, sitemap, attrs, **kw_args):
     
     return pl
 
+# the maximum number of pipeline cache keys whose results are remembered to be uncacheable by each pipeline
+MAX_UNCACHEABLE_KEYS = 1000
+
 class pipeline(component):
     """
     pipeline encapsulates a pipeline.
@@ -65,12 +78,20 @@ class pipeline(component):
     role = "pipeline"
     function = "pipeline"
     
-    def __init__(self, parent, cache_as=""):
+    def __init__(self, parent, cache_as="", max_age=None, stale_while_revalidate="0", stale_if_error="0"):
         """
         pipeline constructor.
 
         @parent: sitemap or server
-        @cache_as: (optional)
+        @cache_as: the name under which the pipeline's results are cached in the sitemap's pipeline cache.
+                   If it is not given, the results are not cached. (optional)
+        @max_age: the number of seconds for which a cached result is used. If it is given, results which
+                  depend on something other than files (e.g. SQL queries) are cached too; otherwise cached
+                  results are used until the files they depend on change. (optional)
+        @stale_while_revalidate: the number of seconds after max_age for which an expired result is still
+                                 used while the pipeline is executed again in the background. (optional)
+        @stale_if_error: the number of seconds after max_age for which an expired (or out of date) result is
+                         used if executing the pipeline again fails. (optional)
         """
 
         component.__init__(self, parent)
@@ -79,41 +100,51 @@ class pipeline(component):
 
         self.description = "Pipeline"
 
-    def force_execute(self, output, uri):
+        try:
+            if max_age is not None:
+                self.max_age = float(max_age)
+            else:
+                self.max_age = None
+            self.stale_while_revalidate = float(stale_while_revalidate)
+            self.stale_if_error = float(stale_if_error)
+        except ValueError:
+            raise PipelineError("max-age, stale-while-revalidate and stale-if-error must be numbers of seconds")
+
+        self.refreshing = set()        # the pipeline cache keys of the results being refreshed in the background
+        self.refreshing_lock = threading.Lock()
+        # the pipeline cache keys whose results couldn't be cached (see execute_once)
+        self.uncacheable = lru_cache(MAX_UNCACHEABLE_KEYS, MAX_UNCACHEABLE_KEYS)
+
+    def force_execute(self, output, uri, inputs=None):
         """
         Used to execute the pipeline without returning the result directly to the HTTP response.
 
         @output: a file-like object
         @uri: a URI string
+        @inputs: a dictionary which, if it is given, is filled with the 'dependencies' (a dictionary of
+                 the modification times of the files which the result depends on, indexed by path), the
+                 'volatile' flag, the 'vary' list (of the request headers which the result depends on) and
+                 the 'status' of the request. Optional
         """
 
         if self.server.log_debug:
             self.server.error_log.write("Pipeline forced to execute for uri: \"%s\"" % uri)
         
-        # create a little pretend apache request object
-        class fake_request:
-            def __init__(self, ostream, uri):
-                self.write = ostream.write
-
-                pos_qm = uri.find("?")
-                if pos_qm == -1: pos_qm = len(uri)
-                pos_hash = uri.find("#")
-                if pos_hash == -1: pos_hash = len(uri)
-
-                self.path = uri[:pos_qm]
-                self.query = uri[pos_qm+1:pos_hash]
-                self.fragment = uri[pos_hash+1:]
-                
-                self.uri = uri
-                self.unparsed_uri = uri
-                self.parsed_uri = ("context", "", "", "", self.server.server_hostname, 80, self.path, self.query, self.fragment)
-                
-                self.content_type = None
-
-            def set_content_length(self, l): pass
-            def sendfile(self, fn): pass
-
-        return self.execute(fake_request(output, uri))
+        # use a little pretend apache request object
+        if self.sitemap is not None:
+            req = get_request_context(fake_request(output, uri, self.sitemap.server_name))
+        else:
+            req = get_request_context(fake_request(output, uri))
+
+        result = self.execute(req)
+
+        if inputs is not None:
+            inputs['dependencies'] = req.dependencies
+            inputs['volatile'] = req.volatile
+            inputs['vary'] = req.vary
+            inputs['status'] = req.status
+
+        return result
 
     def _descend(self, req, p_sibling_result=None):
         return True
@@ -124,11 +155,251 @@ class pipeline(component):
         else:
             return (False, None)
     
+    def cache_key(self, req):
+        """
+        Returns the key of the pipeline's result for the given request in the sitemap's pipeline cache:
+        a tuple of the cache_as name, the position of the top-level matcher which matches the request
+        and the request inputs used by that matcher and its descendants (see component.cache_key).
+        Returns None if the result can't be cached.
+
+        @req: a request_context
+        """
+
+        for pos in range(len(self.children)):
+            m = self.children[pos]
+            if getattr(m, "match", None) is None:
+                # only pipelines made up of matchers can be cached
+                return None
+
+            if m.match(req).matched:
+                inputs = []
+                stack = [m]
+                while len(stack) > 0:
+                    c = stack.pop()
+                    inputs.append(c.cache_key(req))
+                    stack.extend(c.children)
+
+                return (self.cache_as, pos, tuple(inputs))
+
+        return None
+
     def execute(self, req):
         """
-        Execute the pipeline.
+        Execute the pipeline. If the pipeline has a cache_as name, its result may be taken from (or
+        stored in) the sitemap's pipeline cache.
 
-        @req: an Apache request object
+        @req: an Apache request object or a request_context
+        """
+
+        req = get_request_context(req)
+
+        if self.cache_as == "" or self.sitemap is None or self.sitemap.pipeline_cache is None or req.method != "GET":
+            return self._execute(req)
+
+        try:
+            key = self.cache_key(req)
+        except Exception:
+            # if the inputs can't be found (e.g. a missing query parameter) just execute the pipeline
+            key = None
+
+        if key is None:
+            return self._execute(req)
+
+        response = self.sitemap.pipeline_cache.get(key)
+        if response is not None:
+            if self.fresh(response):
+                return self.use_response(req, response)
+
+            if response.valid() and self.max_age is not None\
+                   and response.age() < self.max_age + self.stale_while_revalidate:
+                # the result has expired, but it can still be used while it is refreshed
+                self.start_refresh(req, key)
+                return self.use_response(req, response)
+
+        (success, result, mime) = self.execute_once(req, key)
+
+        if not success and result == apache.HTTP_INTERNAL_SERVER_ERROR and response is not None\
+               and self.max_age is not None and response.age() < self.max_age + self.stale_if_error:
+            # the pipeline failed (e.g. the database is down), so use the old result instead
+            if self.server.log_errors:
+                self.server.error_log.write("Pipeline \"%s\" failed; using its cached result for: \"%s\"" %\
+                                            (self.cache_as, req.unparsed_uri))
+            req.exception = None
+            return self.use_response(req, response)
+
+        return (success, result, mime)
+
+    def fresh(self, response):
+        """
+        Returns True if the given cached_response can be used without executing the pipeline.
+        """
+
+        return response.valid() and (self.max_age is None or response.age() < self.max_age)
+
+    def execute_once(self, req, key):
+        """
+        Executes the pipeline and caches its result, unless another request is already doing so for the
+        same key (see single_flight), in which case this waits for that request and uses the result it
+        cached (or, if it was too large to cache, the result it shared through the flight). Keys whose
+        results couldn't be cached before (because they were volatile or not HTTP_OK) aren't shared, so
+        their requests don't wait for each other.
+
+        @req: a request_context
+        @key: the pipeline cache key of the result
+        """
+
+        flights = self.sitemap.flights
+        if flights is None or self.uncacheable.get(key) is not None:
+            return self.execute_and_cache(req, key)
+
+        (leader, f) = flights.begin(key)
+        if leader:
+            try:
+                # another process may have cached the result while this one waited for it
+                response = self.sitemap.pipeline_cache.get(key)
+                if response is not None and self.fresh(response):
+                    return self.use_response(req, response)
+
+                return self.execute_and_cache(req, key, f)
+            finally:
+                flights.end(key, f)
+
+        flights.wait(f)
+        if f.result is not None:
+            return self.use_response(req, f.result)
+
+        response = self.sitemap.pipeline_cache.get(key)
+        if response is not None and self.fresh(response):
+            return self.use_response(req, response)
+
+        # the result couldn't be cached (or the leader failed), so execute the pipeline for this request too
+        return self.execute_and_cache(req, key)
+
+    def use_response(self, req, response):
+        """
+        Returns the pipeline result tuple for the given cached_response and adds its dependencies to the
+        request.
+
+        @req: a request_context
+        @response: a cached_response from the pipeline cache
+        """
+
+        req.add_dependencies(response.dependencies)
+        for header_name in response.vary:
+            req.add_vary(header_name)
+        if response.volatile or self.max_age is not None:
+            # the result may only be used until it expires, so the response mustn't be cached any longer
+            req.volatile = True
+
+        return (True, response.body, response.mime)
+
+    def start_refresh(self, req, key):
+        """
+        Executes the pipeline again in a background thread for the given request (with the same URI and
+        headers) in order to replace its expired result in the pipeline cache. Only one refresh of each
+        result is done at a time.
+
+        @req: a request_context
+        @key: the pipeline cache key of the result
+        """
+
+        self.refreshing_lock.acquire()
+        try:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        finally:
+            self.refreshing_lock.release()
+
+        refresh_req = fake_request(StringIO(), req.unparsed_uri, self.sitemap.server_name)
+        for name, value in req.headers_in.items():
+            refresh_req.headers_in[name] = value
+
+        t = threading.Thread(target=self.refresh, args=(get_request_context(refresh_req), key))
+        t.setDaemon(True)
+        t.start()
+
+    def refresh(self, req, key):
+        """
+        Executes the pipeline for the given request and stores its result in the pipeline cache under the
+        given key. Errors are logged; the expired result is left in the cache.
+
+        @req: a request_context
+        @key: the pipeline cache key of the result
+        """
+
+        try:
+            (success, result, mime) = self.execute_and_cache(req, key)
+            if not success and self.server.log_errors:
+                self.server.error_log.write("Background refresh of pipeline \"%s\" failed for: \"%s\"" %\
+                                            (self.cache_as, req.unparsed_uri))
+        finally:
+            self.refreshing_lock.acquire()
+            try:
+                self.refreshing.discard(key)
+            finally:
+                self.refreshing_lock.release()
+
+    def execute_and_cache(self, req, key, f=None):
+        """
+        Executes the pipeline's components and stores the result in the pipeline cache under the given key
+        if it can be cached.
+
+        @req: a request_context
+        @key: the pipeline cache key of the result
+        @f: the single_flight flight of the key, if this request is its leader. A result which could have
+            been cached but is too large is given to the flight's waiting requests instead. Optional
+        """
+
+        # keep the files and headers which this pipeline depends on separately from those of any previous
+        # pipelines (the request's own dependencies are restored and updated afterwards)
+        (dependencies, volatile, vary) = (req.dependencies, req.volatile, req.vary)
+        req.dependencies = {}
+        req.volatile = False
+        req.vary = []
+        try:
+            (success, result, mime) = self._execute(req)
+        finally:
+            (p_dependencies, p_volatile, p_vary) = (req.dependencies, req.volatile, req.vary)
+            dependencies.update(p_dependencies)
+            req.dependencies = dependencies
+            req.volatile = volatile or p_volatile
+            req.vary = vary
+            for header_name in p_vary:
+                req.add_vary(header_name)
+
+        if self.max_age is not None:
+            # the result expires, so the response mustn't be cached any longer than the pipeline's result
+            req.volatile = True
+
+        # volatile results may only be cached if they expire
+        cacheable = success and (not p_volatile or self.max_age is not None) and req.status == apache.HTTP_OK
+        if cacheable and isinstance(result, result_chunks):
+            # the streamed result has to be put together to be cached; this is when it is computed, so
+            # errors are handled as they are by _execute
+            try:
+                result = result.join()
+            except Exception:
+                return self.execution_error(req)
+
+        if cacheable and isinstance(result, basestring):
+            response = cached_response(result, mime, req.status, p_dependencies, p_vary, volatile=p_volatile)
+            if len(result) <= self.server.MAX_REQUEST_SIZE:
+                self.sitemap.pipeline_cache.put(key, response, len(result))
+            elif f is not None:
+                f.result = response
+
+        elif success and not cacheable:
+            # the key's results are volatile or errors, so its requests won't wait for each other again
+            self.uncacheable.put(key, True, 1)
+
+        return (success, result, mime)
+
+    def _execute(self, req):
+        """
+        Execute the pipeline's components.
+
+        @req: a request_context
         """
 
         try:
@@ -139,22 +410,32 @@ class pipeline(component):
             else:
                 return (success, result, "unknown")
         except Exception:
-            # if there was an error during execution, return error 500
-            # store the exception in case there is a 500 handler pipeline
-            self.server.EXCEPTION = sys.exc_info()
+            return self.execution_error(req)
 
-            if self.server.log_errors:
-                self.server.error_log.write(string.join(traceback.format_exception(*sys.exc_info()), "\n"))
+    def execution_error(self, req):
+        """
+        Returns the pipeline result tuple for the exception being handled: error 500. The exception is
+        stored in the request in case there is a 500 handler pipeline.
 
-            return (False, apache.HTTP_INTERNAL_SERVER_ERROR, None)
+        @req: a request_context
+        """
+
+        req.exception = sys.exc_info()
+
+        if self.server.log_errors:
+            self.server.error_log.write(string.join(traceback.format_exception(*sys.exc_info()), "\n"))
+
+        return (False, apache.HTTP_INTERNAL_SERVER_ERROR, None)
 
     def handle_error(self, req):
         """
         Execute the pipeline, but only using its error handler matcher for the given error code.
 
-        @req: an Apache request object
+        @req: an Apache request object or a request_context
         """
 
+        req = get_request_context(req)
+
         # um, we could make all matchers check the req.status to make sure its not an error condition
         # so that this function is then the same as execute...
 
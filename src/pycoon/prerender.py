@@ -0,0 +1,398 @@
+"""
+Copyright (C) Richard Lewis 2006
+
+This software is licensed under the terms of the GNU GPL.
+
+The prerender module renders the responses of a sitemap for a list of URIs to static files
+so that they can be served by Apache without Pycoon. Each URI is rendered by the pipeline
+which handles it (see pipeline.force_execute) in a pool of worker processes.
+
+Usage:
+    python -m pycoon.prerender [options] <server-name> <doc-root> <output-dir> [uri-pattern ...]
+
+Arguments:
+    server-name         a domain name
+    doc-root            the full path to the document root directory which the sitemap serves
+    output-dir          the directory in which the rendered files are written
+    uri-pattern         a URI to render; it may include alternatives, e.g. "/page/{a,b,c}", and
+                        numeric ranges, e.g. "/item/{1..20}" or "/item/{01..20}"
+
+Options:
+    -c, --config-root   the directory containing the server.xml file (default: /etc/pycoon)
+    -s, --sitemap       the name of the sitemap file in the doc-root (default: sitemap.xml)
+    -u, --uri-list      a file of URI patterns, one per line ('#' starts a comment)
+    -j, --processes     the number of worker processes (default: the number of CPUs)
+    -f, --force         render every URI, even those whose inputs haven't changed
+    --index             the file name used for URIs ending in '/' (default: index.html)
+
+The MIME type of each file is written to a metadata file for mod_cern_meta, e.g. the type of
+"page/a" is in "page/.web/a.meta", so the output directory can be served with:
+
+    MetaFiles on
+    MetaDir .web
+    MetaSuffix .meta
+
+The modification times of the files used to render each URI are recorded in the output
+directory's .prerender.json manifest. Unless --force is given, a URI is only rendered again
+if its file is missing, any of those files have changed or its result is volatile (e.g. it
+comes from a database query).
+
+A URI whose response depends on request headers (e.g. on a browser selector) or whose status isn't
+200 (OK) can't be served as a static file, so it is reported as a failure and no file is written.
+If the URI was rendered before, its old file (and metadata file) is removed.
+"""
+
+import os, sys, re, json
+from StringIO import StringIO
+from optparse import OptionParser
+
+try:
+    import multiprocessing
+except ImportError:
+    # the URIs are rendered one after another in this process
+    multiprocessing = None
+
+import pycoon
+from pycoon.cache import dependencies_valid, file_mtime
+from pycoon.helpers import unescape_url, result_chunks
+
+MANIFEST_NAME = ".prerender.json"
+META_DIR = ".web"
+META_SUFFIX = ".meta"
+
+# this compiled regex finds the first set of alternatives in a URI pattern
+_alternatives = re.compile("\{([^{}]*)\}")
+_range = re.compile("^([0-9]+)\.\.([0-9]+)$")
+
+def expand_pattern(pattern):
+    """
+    Returns the list of URIs described by the given URI pattern, which may include sets of comma
+    separated alternatives ({a,b,c}) and numeric ranges ({1..20}; {01..20} keeps the zero padding).
+    """
+
+    m = _alternatives.search(pattern)
+    if m is None:
+        return [pattern]
+
+    r = _range.match(m.group(1))
+    if r is not None:
+        (low, high) = r.groups()
+        if low.startswith("0") and len(low) > 1:
+            width = len(low)
+        else:
+            width = 0
+        values = ["%0*d" % (width, n) for n in range(int(low), int(high) + 1)]
+    else:
+        values = m.group(1).split(",")
+
+    uris = []
+    for v in values:
+        uris.extend(expand_pattern(pattern[:m.start()] + v + pattern[m.end():]))
+
+    return uris
+
+def read_uri_list(filename):
+    """
+    Returns the URI patterns in the given file (one per line, '#' starts a comment).
+    """
+
+    patterns = []
+    for line in open(filename, "r"):
+        line = line.split("#")[0].strip()
+        if len(line) > 0:
+            patterns.append(line)
+
+    return patterns
+
+def uri_file_path(uri, index_name="index.html"):
+    """
+    Returns the path (relative to the output directory) of the file for the given URI.
+    """
+
+    path = unescape_url(uri.split("#")[0])
+    if path.endswith("/"):
+        path += index_name
+
+    parts = [part for part in path.split("/") if part not in ["", ".", ".."]]
+    if len(parts) == 0:
+        parts = [index_name]
+
+    return os.path.join(*parts)
+
+def meta_file_path(path):
+    """
+    Returns the path of the mod_cern_meta metadata file for the file with the given path.
+    """
+
+    (directory, name) = os.path.split(path)
+    return os.path.join(directory, META_DIR, name + META_SUFFIX)
+
+def load_manifest(output_dir):
+    """
+    Returns the manifest of the given output directory: a dictionary of the details of the rendered URIs
+    (indexed by URI).
+    """
+
+    try:
+        return json.load(open(os.path.join(output_dir, MANIFEST_NAME), "r"))
+    except (IOError, ValueError):
+        return {}
+
+def save_manifest(output_dir, manifest):
+    """
+    Writes the given manifest to the given output directory.
+    """
+
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    f = open(path + ".tmp", "w")
+    try:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+    os.rename(path + ".tmp", path)
+
+def remove_rendered(output_dir, path):
+    """
+    Removes the file with the given path (relative to the output directory) and its metadata file, if
+    they exist.
+    """
+
+    for name in [path, meta_file_path(path)]:
+        try:
+            os.remove(os.path.join(output_dir, name))
+        except OSError:
+            # it doesn't exist
+            pass
+
+def up_to_date(output_dir, entry):
+    """
+    Returns True if the file of the given manifest entry exists and none of the files it was made from
+    have changed.
+    """
+
+    if entry.get('volatile', True) or entry.get('path') is None:
+        return False
+
+    if not os.path.exists(os.path.join(output_dir, entry['path'])):
+        return False
+
+    return dependencies_valid(entry.get('dependencies', {}))
+
+# the settings used by render_uri (see load_site)
+_settings = {}
+
+def load_site(server_name, document_root, config_root, sitemap_filename, output_dir, index_name):
+    """
+    Loads the server configuration and the sitemap. It is called before the worker processes are
+    started, so that they inherit them (and any configuration errors are raised only once).
+    """
+
+    pycoon.apache._server_root = document_root
+    pycoon.preload(server_name, document_root, config_root, sitemap_filename)
+
+    _settings['output_dir'] = output_dir
+    _settings['index_name'] = index_name
+    # the configuration files are inputs of every URI
+    _settings['config_files'] = [os.path.join(config_root, "server.xml"), os.path.join(document_root, sitemap_filename)]
+
+def render_uri(uri):
+    """
+    Renders the given URI with the first sitemap pipeline which handles it and writes the result (and its
+    metadata) to the output directory. Returns a tuple of the URI and its manifest entry; the entry has an
+    'error' status code (or message) if the URI couldn't be rendered, which includes results which aren't
+    200 (OK) and results which depend on request headers.
+    """
+
+    output_dir = _settings['output_dir']
+
+    for p in pycoon.sitemap.pipelines:
+        inputs = {}
+        (success, result, mime) = p.force_execute(StringIO(), uri, inputs)
+
+        if success and inputs['status'] != pycoon.apache.HTTP_OK:
+            return (uri, {'error': inputs['status']})
+
+        elif success and len(inputs['vary']) > 0:
+            # a static file would give every client the response made for a request without headers
+            return (uri, {'error': "the response depends on request headers (%s)" % ", ".join(inputs['vary'])})
+
+        elif success:
+            path = uri_file_path(uri, _settings['index_name'])
+            full_path = os.path.join(output_dir, path)
+            meta_path = os.path.join(output_dir, meta_file_path(path))
+            for d in [os.path.dirname(full_path), os.path.dirname(meta_path)]:
+                try:
+                    os.makedirs(d)
+                except OSError:
+                    # it already exists (perhaps made by another worker)
+                    if not os.path.isdir(d):
+                        raise
+
+            # the file is written under a temporary name so that a result which fails while it is being
+            # written (e.g. a streamed document with a syntax error) doesn't leave a partial file
+            f = open(full_path + ".tmp", "wb")
+            try:
+                if isinstance(result, file):
+                    try:
+                        data = result.read(64 * 1024)
+                        while data:
+                            f.write(data)
+                            data = result.read(64 * 1024)
+                    finally:
+                        result.close()
+                elif isinstance(result, result_chunks):
+                    for data in result:
+                        f.write(data)
+                elif isinstance(result, unicode):
+                    f.write(result.encode("utf-8"))
+                else:
+                    f.write(result)
+            except:
+                f.close()
+                os.remove(full_path + ".tmp")
+                raise
+            f.close()
+            os.rename(full_path + ".tmp", full_path)
+
+            if mime is not None and mime != "unknown":
+                meta = open(meta_path, "w")
+                try:
+                    meta.write("Content-Type: %s\n" % mime)
+                finally:
+                    meta.close()
+            elif os.path.exists(meta_path):
+                # leave it to Apache to choose the type
+                os.remove(meta_path)
+
+            dependencies = dict(inputs['dependencies'])
+            for path_name in _settings['config_files']:
+                dependencies[path_name] = file_mtime(path_name)
+
+            return (uri, {'path': path, 'mime': mime, 'dependencies': dependencies, 'volatile': inputs['volatile']})
+
+        elif result is not None:
+            # an error code
+            return (uri, {'error': result})
+
+    return (uri, {'error': pycoon.apache.HTTP_NOT_FOUND})
+
+def render_uri_safely(uri):
+    """
+    Calls render_uri and turns any exception into an error entry, so that one bad URI doesn't stop the
+    worker pool.
+    """
+
+    try:
+        return render_uri(uri)
+    except Exception, e:
+        return (uri, {'error': "%s: %s" % (e.__class__.__name__, e)})
+
+def prerender(server_name, document_root, output_dir, uris, config_root="/etc/pycoon", sitemap_filename="sitemap.xml",
+              processes=None, force=False, index_name="index.html", log=sys.stdout):
+    """
+    Renders the given URIs to files in the output directory. Returns the number of URIs which couldn't
+    be rendered.
+
+    @server_name: the name of the (Virtual)Host
+    @document_root: the absolute path of the web application
+    @output_dir: the directory in which the files are written
+    @uris: a list of URIs (without query strings)
+    @config_root: the directory containing the server.xml file. Optional
+    @sitemap_filename: the name of the sitemap file in the document_root. Optional
+    @processes: the number of worker processes. Optional; the number of CPUs is default
+    @force: if True, every URI is rendered, even if its inputs haven't changed. Optional
+    @index_name: the file name used for URIs ending in '/'. Optional
+    @log: a file-like object to which progress is written. Optional
+    """
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    manifest = load_manifest(output_dir)
+
+    todo = []
+    for uri in uris:
+        if uri.find("?") >= 0:
+            log.write("skipped %s: URIs with query strings can't be served as static files\n" % uri)
+        elif not force and manifest.has_key(uri) and up_to_date(output_dir, manifest[uri]):
+            log.write("up to date %s\n" % uri)
+        elif uri not in todo:
+            todo.append(uri)
+
+    load_site(server_name, document_root, config_root, sitemap_filename, output_dir, index_name)
+
+    if multiprocessing is not None and processes != 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = list(pool.imap_unordered(render_uri_safely, todo))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [render_uri_safely(uri) for uri in todo]
+
+    failures = 0
+    stale_paths = []                   # the files of the URIs which were rendered before but have now failed
+    for (uri, entry) in results:
+        if entry.has_key('error'):
+            log.write("failed %s: %s\n" % (uri, entry['error']))
+            failures += 1
+            if manifest.has_key(uri):
+                if manifest[uri].get('path') is not None:
+                    stale_paths.append(manifest[uri]['path'])
+                del manifest[uri]
+        else:
+            log.write("rendered %s -> %s (%s)\n" % (uri, entry['path'], entry['mime']))
+            manifest[uri] = entry
+
+    # Apache would go on serving the old files of failed URIs, so they are removed (unless another URI,
+    # e.g. "/a/" and "/a/index.html", still has the same file)
+    current_paths = set([entry.get('path') for entry in manifest.values()])
+    for path in stale_paths:
+        if path not in current_paths:
+            remove_rendered(output_dir, path)
+            log.write("removed %s\n" % path)
+
+    save_manifest(output_dir, manifest)
+
+    return failures
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = OptionParser(usage="python -m pycoon.prerender [options] <server-name> <doc-root> <output-dir> [uri-pattern ...]")
+    parser.add_option("-c", "--config-root", dest="config_root", default="/etc/pycoon")
+    parser.add_option("-s", "--sitemap", dest="sitemap_filename", default="sitemap.xml")
+    parser.add_option("-u", "--uri-list", dest="uri_list", action="append", default=[])
+    parser.add_option("-j", "--processes", dest="processes", type="int", default=None)
+    parser.add_option("-f", "--force", dest="force", action="store_true", default=False)
+    parser.add_option("--index", dest="index_name", default="index.html")
+
+    (options, args) = parser.parse_args(argv)
+    if len(args) < 3:
+        parser.error("server-name, doc-root and output-dir are required")
+
+    (server_name, document_root, output_dir) = args[:3]
+
+    patterns = args[3:]
+    for filename in options.uri_list:
+        patterns.extend(read_uri_list(filename))
+
+    uris = []
+    for pattern in patterns:
+        uris.extend(expand_pattern(pattern))
+
+    if len(uris) == 0:
+        parser.error("no URIs given")
+
+    failures = prerender(server_name, document_root, output_dir, uris, options.config_root, options.sitemap_filename,
+                         options.processes, options.force, options.index_name)
+
+    if failures > 0:
+        return 1
+    else:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -53,15 +53,34 @@ class read(stream_component):
     def _descend(self, req, p_sibling_result=None):
         return False
     
+    def warm_up(self):
+        """
+        Reads the file into the files cache if its path is constant.
+        """
+
+        fn = self.constant_value(self.file_name, as_filename=True)
+        if fn is not None and self.sitemap is not None and self.sitemap.files_cache is not None:
+            data = self.sitemap.files_cache.read(fn)
+            if isinstance(data, file):
+                # it's too big to be cached
+                data.close()
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         # it makes most sense simply to call req.sendfile(). However, it fits the architecture better to read the contents of the file
         # into a memory stream first so that it can go through the rest of the pipeline (especially for XML/HTML docs.)
-        # However, this is going to to be *bad* for binary files. Could we make this some sort of exception?
+        # Files bigger than the server's MAX_CACHE_FILE_SIZE are returned as open file objects instead so that they are
+        # streamed to the client (see helpers.write_result).
 
         try:
-            fn = interpolate(self, self.file_name, as_filename=True, root_path=self.root_path)
+            fn = interpolate(self, req, self.file_name, as_filename=True, root_path=self.root_path)
+            req.add_dependency(fn)
 
-            return (True, file(fn, 'r').read())
+            if self.sitemap is not None and self.sitemap.files_cache is not None:
+                return (True, self.sitemap.files_cache.read(fn))
+            elif os.path.getsize(fn) > self.server.MAX_CACHE_FILE_SIZE:
+                return (True, file(fn, 'r'))
+            else:
+                return (True, file(fn, 'r').read())
 
-        except IOError:
+        except (IOError, OSError):
             return (False, apache.HTTP_NOT_FOUND)
@@ -62,4 +62,4 @@ class redirect(syntax_component):
         return False
     
     def _result(self, req, p_sibling_result=None, child_results=[]):
-        util.redirect(req, interpolate(self, self.new_uri), self.permanent, self.message)
+        util.redirect(req, interpolate(self, req, self.new_uri), self.permanent, self.message)
@@ -0,0 +1,97 @@
+"""
+Copyright (C) Richard Lewis 2006
+
+This software is licensed under the terms of the GNU GPL.
+
+The request_context module contains the request_context class which holds all the state
+belonging to a single request so that the components of a loaded sitemap can be shared
+by many concurrent requests.
+"""
+
+from pycoon.cache import file_mtime
+
+class request_context(object):
+    """
+    request_context holds the per-request data of a request being handled by Pycoon: the
+    uri_match of each matcher, the exception information for error handlers and any other
+    data which components need to keep while the request is being processed.
+
+    It wraps the Apache request object: any attribute which is not part of the context is
+    read from (or written to) the Apache request, so a request_context is passed through
+    component.__call__ in place of the request object itself.
+    """
+
+    def __init__(self, req):
+        """
+        request_context constructor.
+
+        @req: an Apache request object
+        """
+
+        # the context's own attributes are set in its __dict__ directly because __setattr__
+        # passes on attributes which are not already in the __dict__ to the Apache request
+        self.__dict__['req'] = req
+        self.__dict__['matches'] = {}          # dictionary of uri_match objects (indexed by matcher)
+        self.__dict__['dispatch_matches'] = {} # dictionary of match objects found by the sitemap's
+                                               # uri_dispatch_regex (indexed by matcher)
+        self.__dict__['exception'] = None      # this will hold the exception info and traceback whenever
+                                               # an exception occurs
+        self.__dict__['data'] = {}             # dictionary of any other per-request data (indexed by component)
+        self.__dict__['dependencies'] = {}     # dictionary of the modification times of the files which the response
+                                               # depends on (indexed by path)
+        self.__dict__['volatile'] = False      # set to True by components whose results depend on something other
+                                               # than files (e.g. databases, remote resources), so the response
+                                               # mustn't be cached
+        self.__dict__['vary'] = []             # list of the names of the request headers which the response depends on
+
+    def __getattr__(self, name):
+        return getattr(self.req, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.req, name, value)
+
+    def add_dependency(self, path):
+        """
+        Records that the response depends on the file (or directory) with the given path. Components
+        should call this before reading the file so that a cached response is never newer than the
+        recorded modification time.
+
+        @path: an absolute path name (the file need not exist)
+        """
+
+        if not self.dependencies.has_key(path):
+            self.dependencies[path] = file_mtime(path)
+
+    def add_dependencies(self, dependencies):
+        """
+        Records that the response depends on all the files in the given dictionary of modification
+        times (indexed by path), e.g. those of a cached item.
+        """
+
+        for path, mtime in dependencies.items():
+            if not self.dependencies.has_key(path):
+                self.dependencies[path] = mtime
+
+    def add_vary(self, header_name):
+        """
+        Records that the response depends on the request header with the given name.
+        """
+
+        if header_name not in self.vary:
+            self.vary.append(header_name)
+
+def get_request_context(req):
+    """
+    Returns a request_context for the given request object. If req is already a request_context
+    it is returned unchanged.
+
+    @req: an Apache request object or a request_context
+    """
+
+    if isinstance(req, request_context):
+        return req
+    else:
+        return request_context(req)
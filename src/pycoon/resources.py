@@ -7,45 +7,431 @@ This module contains the classes used to generalise access to external
 resources as well as those used to implement the caching mechanism.
 """
 
-import os, tempfile, cPickle
+import os, time, tempfile, threading, cPickle, httplib, socket
+from StringIO import StringIO
+from collections import OrderedDict
+
+RELOAD_POLICIES = ['always', 'modified', 'wait', 'repeated', 'never']
+
+def find_executable(command):
+    """
+    Returns the path of the executable which the shell would run for the given command name (searching
+    the PATH for names without a '/') or None if it can't be found.
+    """
+
+    if os.sep in command:
+        return command
+
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        path = os.path.join(directory or os.curdir, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+    return None
+
+class resource_store(object):
+    """
+    resource_store keeps the results of resources in files in a temporary directory. It holds at most
+    max_entries results whose total size is at most max_bytes; when either limit would be exceeded, the
+    least recently used results are removed. It may be shared by concurrent requests.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        """
+        resource_store constructor. The directory is created when the first result is stored.
+
+        @max_entries: the maximum number of stored results
+        @max_bytes: the maximum total size (in bytes) of the stored results' files
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.directory = None
+        self.entries = OrderedDict()   # dictionary of (path, size, cache_class, state) tuples (indexed by key)
+                                       # in order of use
+        self.size = 0                  # the total size of the stored files
+        self.lock = threading.Lock()
+
+    def put(self, key, result, state=None):
+        """
+        Stores the given result under the given key. result may be a file-like object, whose contents are
+        stored, or any Python object which can be pickled. Returns False if the result can't be stored.
+
+        @state: an object kept with the result (see get_state) and discarded with it. Optional
+        """
+
+        self.lock.acquire()
+        try:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="pycoon")
+        finally:
+            self.lock.release()
+
+        (handle, path) = tempfile.mkstemp(dir=self.directory)
+        f = os.fdopen(handle, 'wb')
+        try:
+            try:
+                if hasattr(result, "read"):
+                    data = result.read(64 * 1024)
+                    while data:
+                        f.write(data)
+                        data = result.read(64 * 1024)
+                    cache_class = "file"
+                else:
+                    cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
+                    cache_class = "pickle"
+            finally:
+                f.close()
+        except (cPickle.PicklingError, TypeError, IOError, OSError):
+            os.remove(path)
+            return False
+
+        size = os.stat(path).st_size
+        if size > self.max_bytes or self.max_entries < 1:
+            os.remove(path)
+            return False
+
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                self._discard(key)
+
+            while len(self.entries) >= self.max_entries or self.size + size > self.max_bytes:
+                self._discard(self.entries.keys()[0])
+
+            self.entries[key] = (path, size, cache_class, state)
+            self.size += size
+            return True
+        finally:
+            self.lock.release()
+
+    def get(self, key):
+        """
+        Returns the result stored under the given key (marking it as the most recently used) or False if
+        there is no such result. Results which were stored from file-like objects are returned as open
+        file objects.
+        """
+
+        self.lock.acquire()
+        try:
+            try:
+                entry = self.entries.pop(key)
+            except KeyError:
+                return False
+            self.entries[key] = entry
+        finally:
+            self.lock.release()
+
+        (path, size, cache_class, state) = entry
+        try:
+            if cache_class == "file":
+                return file(path, 'rb')
+            else:
+                f = file(path, 'rb')
+                try:
+                    return cPickle.load(f)
+                finally:
+                    f.close()
+        except (IOError, OSError, cPickle.UnpicklingError, EOFError, ImportError, IndexError, AttributeError):
+            # the file may have been removed by another thread in the meantime
+            return False
+
+    def get_state(self, key):
+        """
+        Returns the state object which was stored with the result under the given key or None if there
+        is no such result. It doesn't mark the result as used.
+        """
+
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key)
+        finally:
+            self.lock.release()
+
+        if entry is None:
+            return None
+        else:
+            return entry[3]
+
+    def keys(self):
+        """
+        Returns a list of the keys of the stored results.
+        """
+
+        self.lock.acquire()
+        try:
+            return self.entries.keys()
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        """
+        Removes the result stored under the given key (if there is one).
+        """
+
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                self._discard(key)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """
+        Removes all the stored results and the store's directory.
+        """
+
+        self.lock.acquire()
+        try:
+            for key in self.entries.keys():
+                self._discard(key)
+
+            if self.directory is not None:
+                try:
+                    os.rmdir(self.directory)
+                except OSError:
+                    pass
+                self.directory = None
+        finally:
+            self.lock.release()
+
+    def _discard(self, key):
+        """
+        Removes the entry with the given key and its file. The caller must hold the lock.
+        """
+
+        (path, size, cache_class, state) = self.entries.pop(key)
+        self.size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.entries)
+
+    def has_key(self, key):
+        return self.entries.has_key(key)
+
+class HTTPPoolError(httplib.HTTPException): pass
+
+class http_pool(object):
+    """
+    http_pool makes HTTP requests on connections which are kept open (and reused) between requests to the
+    same host. It limits the number of connections to each host which are in use at once and the time
+    spent connecting and waiting for responses. It may be shared by concurrent requests.
+    """
+
+    def __init__(self, max_connections, connect_timeout, read_timeout, idle_timeout, keep_alive=True):
+        """
+        http_pool constructor.
+
+        @max_connections: the maximum number of connections to each host which are in use at once
+        @connect_timeout: the number of seconds to wait for a connection to be made (or for a connection
+                          to be free)
+        @read_timeout: the number of seconds to wait for the server to send each part of a response
+        @idle_timeout: the number of seconds for which an unused connection is kept open
+        @keep_alive: if False, every connection is closed once its response has been read. Optional
+        """
+
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.keep_alive = keep_alive
+
+        self.idle = {}                 # dictionary of lists of (connection, time of last use) tuples of the
+                                       # unused open connections (indexed by (scheme, host))
+        self.active = {}               # dictionary of the number of connections in use (indexed by (scheme, host))
+        self.pid = os.getpid()         # the process which owns the connections
+        self.condition = threading.Condition()
+
+    def _acquire(self, key):
+        """
+        Waits for a free connection slot for the given (scheme, host) key and returns an idle connection
+        to the host or None if a new one must be made. Raises HTTPPoolError if no slot is free within
+        connect_timeout seconds.
+        """
+
+        deadline = time.time() + self.connect_timeout
+
+        self.condition.acquire()
+        try:
+            if self.pid != os.getpid():
+                # the connections belong to the parent of this forked process
+                self.idle = {}
+                self.active = {}
+                self.pid = os.getpid()
+
+            while self.active.get(key, 0) >= self.max_connections:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise HTTPPoolError("no free connection to %s within %s seconds" % (key[1], self.connect_timeout))
+                self.condition.wait(remaining)
+
+            self.active[key] = self.active.get(key, 0) + 1
+
+            idle = self.idle.get(key, [])
+            now = time.time()
+            while len(idle) > 0:
+                (conn, used) = idle.pop()
+                if now - used < self.idle_timeout:
+                    return conn
+                conn.close()
+
+            return None
+        finally:
+            self.condition.release()
+
+    def _release(self, key, conn, reusable):
+        """
+        Frees the connection slot of the given (scheme, host) key and keeps the given connection for
+        later requests if it is reusable (otherwise it is closed).
+        """
+
+        self.condition.acquire()
+        try:
+            self.active[key] = self.active.get(key, 1) - 1
+
+            if conn is not None:
+                if reusable and self.keep_alive and self.idle_timeout > 0:
+                    self.idle.setdefault(key, []).append((conn, time.time()))
+                else:
+                    conn.close()
+
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def _connect(self, scheme, host):
+        """
+        Returns a new connection to the given host. The connect timeout applies to making the connection
+        and the read timeout to everything after it.
+        """
+
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(host, timeout=self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=self.connect_timeout)
+
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+
+        return conn
+
+    def request(self, scheme, host, method, url, body=None, headers={}):
+        """
+        Makes an HTTP request and returns a tuple of the response (an httplib.HTTPResponse whose body has
+        been read) and its body. A GET request which fails on a reused connection (which the server may
+        have closed) is made once more on a new connection, unless it timed out.
+
+        @scheme: the URI scheme [http|https]
+        @host: the host (and port) of the server
+        @method: the HTTP method
+        @url: the request URI
+        @body: the request body. Optional
+        @headers: a dictionary of request headers. Optional
+        """
+
+        key = (scheme, host)
+        while True:
+            conn = self._acquire(key)
+            reused = conn is not None
+
+            try:
+                if conn is None:
+                    conn = self._connect(scheme, host)
+                else:
+                    conn.sock.settimeout(self.read_timeout)
+                conn.request(method, url, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                self._release(key, conn, False)
+                if reused and method == "GET" and not isinstance(e, socket.timeout):
+                    continue
+                raise
+            except:
+                self._release(key, conn, False)
+                raise
+
+            self._release(key, conn, not response.will_close)
+            return (response, data)
+
+    def close(self):
+        """
+        Closes the unused connections.
+        """
+
+        self.condition.acquire()
+        try:
+            if self.pid == os.getpid():
+                for idle in self.idle.values():
+                    for (conn, used) in idle:
+                        conn.close()
+            self.idle = {}
+        finally:
+            self.condition.release()
+
+class db_result(object):
+    """
+    db_result holds the description, row count and rows of a cursor on which a query has been made,
+    so that the result of a 'db' resource can be stored after the cursor has been reused. It provides
+    the parts of the DB-API cursor interface which are needed to read the result.
+    """
+
+    def __init__(self, cursor):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.rows = list(cursor.fetchall())
+
+    def fetchall(self):
+        return self.rows
 
 class resource(object):
     """
     resource encapsulates an external resource. It provides mechanisms to obtain data
     from that resource (allowing parameterized invokation for resources such as
-    database queries) and to make the resource reload itself.
-
-    ?It is used as a mix-in class for stream_components.
-     if it is, will it have better access to component's 'result' object for caching?
-     how will its construction be handled?
-     hmm, if its a db source, its holding too much information to have one per every
-     stream_component instance, probably. Perhaps use these more like how we currently
-     use sitemap.ds_mods?
+    database queries) and to make the resource reload itself according to its reload
+    policy. The results of each set of parameters are kept in a resource_store between
+    reloads.
     """
-    
-    def __init__(self, rtype, src, query="", custom_result=False, reload_policy="always"):
+
+    def __init__(self, rtype, src, query="", custom_result=False, reload_policy="always", interval=60, repeats=10,
+                 store=None, src_lock=None):
         """
         resource constructor.
 
         @rtype: the type of resource; ['file', 'db', 'exec']
         @src: the source for the resource; path name for 'file' and 'exec' types, for 'db' type
-              must be triple (database module, method to acquire db cursor in terms of module,
-              db query method in terms of cursor)
+              either a DB-API cursor or a triple (database module, method to acquire db cursor in
+              terms of module, db query method in terms of cursor)
         @query: a query template needed to access the resource; e.g. SQL query. Optional
         @custom_result: if True, then resource's store() method must be called in order for
                         a result to be cached for this resource. If False, resource caches the
                         result from _load() automatically.
         @reload_policy: on what condition the resource should be reloaded;
                         ['always', 'modified', 'wait', 'repeated', 'never']
+        @interval: the number of seconds after which a result is reloaded under the 'wait' policy. Optional
+        @repeats: the number of times a result is used before it is reloaded under the 'repeated' policy.
+                  Optional
+        @store: the resource_store which holds the results. Optional; without one the resource is always
+                reloaded
+        @src_lock: a lock which is held while a 'db' resource's query is executed and its result is
+                   fetched, because the cursor may be shared by concurrent requests (and other resources).
+                   Optional
         """
 
         if rtype not in ['file', 'db', 'exec']:
             raise TypeError("resource.__init__ rtype parameter must be one of: 'file', 'db', 'exec'.")
         else:
             self.rtype = rtype
-        
-        if self.rtype == "db" and not isinstance(src, tuple):
-            raise TypeError("'db' type resources require tuple src parameter: (db mod, get_cursor(mod), get_query(cursor)).")
+
+        if self.rtype == "db" and hasattr(src, "execute"):
+            self.src = {'mod': None, 'cursor': src, 'query': src.execute}
+        elif self.rtype == "db" and not isinstance(src, tuple):
+            raise TypeError("'db' type resources require a cursor or a tuple src parameter: (db mod, get_cursor(mod), get_query(cursor)).")
         elif self.rtype == "db":
             self.src = {}
             self.src['mod'] = src[0]()
@@ -56,74 +442,189 @@ class resource(object):
             # what if query func requires more than just a query string? (like dbxml requires a query context object)
         else:
             self.src = src
-        
+
         self.query = query
         self.custom_result = custom_result
 
-        if reload_policy not in ['always', 'modified', 'wait', 'repeated', 'never']:
+        if reload_policy not in RELOAD_POLICIES:
             raise TypeError("resource.__init__ reload_policy parameter must be one of: 'always', 'modified', 'wait', 'repeated', 'never'.")
+        if reload_policy == "modified" and self.rtype == "db":
+            raise TypeError("'db' type resources can't use the 'modified' reload_policy.")
         self.reload_policy = reload_policy
 
+        self.interval = interval
+        self.repeats = repeats
+        self.result_store = store
+        self.src_lock = src_lock
+
+        # the state of each stored result is a [load time, modification time, uses] list which is kept
+        # with it in the store (so that it is discarded when the result is)
+        self.lock = threading.Lock()
+
     def _load(self, **params):
         """
         Execute the resource and return the result. Behaviour depends on type. 'file' types return
-        a file object; 'db' objects return a cursor on which the query has been made; 'exec' types
-        return a file-like object which is the result of executing the command.
+        a file object; 'db' objects return a db_result of the cursor on which the query has been made;
+        'exec' types return a file-like object which is the result of executing the command.
         """
 
         if self.rtype == "file":
             return file(self.src % params, 'r')
         elif self.rtype == "db":
-            return self.src['query'](self.query % params)
+            # another request mustn't use the cursor until this query's rows have been fetched
+            if self.src_lock is not None:
+                self.src_lock.acquire()
+            try:
+                self.src['query'](self.query % params)
+                return db_result(self.src['cursor'])
+            finally:
+                if self.src_lock is not None:
+                    self.src_lock.release()
             # what if query func requires more than just a query string? (like dbxml requires a query context object)
         elif self.rtype == "exec":
             return os.popen(self.src % params)
             # we could allow for using self.query here as well, by giving it as stdin using popen2
-        
-    def store(self, result):
+
+    def _key(self, params):
         """
-        Uses tempfile to store (cache) the given result. result may be any Python object such as
-        a character string or an lxml.etree.Element object, or it may be a file-like object.
+        Returns the key under which the result for the given parameters is stored.
         """
 
+        items = params.items()
+        items.sort()
+        return (id(self), tuple(items))
+
+    def _mtime(self, params):
+        """
+        Returns the modification time of the file which the resource reads (or executes) with the
+        given parameters or None if it can't be found. For 'exec' resources only the command's
+        executable (e.g. a script) is watched, not any files the command reads.
+        """
+
+        if self.rtype == "file":
+            path = self.src % params
+        else:
+            words = (self.src % params).split()
+            if len(words) == 0:
+                return None
+            path = find_executable(words[0])
+            if path is None:
+                return None
+
         try:
-            (handle, self.cache_path) = tempfile.mkstemp(prefix="pycoon")
-            if isinstance(result, file):
-                handle.write(result.read())
-                self.cache_class = "file"
-            else:
-                pickler = cPickle.Pickler(handle)
-                pickler.dump(result)
-                self.cache_class = "pickle"
-        except PicklingError:
-            self.cache_class = None
-        
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _expired(self, state, params):
+        """
+        Returns True if the result with the given state must be reloaded according to the reload policy.
+        """
+
+        (loaded, mtime, uses) = state
+        if self.reload_policy == "always":
+            return True
+        elif self.reload_policy == "modified":
+            return mtime is None or self._mtime(params) != mtime
+        elif self.reload_policy == "wait":
+            return time.time() - loaded >= self.interval
+        elif self.reload_policy == "repeated":
+            return uses >= self.repeats
+        else:
+            return False
+
+    def store(self, result, **params):
+        """
+        Stores (caches) the given result for the given parameters. result may be any Python object
+        which can be pickled (e.g. a character string) or it may be a file-like object. Returns the
+        result to use in place of the given one (a file-like result is used up by being stored) or
+        the given result if it couldn't be stored.
+        """
+
+        if self.result_store is None or self.reload_policy == "always":
+            return result
+
+        if hasattr(result, "read"):
+            # read the whole result first so that it can still be used if it can't be stored
+            data = result.read()
+            result.close()
+            result = StringIO(data)
+
+        key = self._key(params)
+        if self.reload_policy == "modified":
+            # take the modification time before the result is stored so that any later change causes a reload
+            mtime = self._mtime(params)
+        else:
+            mtime = None
+
+        if not self.result_store.put(key, result, [time.time(), mtime, 0]):
+            # e.g. the result is too large or can't be pickled
+            if hasattr(result, "seek"):
+                result.seek(0)
+            return result
+
+        stored = self.result_store.get(key)
+        if stored is False:
+            # it has been removed by another thread in the meantime
+            if hasattr(result, "seek"):
+                result.seek(0)
+            return result
+        else:
+            return stored
+
     def _retrieve(self, **params):
         """
-        Retrieves the data for this resource from the cache. Returns False upon failure.
+        Retrieves the data for this resource from the cache. Returns False upon failure or if the
+        reload policy requires the resource to be reloaded.
         """
 
-        try:
-            if self.cache_class == "file":
-                return file(self.cache_path, 'r')
-            elif self.cache_class == "pickle":
-                unpickler = cPickle.Unpickler(file(self.cache_path, 'r'))
-                return unpickle.load()
-        except (AttributeError, IOError, OSError, UnpicklingError, EOFError, ImportError, IndexError):
+        if self.result_store is None:
             return False
 
+        key = self._key(params)
+        self.lock.acquire()
+        try:
+            state = self.result_store.get_state(key)
+            if state is None or self._expired(state, params):
+                return False
+            state[2] += 1
+        finally:
+            self.lock.release()
+
+        return self.result_store.get(key)
+
+    def retrieve(self, **params):
+        """
+        Returns the stored result for the given parameters or False if the resource must be reloaded.
+        Resources with a custom_result use this and store() in place of calling the resource.
+        """
+
+        return self._retrieve(**params)
+
     def __del__(self):
         """
         resource destructor. Attempt to remove any existing cache files.
         """
 
         try:
-            os.remove(self.cache_path)
-        except (AttributeError, OSError):
+            for key in self.result_store.keys():
+                if key[0] == id(self):
+                    self.result_store.remove(key)
+        except AttributeError:
             pass
-        
+
     def __call__(self, **params):
         """
         Determine whether to call self._load() or self._retrieve() on this resource to obtain data
         based on the caching policy. Returns data.
         """
+
+        data = self._retrieve(**params)
+        if data is not False:
+            return data
+
+        result = self._load(**params)
+        if self.custom_result:
+            return result
+        else:
+            return self.store(result, **params)
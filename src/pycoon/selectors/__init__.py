@@ -7,8 +7,9 @@ The selectors module provides the selector class which is the base class of all
 selector classes.
 """
 
-from pycoon.components import syntax_component, invokation_syntax, ComponentError
-import lxml.etree
+from pycoon.components import syntax_component, invokation_syntax, ComponentError, event_stream
+from pycoon.interpolation import interpolate
+import lxml.etree, re
 
 class SelectorError(ComponentError): pass
 
@@ -66,6 +67,23 @@ class selector(syntax_component):
 
         raise NotImplemented()
 
+    def when_results(self, req):
+        """
+        Returns a tuple of the results of when_func for the conditions of each of this selector's <when>
+        children, i.e. which branches the request chooses. Selectors which test request headers use it in
+        their cache_key so that all the requests which choose the same branches share cached results,
+        rather than each header value (e.g. each User-agent string) having its own.
+
+        @req: a request_context
+        """
+
+        results = []
+        for c in self.children:
+            if c.function == "when":
+                results.append(self.when_func(req, re.split("\s+", interpolate(c, req, c.test))))
+
+        return tuple(results)
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         If the parent selector is 'exclusive' (default) _result simply returns either the last child
@@ -80,6 +98,12 @@ class selector(syntax_component):
                 return (True, p_sibling_result)
         
         elif self.method == "inclusive":
+            # the results are put together in one tree
+            child_results = list(child_results)
+            for i in range(len(child_results)):
+                if isinstance(child_results[i], event_stream):
+                    child_results[i] = child_results[i].to_tree()
+
             if len(child_results) > 0:
                 first = None
                 for c, i in zip(child_results, range(len(child_results))):
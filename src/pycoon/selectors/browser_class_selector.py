@@ -37,6 +37,15 @@ BROWSER_CLASSES = {
     re.compile(".*MSIE.*", re.I): "graphic",
     re.compile(".*Safari.*", re.I): "graphic"}
 
+def browser_classes(user_agent):
+    """
+    Returns a sorted tuple of the known browser classes which the given 'User-agent' header value
+    belongs to.
+    """
+
+    classes = set([bclass for regex, bclass in BROWSER_CLASSES.items() if regex.match(user_agent) is not None])
+    return tuple(sorted(classes))
+
 class browser_class_selector(selector):
     """
     browser_class_selector allows pipeline processing to be conditional upon the type of
@@ -53,6 +62,10 @@ class browser_class_selector(selector):
         self.description = "browser_class_selector()"
         self.selector_type = "browser-class"
 
+    def cache_key(self, req):
+        # the result depends only on the classes of the browser, not on its exact 'User-agent' string
+        return selector.cache_key(self, req) + browser_classes(req.headers_in["User-agent"])
+
     def when_func(self, req, conditions):
         """
         This is the function which child <when> elements of this selector should use to implement
@@ -61,10 +74,11 @@ class browser_class_selector(selector):
         conditions.
         """
     
-        # loop over all the known browser classes
-        for regex, bclass in BROWSER_CLASSES.items():
-            # return True if one of them matches the 'User-agent' header
-            if bclass in conditions and regex.match(req.headers_in["User-agent"]) is not None:
+        req.add_vary("User-agent")
+
+        # return True if the browser belongs to one of the given classes
+        for bclass in browser_classes(req.headers_in["User-agent"]):
+            if bclass in conditions:
                 return True
 
         # if this point is reached there was no matching known browser class
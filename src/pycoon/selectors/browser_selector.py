@@ -45,6 +45,9 @@ class browser_selector(selector):
         self.description = "browser_selector()"
         self.selector_type = "browser"
 
+    def cache_key(self, req):
+        return selector.cache_key(self, req) + self.when_results(req)
+
     def when_func(self, req, conditions):
         """
         This is the function which child <when> elements of this selector should use to implement
@@ -53,6 +56,8 @@ class browser_selector(selector):
         given conditions.
         """
 
+        req.add_vary("User-agent")
+
         for cond in conditions:
             if re.match(".+%s.*" % cond, req.headers_in["User-agent"], re.I) is not None:
                 return True
@@ -48,6 +48,9 @@ class request_header_selector(selector):
 
         self.description = "Request header selector(\"%s\")" % self.header
 
+    def cache_key(self, req):
+        return selector.cache_key(self, req) + self.when_results(req)
+
     def when_func(self, req, conditions):
         """
         This is the function which child <when> elements of this selector should use to implement
@@ -56,7 +59,9 @@ class request_header_selector(selector):
         parameter's value True is returned.
         """
 
-        header_name = interpolate(self, self.header)
+        header_name = interpolate(self, req, self.header)
+        req.add_vary(header_name)
+
         if req.headers_in.has_key(header_name):
             header_value = req.headers_in[header_name]
         else:
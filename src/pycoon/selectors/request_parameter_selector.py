@@ -63,6 +63,10 @@ class request_parameter_selector(selector):
         if self.uri_matcher is None:
             raise SelectorError("%s has no uri_matcher or error_matcher instance in pipeline" % self.description)
 
+    def cache_key(self, req):
+        parameter = interpolate(self, req, self.parameter)
+        return selector.cache_key(self, req) + (self.uri_matcher.match(req).query_dict.get(parameter),)
+
     def when_func(self, req, conditions):
         """
         This is the function which child <when> elements of this selector should use to implement
@@ -71,12 +75,13 @@ class request_parameter_selector(selector):
         parameter's value True is returned.
         """
 
-        parameter = interpolate(self, self.parameter)
+        parameter = interpolate(self, req, self.parameter)
         param_value = ""
         
         if req.method == "GET":
-            if self.uri_matcher.query_dict.has_key(parameter):
-                param_value = self.uri_matcher.query_dict[parameter]
+            query_dict = self.uri_matcher.match(req).query_dict
+            if query_dict.has_key(parameter):
+                param_value = query_dict[parameter]
             
         elif req.method == "POST":
             # whats the correct method for reading POSTed data?
@@ -89,7 +94,7 @@ class request_parameter_selector(selector):
                 else:
                     name = p
                     value = ""
-                self.param_dict[name] = value
+                param_dict[name] = value
 
             if param_dict.has_key(parameter):
                 param_value = param_dict[parameter]
@@ -54,7 +54,8 @@ class resource_exists_selector(selector):
         """
 
         for res in conditions:
-            path = interpolate(self, res, as_filename=True, root_path=self.root_path)
+            path = interpolate(self, req, res, as_filename=True, root_path=self.root_path)
+            req.add_dependency(path)
             try:
                 os.stat(path)
             except OSError:
@@ -73,10 +73,10 @@ class when(syntax_component):
             raise WhenError("when \"%s\": Could not find a parent selector component." % self.test)
 
     def _descend(self, req, p_sibling_result=None):
-        return self.selector.when_func(req, re.split("\s+", interpolate(self, self.test)))
+        return self.selector.when_func(req, re.split("\s+", interpolate(self, req, self.test)))
 
     def _continue(self, req, p_sibling_result=None):
         if self.selector.method == "inclusive":
             return True
         else:
-            return not self.selector.when_func(req, re.split("\s+", interpolate(self, self.test)))
+            return not self.selector.when_func(req, re.split("\s+", interpolate(self, req, self.test)))
@@ -7,10 +7,75 @@ The serializers module provides the serializer class which is the base class of
 serializer classes.
 """
 
-from pycoon.components import stream_component, invokation_syntax, ComponentError
+from pycoon.components import stream_component, invokation_syntax, ComponentError, event_stream
+from pycoon.helpers import result_chunks
+import lxml.etree
 
 class SerializerError(ComponentError): pass
 
+def serialize_chunks(tree, declaration=None, chunk_size=64 * 1024):
+    """
+    Returns a result_chunks of the given lxml Element (or event_stream) serialized as UTF-8 (preceded by
+    the given XML declaration string, if there is one). The element's start tag and each of its children
+    are serialized in turn as the chunks are written, so only one child's serialization is in memory at
+    a time rather than the whole document. Elements which declare namespaces are serialized at once,
+    because their children can't be serialized separately without repeating the declarations (as are
+    ElementTrees and elements without children); the children of an event_stream are always serialized
+    separately, so they may repeat the root's namespace declarations. Raises TypeError if tree isn't an
+    Element, ElementTree or event_stream.
+
+    @tree: an lxml Element (or ElementTree or event_stream)
+    @declaration: the XML declaration string. Optional
+    @chunk_size: the number of bytes which are collected before a chunk is written. Optional
+    """
+
+    if not isinstance(tree, (lxml.etree._Element, lxml.etree._ElementTree, event_stream)):
+        raise TypeError("serialize_chunks requires an Element, not %s" % type(tree).__name__)
+
+    def pieces():
+        if declaration is not None:
+            yield declaration
+
+        if isinstance(tree, event_stream):
+            shell = tree.shell()
+        elif not isinstance(tree, lxml.etree._Element) or not isinstance(tree.tag, basestring)\
+                 or len(tree.nsmap) > 0 or tree.tail is not None or len(tree) == 0:
+            yield lxml.etree.tostring(tree, encoding="utf-8", xml_declaration=False)
+            return
+        else:
+            # an empty copy of the element
+            shell = lxml.etree.Element(tree.tag)
+            for name, value in tree.items():
+                shell.set(name, value)
+            shell.text = tree.text
+
+        # serialize the empty element (with its text) and split off its end tag
+        if shell.text is None:
+            shell.text = ""
+        start_tag = lxml.etree.tostring(shell, encoding="utf-8", xml_declaration=False)
+        end_pos = start_tag.rindex("</")
+        yield start_tag[:end_pos]
+
+        for child in tree:
+            yield lxml.etree.tostring(child, encoding="utf-8", xml_declaration=False, with_tail=True)
+
+        yield start_tag[end_pos:]
+
+    def chunks():
+        buf = []
+        size = 0
+        for piece in pieces():
+            buf.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield "".join(buf)
+                buf = []
+                size = 0
+        if size > 0:
+            yield "".join(buf)
+
+    return result_chunks(chunks())
+
 def register_invokation_syntax(server):
     """
     Allows the component to register the required XML element syntax for it's invokation
@@ -35,6 +100,7 @@ class serializer(stream_component):
 
     role = "stream"
     function = "serialize"
+    reads_input_only = True
     
     def __init__(self, parent, root_path=""):
         stream_component.__init__(self, parent, root_path)
@@ -6,9 +6,8 @@ This software is licensed under the terms of the GNU GPL.
 This module implements the text serializer.
 """
 
-from pycoon.serializers import serializer, SerializerError
+from pycoon.serializers import serializer, SerializerError, serialize_chunks
 from pycoon.components import invokation_syntax
-from lxml.etree import tounicode
 import os
 
 def register_invokation_syntax(server):
@@ -33,6 +32,9 @@ class text_serializer(serializer):
     text_serializer class allows the pipeline result to be serialized into plain text.
     """
 
+    # an event_stream is serialized as it is read
+    streaming = True
+
     def __init__(self, parent, mime="text/plain", root_path=""):
         """
         text_serializer constructor.
@@ -47,11 +49,11 @@ class text_serializer(serializer):
 
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
-        Executes lxml.etree.tounicode() on the pipeline's result tree.
+        Returns the pipeline's result tree as a result_chunks which is serialized as it is written.
         """
 
         try:
-            return (True, (tounicode(p_sibling_result).encode("utf-8"), self.mime_str))
+            return (True, (serialize_chunks(p_sibling_result), self.mime_str))
         except TypeError:
             if p_sibling_result is None:
                 raise SerializerError("text_serializer: preceding pipeline components have returned no content!")
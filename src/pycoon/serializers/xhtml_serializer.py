@@ -7,7 +7,7 @@ This software is licensed under the terms of the GNU GPL.
 from pycoon.serializers import serializer, SerializerError
 from pycoon.components import invokation_syntax
 from pycoon.helpers import correct_script_chars
-from lxml.etree import tounicode
+from lxml.etree import tostring
 import os
 
 try:
@@ -60,9 +60,9 @@ class xhtml_serializer(serializer):
                 options = dict(output_xhtml=1, add_xml_decl=1, doctype="strict", indent=1, wrap=120, tidy_mark=0,\
                                input_encoding="utf8", output_encoding="utf8")
             
-                return (True, (correct_script_chars(str(tidy.parseString(tounicode(p_sibling_result).encode("utf-8"), **options))), self.mime_str))
+                return (True, (correct_script_chars(str(tidy.parseString(tostring(p_sibling_result, encoding="utf-8", xml_declaration=False), **options))), self.mime_str))
             else:
-                return (True, (correct_script_chars(tounicode(p_sibling_result).encode("utf-8")), self.mime_str))
+                return (True, (correct_script_chars(tostring(p_sibling_result, encoding="utf-8", xml_declaration=False)), self.mime_str))
         except TypeError:
             if p_sibling_result is None:
                 raise SerializerError("xhtml_serializer: preceding pipeline components have returned no content!")
@@ -4,9 +4,8 @@ Copyright (C) Richard Lewis 2006
 This software is licensed under the terms of the GNU GPL.
 """
 
-from pycoon.serializers import serializer, SerializerError
+from pycoon.serializers import serializer, SerializerError, serialize_chunks
 from pycoon.components import invokation_syntax
-from lxml.etree import tounicode
 
 def register_invokation_syntax(server):
     """
@@ -30,6 +29,9 @@ class xml_serializer(serializer):
     xml_serializer class simply returns the XML source as a character stream.
     """
 
+    # an event_stream is serialized as it is read
+    streaming = True
+
     def __init__(self, parent, mime="text/xml", root_path=""):
         """
         xml_serializer constructor.
@@ -44,11 +46,11 @@ class xml_serializer(serializer):
 
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
-        Executes lxml.etree.tounicode with the p_sibling_result and returns the resultant XML.
+        Returns the XML of the p_sibling_result as a result_chunks which is serialized as it is written.
         """
 
         try:
-            return (True, ("<?xml version=\"1.0\"?>%s" % tounicode(p_sibling_result), self.mime_str))
+            return (True, (serialize_chunks(p_sibling_result, "<?xml version=\"1.0\"?>"), self.mime_str))
         except TypeError:
             if p_sibling_result is None:
                 raise SerializerError("xml_serializer: preceding pipeline components have returned no content!")
@@ -12,9 +12,10 @@ from xml.sax import parse, SAXException
 from xml.sax.handler import ContentHandler
 from pycoon import apache, PycoonConfigurationError
 from interpolation import *
-from pycoon.helpers import attributes2options
+from pycoon.helpers import attributes2options, write_result
 from pycoon.pipeline import pipeline, build_pipeline
 from pycoon.components import register_component, ComponentError
+from pycoon.request_context import get_request_context
 
 class server_config(object):
     """
@@ -30,15 +31,60 @@ class server_config(object):
         self.log_requests = False      # all requests;
         self.log_debug = False         # debugging;
 
-        self.EXCEPTION = None          # this will hold the exception info and traceback whenever an exception occurs
-
         self.use_requests_cache = False # flag indicates whether request caching should be used
         self.MAX_REQUESTS_CACHE = 20   # the maximum number of cached requests
         self.MAX_REQUEST_SIZE = 1024 * 1024 # the maximum size (in bytes) of requests that can be cached
+        self.MAX_REQUESTS_CACHE_SIZE = 16 * 1024 * 1024 # the maximum total size (in bytes) of the cached requests
 
         self.use_files_cache = False   # flag indicates whether file caching should be used
         self.MAX_FILES_CACHE = 10      # the maximum number of cached files
         self.MAX_CACHE_FILE_SIZE = 512 * 1024 # the maximum size (in bytes) of files that can be cached
+        self.FILES_CACHE_STAT_INTERVAL = 1 # the minimum number of seconds between checks of a cached file's mtime and size
+
+        self.use_documents_cache = False # flag indicates whether parsed source documents should be cached
+        self.MAX_DOCUMENTS_CACHE = 20  # the maximum number of cached documents
+        self.MAX_DOCUMENTS_CACHE_SIZE = 32 * 1024 * 1024 # the maximum total size (in bytes) of the files of the cached documents
+
+        self.use_stylesheets_cache = False # flag indicates whether compiled XSLT stylesheets should be cached
+        self.MAX_STYLESHEETS_CACHE = 20 # the maximum number of cached stylesheets (in each thread)
+
+        self.use_compression = False   # flag indicates whether responses should be compressed for clients which
+                                       # accept gzip (or deflate) content coding
+        self.MIN_COMPRESS_SIZE = 1024  # the minimum size (in bytes) of responses which are compressed
+        self.COMPRESSION_LEVEL = 6     # the zlib compression level [1-9]
+
+        self.use_shared_cache = False  # flag indicates whether the requests and pipeline caches should be kept in a
+                                       # file shared by every server process rather than in each process's memory
+        self.SHARED_CACHE_PATH = ""    # the path of the shared cache's database file
+        self.MAX_SHARED_CACHE_SIZE = 64 * 1024 * 1024 # the maximum total size (in bytes) of the shared cache
+
+        self.use_resources_cache = False # flag indicates whether the results of resources (e.g. commands and
+                                         # database queries) may be kept on disk according to their reload policies
+        self.MAX_RESOURCES_CACHE = 50  # the maximum number of stored resource results
+        self.MAX_RESOURCES_CACHE_SIZE = 16 * 1024 * 1024 # the maximum total size (in bytes) of the stored resource results
+
+        self.use_conditional_get = False # flag indicates whether ETag/Last-Modified headers should be sent and
+                                         # conditional GET requests answered with 304 (Not Modified)
+        self.MAX_VALIDATORS = 1000     # the maximum number of remembered response validators
+
+        self.use_not_found_cache = False # flag indicates whether URIs which no pipeline matches (and their rendered
+                                         # error pages) should be remembered
+        self.MAX_NOT_FOUND_CACHE = 1000 # the maximum number of remembered not-found URIs
+        self.MAX_NOT_FOUND_CACHE_SIZE = 4 * 1024 * 1024 # the maximum total size (in bytes) of their error pages
+
+        self.use_parallel_aggregates = False # flag indicates whether aggregates with parallel="yes" may call their
+                                             # children concurrently
+        self.MAX_AGGREGATE_THREADS = 8 # the maximum number of threads which call the children of parallel aggregates
+        self.AGGREGATE_TIMEOUT = 30    # the default number of seconds a parallel aggregate waits for each child
+
+        self.use_http_pool = False     # flag indicates whether the connections of HTTP generators should be kept open
+                                       # and reused for later requests to the same host
+        self.MAX_HTTP_CONNECTIONS = 10 # the maximum number of connections to each host which are in use at once
+        self.HTTP_CONNECT_TIMEOUT = 5  # the number of seconds to wait for a connection to be made (or to be free)
+        self.HTTP_READ_TIMEOUT = 30    # the number of seconds to wait for a server to send each part of a response
+        self.HTTP_IDLE_TIMEOUT = 60    # the number of seconds for which an unused connection is kept open
+
+        self.uri_dispatch = "trie"     # how sitemap pipelines are found for a request: [trie|regex|linear]
 
         self.component_super_types = ["built-in", "matchers", "selectors", "authenticators", "generators", "transformers", "serializers"]
         self.component_types = ["component", "matcher", "selector", "generator", "transformer", "serializer"]
@@ -49,6 +95,9 @@ class server_config(object):
                                        # (indexed by (element name, type value)
 
         self.interpolation_syntaxes = {} # dictionary of available interpolation_syntax object (indexed by name)
+        self.interpolation_prefixes = {} # dictionary of interpolation_syntax objects (indexed by instruction prefix)
+        self.unprefixed_interpolation_syntaxes = [] # list of interpolation_syntax objects with no prefix, which
+                                                    # are tried for every instruction (in registration order)
 
         self.ds_initialisers = {}      # dictionary of available generator component data-source initialisation methods
                                        # (indexed by source name)
@@ -97,7 +146,15 @@ class server_config(object):
                 attrs_dict['parent'] = parent
                 attrs_dict['root_path'] = root_path
 
-                return self.components[component_id](**attrs_dict)
+                new_component = self.components[component_id](**attrs_dict)
+
+                # compile the component's attribute strings so that they needn't be parsed
+                # each time they're interpolated
+                for name, value in attrs_dict.items():
+                    if isinstance(value, str) and name != "root_path":
+                        new_component.templates[value] = interpolation_template(new_component, value)
+
+                return new_component
         else:
             raise ComponentError("Could not find a component to match: <%s type=\"%s\">" % component_id)
 
@@ -105,10 +162,12 @@ class server_config(object):
         """
         Attempt to use the error_pipelines to handle the given error code.
 
-        @req: an Apache request object
+        @req: an Apache request object or a request_context
         @error_code: an Apache error code
         """
 
+        req = get_request_context(req)
+
         for p in self.pipelines:
             (success, result, mime) = p.handle_error(req)
         
@@ -119,8 +178,7 @@ class server_config(object):
                     self.error_log.write("Server handling error %s; request: \"%s\"" % (error_code, req.unparsed_uri))
 
                 req.content_type = mime
-                req.set_content_length(len(result))
-                req.write(result)
+                write_result(req, result)
 
                 return (True, apache.DONE)
 
@@ -133,6 +191,32 @@ class server_config(object):
 
 class ServerConfigurationError(PycoonConfigurationError): pass
 
+# the server_config properties set by the cache option elements of the server configuration file
+# (indexed by element name)
+_cache_properties = {"max-files-cache": "MAX_FILES_CACHE",
+                     "max-file-size": "MAX_CACHE_FILE_SIZE",
+                     "file-stat-interval": "FILES_CACHE_STAT_INTERVAL",
+                     "max-requests-cache": "MAX_REQUESTS_CACHE",
+                     "max-request-size": "MAX_REQUEST_SIZE",
+                     "max-requests-cache-size": "MAX_REQUESTS_CACHE_SIZE",
+                     "max-documents-cache": "MAX_DOCUMENTS_CACHE",
+                     "max-documents-cache-size": "MAX_DOCUMENTS_CACHE_SIZE",
+                     "max-stylesheets-cache": "MAX_STYLESHEETS_CACHE",
+                     "max-shared-cache-size": "MAX_SHARED_CACHE_SIZE",
+                     "min-compress-size": "MIN_COMPRESS_SIZE",
+                     "compression-level": "COMPRESSION_LEVEL",
+                     "max-resources-cache": "MAX_RESOURCES_CACHE",
+                     "max-resources-cache-size": "MAX_RESOURCES_CACHE_SIZE",
+                     "max-validators": "MAX_VALIDATORS",
+                     "max-not-found-cache": "MAX_NOT_FOUND_CACHE",
+                     "max-not-found-cache-size": "MAX_NOT_FOUND_CACHE_SIZE",
+                     "max-aggregate-threads": "MAX_AGGREGATE_THREADS",
+                     "aggregate-timeout": "AGGREGATE_TIMEOUT",
+                     "max-http-connections": "MAX_HTTP_CONNECTIONS",
+                     "http-connect-timeout": "HTTP_CONNECT_TIMEOUT",
+                     "http-read-timeout": "HTTP_READ_TIMEOUT",
+                     "http-idle-timeout": "HTTP_IDLE_TIMEOUT"}
+
 class server_config_parse(ContentHandler):
     """
     server_config_parse parses the server configuration XML file (using SAX) and populates the given server_config
@@ -166,7 +250,12 @@ class server_config_parse(ContentHandler):
         elif name == "details": pass
         
         elif name in ["name", "admin-email", "max-files-cache", "max-file-size",\
-                    "max-requests-cache", "max-request-size"]:
+                    "max-requests-cache", "max-request-size", "max-requests-cache-size", "file-stat-interval",\
+                    "max-documents-cache", "max-documents-cache-size", "max-stylesheets-cache",\
+                    "max-validators", "max-shared-cache-size", "max-resources-cache", "max-resources-cache-size",\
+                    "min-compress-size", "compression-level", "max-not-found-cache", "max-not-found-cache-size",\
+                    "max-aggregate-threads", "aggregate-timeout", "max-http-connections",\
+                    "http-connect-timeout", "http-read-timeout", "http-idle-timeout"]:
             # these are the text-only configuration details
             # instruct the parser to collect the textual content of the elements
             self.chars = u""
@@ -186,6 +275,94 @@ class server_config_parse(ContentHandler):
                 if self.server.log_debug: self.server.error_log.write("Using requests cache is True.")
             elif attrs['use'] == "no": self.server.use_requests_cache = False
 
+        elif name == "documents-cache":
+            # boolean option "documents-cache": specifies whether generators' parsed source documents should be cached
+            if attrs['use'] == "yes":
+                self.server.use_documents_cache = True
+                if self.server.log_debug: self.server.error_log.write("Using documents cache is True.")
+            elif attrs['use'] == "no": self.server.use_documents_cache = False
+
+        elif name == "stylesheets-cache":
+            # boolean option "stylesheets-cache": specifies whether compiled XSLT stylesheets should be cached
+            if attrs['use'] == "yes":
+                self.server.use_stylesheets_cache = True
+                if self.server.log_debug: self.server.error_log.write("Using stylesheets cache is True.")
+            elif attrs['use'] == "no": self.server.use_stylesheets_cache = False
+
+        elif name == "compression":
+            # boolean option "compression": specifies whether responses should be compressed for clients which
+            # accept it (compressed responses are stored in the requests cache)
+            if attrs['use'] == "yes":
+                self.server.use_compression = True
+                if self.server.log_debug: self.server.error_log.write("Using compression is True.")
+            elif attrs['use'] == "no": self.server.use_compression = False
+
+        elif name == "shared-cache":
+            # boolean option "shared-cache": specifies whether the requests and pipeline caches should be kept in
+            # the database file given by the 'path' attribute so that they are shared by every server process
+            if attrs['use'] == "yes":
+                if not attrs.has_key('path') or len(attrs['path'].strip()) == 0:
+                    raise ServerConfigurationError("<shared-cache> element must have a 'path' attribute.")
+                self.server.use_shared_cache = True
+                self.server.SHARED_CACHE_PATH = str(attrs['path'])
+                if self.server.log_debug: self.server.error_log.write("Using shared cache is True.")
+            elif attrs['use'] == "no": self.server.use_shared_cache = False
+
+        elif name == "resources-cache":
+            # boolean option "resources-cache": specifies whether the results of resources may be kept on disk
+            # between reloads (see the reload attribute of the command and sql generators)
+            if attrs['use'] == "yes":
+                self.server.use_resources_cache = True
+                if self.server.log_debug: self.server.error_log.write("Using resources cache is True.")
+            elif attrs['use'] == "no": self.server.use_resources_cache = False
+
+        elif name == "conditional-get":
+            # boolean option "conditional-get": specifies whether responses should have ETag and Last-Modified
+            # headers and conditional GET requests should be answered with 304 (Not Modified)
+            if attrs['use'] == "yes":
+                self.server.use_conditional_get = True
+                if self.server.log_debug: self.server.error_log.write("Using conditional GET is True.")
+            elif attrs['use'] == "no": self.server.use_conditional_get = False
+
+        elif name == "not-found-cache":
+            # boolean option "not-found-cache": specifies whether URIs which no pipeline matches should be remembered
+            # (with their rendered error pages)
+            if attrs['use'] == "yes":
+                self.server.use_not_found_cache = True
+                if self.server.log_debug: self.server.error_log.write("Using not-found cache is True.")
+            elif attrs['use'] == "no": self.server.use_not_found_cache = False
+
+        elif name == "sitemap-stat-interval":
+            # the not-found cache no longer checks the sitemap file, but older configuration files may still
+            # give this option, so it is ignored
+            if self.server.log_debug: self.server.error_log.write("Ignored obsolete option <sitemap-stat-interval>.")
+
+        elif name == "parallel-aggregates":
+            # boolean option "parallel-aggregates": specifies whether aggregates with parallel="yes" may call
+            # their children concurrently (in a pool of at most max-aggregate-threads threads)
+            if attrs['use'] == "yes":
+                self.server.use_parallel_aggregates = True
+                if self.server.log_debug: self.server.error_log.write("Using parallel aggregates is True.")
+            elif attrs['use'] == "no": self.server.use_parallel_aggregates = False
+
+        elif name == "http-pool":
+            # boolean option "http-pool": specifies whether the connections of HTTP generators should be kept open
+            # and reused (the connection limit and timeouts apply either way)
+            if attrs['use'] == "yes":
+                self.server.use_http_pool = True
+                if self.server.log_debug: self.server.error_log.write("Using HTTP pool is True.")
+            elif attrs['use'] == "no": self.server.use_http_pool = False
+
+        elif name == "uri-dispatch":
+            # option "uri-dispatch": specifies how the sitemap finds the pipelines which may match a request URI;
+            # 'trie' (default) uses an index of pattern prefixes, 'regex' uses a combined regular expression of
+            # all the top-level matcher patterns and 'linear' tries every pipeline in turn
+            if attrs['mode'] in ["trie", "regex", "linear"]:
+                self.server.uri_dispatch = str(attrs['mode'])
+                if self.server.log_debug: self.server.error_log.write("URI dispatch mode is %s." % self.server.uri_dispatch)
+            else:
+                raise ServerConfigurationError("Invalid uri-dispatch mode: %s" % attrs['mode'])
+
         elif name == "logging": pass
 
         elif name == "log-up-down":
@@ -278,15 +455,14 @@ class server_config_parse(ContentHandler):
             except KeyError:
                 raise ServerConfigurationError("Unknown server property: %s" % name)
             
-        elif name in ["max-files-cache", "max-file-size",\
-                    "max-requests-cache", "max-request-size"]:
+        elif name in _cache_properties.keys():
             try:
-                self.server.__dict__[name.replace("-", "_")] = eval(str(self.chars))
+                self.server.__dict__[_cache_properties[name]] = eval(str(self.chars))
                 self.col_chars = False
                 self.chars = u""
                 if self.server.log_debug:
                     self.server.error_log.write("Set server property: \"%s\": \"%s\"." %\
-                                           (str(name.replace("-", "_")), self.server.__dict__[str(name.replace("-", "_"))]))
+                                           (_cache_properties[name], self.server.__dict__[_cache_properties[name]]))
             except KeyError:
                 raise ServerConfigurationError("Unknown server property: %s" % name)
             except SyntaxError:
@@ -7,12 +7,22 @@ The sitemap module contains the sitemap_config class and its configuration file
 parser class.
 """
 
-import string, os
+import string, os, sys, traceback, zlib, threading
+from StringIO import StringIO
+from email.Utils import formatdate, parsedate_tz, mktime_tz
 from xml.sax import parse, SAXException
 from xml.sax.handler import ContentHandler
 from pycoon import apache, PycoonConfigurationError
-from pycoon.helpers import attributes2options
+from pycoon.helpers import attributes2options, write_result, fake_request, choose_encoding, compressible_mime,\
+     gzip_compress, gzip_decompress, normalize_uri, result_chunks, compress_chunks, worker_pool
 from pycoon.pipeline import pipeline, build_pipeline
+from pycoon.dispatch import uri_dispatch_index, uri_dispatch_regex
+from pycoon.request_context import get_request_context
+from pycoon.cache import lru_cache, shared_cache, cached_response, files_cache, documents_cache, stylesheets_cache,\
+     make_validator, file_mtime, single_flight
+from pycoon.resources import resource_store, http_pool
+from pycoon.generators import parse_file
+from pycoon.transformers.xslt_transformer import compile_stylesheet
 
 class sitemap_config(object):
     """
@@ -25,41 +35,326 @@ class sitemap_config(object):
         self.server = self.parent
         
         self.server_name = ""          # the name of the VirtualHost on which the handler is running
+        self.filename = ""             # the URL of the sitemap file
         self.document_root = ""        # the absolute path of the web application
 
         self.data_sources = {}         # a dictionary of database connections
+        self.data_source_locks = {}    # a dictionary of threading.Lock objects which serialize the use of each data
+                                       # source by concurrent requests (indexed by data source name)
         self.ds_mods = {}              # a dictionary of Python modules which implement database bindings
 
         self.pipelines = []            # a list of pipeline objects
+        self.warm_up_uris = []         # a list of URIs which are requested once the sitemap is loaded
+        self.dispatch_index = None     # a uri_dispatch_index or uri_dispatch_regex of the pipelines; built
+                                       # once the sitemap is loaded
+        self.pipeline_positions = {}   # dictionary of the positions of the pipelines in the list (indexed by
+                                       # pipeline)
+
+        self.requests_cache = None     # an lru_cache (or shared_cache) of cached_response objects (indexed by
+                                       # normalized uri or, for responses which depend on request headers, by
+                                       # variant_key); created once the sitemap is loaded if the server's requests
+                                       # cache is used
+        self.files_cache = None        # a files_cache used by read components; created once the sitemap
+                                       # is loaded if the server's files cache is used
+        self.documents_cache = None    # a documents_cache used by generators; created once the sitemap is
+                                       # loaded if the server's documents cache is used
+        self.stylesheets_cache = None  # a stylesheets_cache used by XSLT transformers; created once the sitemap
+                                       # is loaded if the server's stylesheets cache is used
+        self.resource_store = None     # a resource_store used by the resources of generators; created once the
+                                       # sitemap is loaded if the server's resources cache is used
+        self.validators = None         # an lru_cache of response_validator objects (indexed by (pipeline,
+                                       # pipeline.cache_key)); created once the sitemap is loaded if the
+                                       # server uses conditional GET
+        self.pipeline_cache = None     # an lru_cache (or shared_cache) of cached_response objects (indexed by
+                                       # pipeline.cache_key); created once the sitemap is loaded if any pipeline
+                                       # has a cache_as name
+        self.flights = None            # a single_flight used to compute each pipeline cache item once; created
+                                       # with the pipeline cache
+        self.not_found_cache = None    # an lru_cache of cached_response objects of the error pages of URIs which
+                                       # no pipeline matches (indexed by uri); created once the sitemap is loaded
+                                       # if the server uses the not-found cache
+        self.aggregate_pool = None     # a worker_pool which calls the children of parallel aggregates; created
+                                       # once the sitemap is loaded if the server uses parallel aggregates
+        self.http_pool = None          # an http_pool used by HTTP generators; created once the sitemap is loaded
+
+    def build_dispatch_index(self):
+        """
+        Builds the index used by handle() to find the pipelines which may match a request, according
+        to the server's uri_dispatch option. Should be called whenever the list of pipelines changes.
+        """
+
+        self.pipeline_positions = dict([(self.pipelines[i], i) for i in range(len(self.pipelines))])
+
+        if self.server.uri_dispatch == "trie":
+            self.dispatch_index = uri_dispatch_index(self.pipelines)
+        elif self.server.uri_dispatch == "regex":
+            self.dispatch_index = uri_dispatch_regex(self.pipelines)
+        else:
+            self.dispatch_index = None
+
+    def data_source_lock(self, name):
+        """
+        Returns the lock which must be held while the data source with the given name is used (e.g. while
+        a query is executed on its cursor and the result is fetched), because data sources are shared by
+        every request.
+        """
+
+        return self.data_source_locks.setdefault(name, threading.Lock())
 
-        #self.requests_cache = {}       # a dictionary of request reponses; indexed by uri
-        #self.requests_cache_queue = [] # a list of cached request uris in order of when they were cached
+    def response_cache(self, name):
+        """
+        Returns a new cache for cached_response objects: a shared_cache if the server uses the shared cache,
+        otherwise an lru_cache.
 
-        #self.files_cache = {}          # a dictionary of ordinary files cached in memory; indexed by file name
-        #self.files_cache_queue = []    # a list of cached file names in order of when they were cached
+        @name: the name of the cache; it distinguishes the cache's items from those of the sitemap's other
+               caches in the shared cache
+        """
+
+        if self.server.use_shared_cache:
+            # the items of other sitemaps (or earlier versions of this one) mustn't be used
+            namespace = repr((self.server_name, self.document_root, self.filename, self.sitemap_file_mtime(), name))
+
+            return shared_cache(self.server.SHARED_CACHE_PATH, self.server.MAX_SHARED_CACHE_SIZE, namespace)
+        else:
+            return lru_cache(self.server.MAX_REQUESTS_CACHE, self.server.MAX_REQUESTS_CACHE_SIZE)
+
+    def sitemap_file_mtime(self):
+        """
+        Returns the modification time of the sitemap file or None if it isn't a local file.
+        """
+
+        if self.filename.startswith("file://"):
+            return file_mtime(self.filename[len("file://"):])
+        else:
+            return None
+
+    def build_caches(self):
+        """
+        Creates the sitemap's caches according to the server's cache options.
+        """
+
+        if self.server.use_requests_cache:
+            self.requests_cache = self.response_cache("requests")
+        else:
+            self.requests_cache = None
+
+        if len([p for p in self.pipelines if p.cache_as != ""]) > 0:
+            self.pipeline_cache = self.response_cache("pipelines")
+            if self.server.use_shared_cache:
+                # the requests of other processes wait for each pipeline result to be computed too
+                self.flights = single_flight(self.server.SHARED_CACHE_PATH + ".locks")
+            else:
+                self.flights = single_flight()
+        else:
+            self.pipeline_cache = None
+            self.flights = None
+
+        if self.server.use_not_found_cache:
+            self.not_found_cache = lru_cache(self.server.MAX_NOT_FOUND_CACHE, self.server.MAX_NOT_FOUND_CACHE_SIZE)
+        else:
+            self.not_found_cache = None
+
+        if self.server.use_conditional_get:
+            self.validators = lru_cache(self.server.MAX_VALIDATORS, self.server.MAX_VALIDATORS)
+        else:
+            self.validators = None
+
+        if self.server.use_documents_cache:
+            self.documents_cache = documents_cache(self.server.MAX_DOCUMENTS_CACHE, self.server.MAX_DOCUMENTS_CACHE_SIZE,
+                                                   parse_file)
+        else:
+            self.documents_cache = None
+
+        if self.server.use_stylesheets_cache:
+            self.stylesheets_cache = stylesheets_cache(self.server.MAX_STYLESHEETS_CACHE, compile_stylesheet)
+        else:
+            self.stylesheets_cache = None
+
+        if self.server.use_resources_cache:
+            self.resource_store = resource_store(self.server.MAX_RESOURCES_CACHE, self.server.MAX_RESOURCES_CACHE_SIZE)
+        else:
+            self.resource_store = None
+
+        if self.server.use_files_cache:
+            self.files_cache = files_cache(self.server.MAX_FILES_CACHE, self.server.MAX_CACHE_FILE_SIZE,
+                                           self.server.FILES_CACHE_STAT_INTERVAL)
+        else:
+            self.files_cache = None
+
+        if self.aggregate_pool is not None:
+            self.aggregate_pool.close()
+        if self.server.use_parallel_aggregates:
+            self.aggregate_pool = worker_pool(self.server.MAX_AGGREGATE_THREADS)
+        else:
+            self.aggregate_pool = None
+
+        if self.http_pool is not None:
+            self.http_pool.close()
+        self.http_pool = http_pool(self.server.MAX_HTTP_CONNECTIONS, self.server.HTTP_CONNECT_TIMEOUT,
+                                   self.server.HTTP_READ_TIMEOUT, self.server.HTTP_IDLE_TIMEOUT,
+                                   self.server.use_http_pool)
+
+    def warm_up(self):
+        """
+        Prepares the sitemap to handle requests: calls the warm_up method of every component (e.g. to
+        compile stylesheets) and then handles a request for each of the warm-up URIs so that the caches
+        are filled. Errors are logged but otherwise ignored.
+        """
+
+        for p in self.pipelines:
+            stack = [p]
+            while len(stack) > 0:
+                c = stack.pop()
+                try:
+                    c.warm_up()
+                except Exception:
+                    if self.server.log_errors:
+                        self.server.error_log.write("Error warming up %s:\n%s" %\
+                                                    (c.description, string.join(traceback.format_exception(*sys.exc_info()), "\n")))
+                stack.extend(c.children)
+
+        for uri in self.warm_up_uris:
+            (success, status) = self.handle(fake_request(StringIO(), uri, self.server_name))
+            if self.server.log_up_down:
+                self.server.error_log.write("Warm-up request: \"%s\"; status: %s" % (uri, status))
+
+    def not_modified(self, req, validator):
+        """
+        Returns True if the request's If-None-Match (or, failing that, If-Modified-Since) header shows
+        that the client already has the response with the given response_validator.
+        """
+
+        if req.headers_in.has_key("If-None-Match"):
+            etags = [etag.strip() for etag in req.headers_in["If-None-Match"].split(",")]
+            # weak comparison is allowed for If-None-Match
+            etags = [etag.replace("W/", "", 1) for etag in etags]
+            return validator.etag in etags or "*" in etags
+
+        elif req.headers_in.has_key("If-Modified-Since") and validator.last_modified is not None:
+            since = parsedate_tz(req.headers_in["If-Modified-Since"])
+            if since is None:
+                return False
+            return int(validator.last_modified) <= mktime_tz(since)
+
+        return False
+
+    def set_validator_headers(self, req, validator):
+        """
+        Sets the ETag and Last-Modified headers of the response from the given response_validator.
+        """
+
+        if self.server.use_compression:
+            # the compressed and uncompressed responses are equivalent but not identical
+            req.headers_out["ETag"] = "W/" + validator.etag
+        else:
+            req.headers_out["ETag"] = validator.etag
+        if validator.last_modified is not None:
+            req.headers_out["Last-Modified"] = formatdate(validator.last_modified, usegmt=True)
+
+    def set_vary_header(self, req, header_names):
+        """
+        Sets the Vary header of the response to the given list of request header names.
+        """
+
+        if len(header_names) > 0:
+            req.headers_out["Vary"] = string.join(header_names, ", ")
+
+    def client_encoding(self, req):
+        """
+        Returns the content coding ('gzip' or 'deflate') which the client accepts for the response to the
+        request or None if the response shouldn't be compressed.
+        """
+
+        if req.headers_in.has_key("Accept-Encoding"):
+            return choose_encoding(req.headers_in["Accept-Encoding"])
+        else:
+            return None
+
+    def write_body(self, req, body, encoding=None, uncompressed=None):
+        """
+        Writes the given response body to the request in the content coding which the client accepts.
+
+        @req: a request_context
+        @body: the response body string
+        @encoding: the content coding of body ('gzip') or None if it isn't compressed. Optional
+        @uncompressed: the uncompressed body, if it is at hand. Optional
+        """
+
+        if encoding is None:
+            write_result(req, body)
+            return
+
+        client_encoding = self.client_encoding(req)
+        if client_encoding != encoding:
+            if uncompressed is not None:
+                body = uncompressed
+            else:
+                body = gzip_decompress(body)
+            if client_encoding == "deflate":
+                body = zlib.compress(body, self.server.COMPRESSION_LEVEL)
+
+        if client_encoding is not None:
+            req.headers_out["Content-Encoding"] = client_encoding
+        write_result(req, body)
 
     def handle(self, req):
         """
         Attempt to use the pipelines to handle the given request. Returns two values: first is flag which
         is True if the request has been handled; the second is the status/error code.
 
-        @req: an Apache request object
+        @req: an Apache request object or a request_context
         """
+
+        req = get_request_context(req)
+
+        # the caches are indexed by the uri with its query parameters in a standard order
+        uri_key = normalize_uri(req.unparsed_uri)
+
+        # only GET requests are answered from (and stored in) the requests cache
+        use_cache = self.requests_cache is not None and req.method == "GET"
+
+        # a URI which no pipeline matched before is answered with its remembered error page
+        use_not_found_cache = self.not_found_cache is not None and req.method == "GET"
+
+        if use_not_found_cache:
+            response = self.find_not_found_response(uri_key)
+            if response is not None:
+                return self.use_not_found_response(req, response)
+
+        # this flag is set if the responses for the uri depend on request headers, in which case they are
+        # cached under their variant keys (see variant_key)
+        variants = False
+
+        if use_cache:
+            (response, variants) = self.find_cached_response(uri_key)
+            if response is not None:
+                return self.use_cached_response(req, response)
         
+        # find the pipelines which may match the request
+        if self.dispatch_index is not None:
+            pipelines = self.dispatch_index.candidates(req)
+        else:
+            pipelines = self.pipelines
+
         # iterate over the pipelines
-        for p in self.pipelines:
+        for p in pipelines:
+            inputs = self.request_inputs(req, p, variants)
+
+            if variants and inputs is not None:
+                response = self.find_cached_variant(uri_key, p, inputs)
+                if response is not None:
+                    return self.use_cached_response(req, response)
+
+            validator_key = None
+            if self.validators is not None and inputs is not None:
+                validator_key = (p, inputs)
+                if self.answer_from_validator(req, validator_key):
+                    return (True, apache.HTTP_NOT_MODIFIED)
+
             (success, result, mime) = p.execute(req)
 
             if success:
-                # if its successful it writes its result to the request object
-                req.content_type = mime
-                req.set_content_length(len(result))
-                req.write(result)
-                
-                if self.server.log_requests:
-                    self.server.access_log.write("Handled request: \"%s\"" % req.unparsed_uri)
-
-                return (True, apache.OK)
+                return self.handle_result(req, uri_key, p, inputs, validator_key, use_cache, result, mime)
             elif result is None:
                 # in this case there was no error
                 pass
@@ -70,16 +365,406 @@ class sitemap_config(object):
 
         # if execution reaches this point then the request was not handled
         req.status = apache.HTTP_NOT_FOUND
+
+        # the pipelines' choices mustn't have depended on anything but the URI and files
+        if use_not_found_cache and not req.volatile and len(req.vary) == 0:
+            return self.handle_not_found(req, uri_key)
+
         return self.handle_error(req, apache.HTTP_NOT_FOUND)
 
+    def find_not_found_response(self, uri_key):
+        """
+        Returns the remembered error page for the given uri from the not-found cache, or None if there
+        isn't one or it is no longer valid.
+
+        @uri_key: the normalized uri of the request
+        """
+
+        response = self.not_found_cache.get(uri_key)
+        if response is not None and response.valid():
+            return response
+        else:
+            return None
+
+    def find_cached_response(self, uri_key):
+        """
+        Returns a tuple of the valid response for the given uri from the requests cache (or None) and a
+        flag which is True if the uri's responses depend on request headers, in which case they are
+        cached under their variant keys (see find_cached_variant).
+
+        @uri_key: the normalized uri of the request
+        """
+
+        response = self.requests_cache.get(uri_key)
+        if response is not None and not response.valid():
+            # one of the files it was made from has changed
+            self.requests_cache.remove(uri_key)
+            response = None
+
+        if response is not None and response.body is None:
+            return (None, True)
+        else:
+            return (response, False)
+
+    def find_cached_variant(self, uri_key, p, inputs):
+        """
+        Returns the valid response from the requests cache which the given pipeline made for the given
+        uri and request inputs, or None if there isn't one.
+
+        @uri_key: the normalized uri of the request
+        @p: the pipeline
+        @inputs: the request inputs which the pipeline's result depends on
+        """
+
+        response = self.requests_cache.get(self.variant_key(uri_key, p, inputs))
+        if response is not None and response.valid():
+            return response
+        else:
+            return None
+
+    def request_inputs(self, req, p, variants):
+        """
+        Returns the request inputs which the given pipeline's result depends on (see pipeline.cache_key),
+        or None if they aren't needed (they are used for validators and variant keys, and only for GET
+        requests) or can't be found.
+
+        @req: a request_context
+        @p: the pipeline
+        @variants: True if the uri's cached responses are stored under their variant keys
+        """
+
+        if (self.validators is None and not variants) or req.method != "GET":
+            return None
+
+        try:
+            return p.cache_key(req)
+        except Exception:
+            return None
+
+    def answer_from_validator(self, req, validator_key):
+        """
+        Returns True if the request is a conditional GET which can be answered with 304 Not Modified using
+        the validator of the response the pipeline made for the same request inputs before (as long as none
+        of its files have changed), without executing the pipeline. The validator headers are then set.
+
+        @req: a request_context
+        @validator_key: the (pipeline, request inputs) key of the validator
+        """
+
+        validator = self.validators.get(validator_key)
+        if validator is not None and validator.valid() and self.not_modified(req, validator):
+            self.set_validator_headers(req, validator)
+            return True
+        else:
+            return False
+
+    def store_validator(self, req, validator_key):
+        """
+        Makes a validator for the response of the current request from the files it depends on, stores it
+        under the given key, sets the validator headers and returns it.
+
+        @req: a request_context
+        @validator_key: the (pipeline, request inputs) key of the validator
+        """
+
+        validator = make_validator(validator_key[1], req.dependencies)
+        self.validators.put(validator_key, validator, 1)
+        self.set_validator_headers(req, validator)
+
+        return validator
+
+    def handle_result(self, req, uri_key, p, inputs, validator_key, use_cache, result, mime):
+        """
+        Writes the successful result of the given pipeline to the request (unless it can be answered with
+        304 Not Modified) and stores it in the requests cache if it is cacheable. Returns the same values as
+        handle.
+
+        @req: a request_context
+        @uri_key: the normalized uri of the request
+        @p: the pipeline which made the result
+        @inputs: the request inputs which the pipeline's result depends on, or None
+        @validator_key: the key of the response's validator, or None if validators aren't used
+        @use_cache: True if the response may be stored in the requests cache
+        @result: the pipeline's result (a string, file or result_chunks)
+        @mime: the result's MIME type
+        """
+
+        validator = None
+        if validator_key is not None and req.status == apache.HTTP_OK and not req.volatile:
+            validator = self.store_validator(req, validator_key)
+            if self.not_modified(req, validator):
+                if isinstance(result, file):
+                    result.close()
+                return (True, apache.HTTP_NOT_MODIFIED)
+
+        will_cache = use_cache and req.status == apache.HTTP_OK and not req.volatile
+
+        if isinstance(result, result_chunks):
+            try:
+                result = self.finish_chunks(result, will_cache)
+            except Exception:
+                (success, result, mime) = p.execution_error(req)
+                req.status = result
+                return self.handle_error(req, result)
+
+        (body, encoding, result) = self.encode_result(req, result, mime, will_cache)
+
+        # if its successful it writes its result to the request object
+        req.content_type = mime
+        if not self.write_response(req, body, encoding, result):
+            return (True, apache.OK)
+
+        if will_cache and isinstance(body, basestring) and len(body) <= self.server.MAX_REQUEST_SIZE:
+            self.cache_response(req, uri_key, p, inputs, cached_response(body, mime, req.status, req.dependencies,
+                                                                         req.vary, validator, encoding=encoding))
+        
+        if self.server.log_requests:
+            self.server.access_log.write("Handled request: \"%s\"" % req.unparsed_uri)
+
+        return (True, apache.OK)
+
+    def finish_chunks(self, result, will_cache):
+        """
+        Returns the given streamed result ready to be written. It is only put together (as a string) if it
+        is to be cached; otherwise its first chunk is produced before anything is written, so that errors at
+        its start still give an error page. Raises any error from producing the result.
+
+        @result: a result_chunks
+        @will_cache: True if the response is to be stored in the requests cache
+        """
+
+        if will_cache:
+            return result.join()
+        else:
+            result.prefetch()
+            return result
+
+    def encode_result(self, req, result, mime, will_cache):
+        """
+        Returns a tuple of the response body for the given result, its stored content coding ('gzip' if it
+        is compressed for the requests cache, otherwise None) and the uncompressed body (the result, encoded
+        as UTF-8 if it was unicode), and sets the Content-Encoding and Vary headers. Responses which are stored in the requests cache are stored gzip compressed (and converted
+        for clients which don't accept gzip); others are compressed once in the client's content coding.
+
+        @req: a request_context
+        @result: the pipeline's result (a string, file or result_chunks)
+        @mime: the result's MIME type
+        @will_cache: True if the response is to be stored in the requests cache
+        """
+
+        compress = self.server.use_compression and req.status == apache.HTTP_OK and compressible_mime(mime)
+
+        if isinstance(result, result_chunks):
+            # streamed results are compressed as they are written
+            body = result
+            if compress:
+                client_encoding = self.client_encoding(req)
+                if client_encoding is not None:
+                    body = compress_chunks(result, client_encoding, self.server.COMPRESSION_LEVEL)
+                    req.headers_out["Content-Encoding"] = client_encoding
+                self.set_vary_header(req, req.vary + ["Accept-Encoding"])
+            else:
+                self.set_vary_header(req, req.vary)
+            return (body, None, result)
+
+        if not compress or not isinstance(result, basestring) or len(result) < self.server.MIN_COMPRESS_SIZE:
+            self.set_vary_header(req, req.vary)
+            return (result, None, result)
+
+        if isinstance(result, unicode):
+            result = result.encode("utf-8")
+
+        self.set_vary_header(req, req.vary + ["Accept-Encoding"])
+        if will_cache:
+            return (gzip_compress(result, self.server.COMPRESSION_LEVEL), "gzip", result)
+
+        client_encoding = self.client_encoding(req)
+        if client_encoding == "gzip":
+            body = gzip_compress(result, self.server.COMPRESSION_LEVEL)
+        elif client_encoding == "deflate":
+            body = zlib.compress(result, self.server.COMPRESSION_LEVEL)
+        else:
+            body = result
+        if client_encoding is not None:
+            req.headers_out["Content-Encoding"] = client_encoding
+
+        return (body, None, result)
+
+    def write_response(self, req, body, encoding, result):
+        """
+        Writes the response body to the request (see write_body). Returns False if writing a streamed body
+        failed part way, in which case the response has been cut short; other errors are raised.
+
+        @req: a request_context
+        @body: the response body
+        @encoding: the content coding of body ('gzip') or None
+        @result: the uncompressed result
+        """
+
+        try:
+            self.write_body(req, body, encoding, result)
+        except Exception:
+            if not isinstance(body, result_chunks):
+                raise
+            # part of the response may have been sent, so it can only be cut short
+            if self.server.log_errors:
+                self.server.error_log.write("Error while streaming the response for \"%s\"; response cut short:\n%s" %\
+                                            (req.unparsed_uri, string.join(traceback.format_exception(*sys.exc_info()), "\n")))
+            return False
+
+        return True
+
+    def variant_key(self, uri_key, p, inputs):
+        """
+        Returns the requests cache key of a response for the given uri which depends on request headers:
+        the uri, the position of the pipeline which made it and the request inputs which that pipeline's
+        result depends on (see pipeline.cache_key). Selectors contribute what they derive from the headers
+        (e.g. the browser class) rather than the headers themselves, so that many requests share a variant.
+        """
+
+        return (uri_key, self.pipeline_positions[p], inputs)
+
+    def cache_response(self, req, uri_key, p, inputs, response):
+        """
+        Stores the given cached_response, made by the given pipeline, in the requests cache. A response
+        which doesn't depend on request headers is indexed by its uri. Otherwise, it is stored under its
+        variant key and a response with no body is stored under the uri to show that its responses vary.
+
+        @req: a request_context
+        @uri_key: the normalized uri of the request
+        @p: the pipeline which made the response
+        @inputs: the pipeline's cache_key for the request (or None if it hasn't been found yet)
+        @response: a cached_response
+        """
+
+        if len(req.vary) == 0:
+            self.requests_cache.put(uri_key, response, len(response.body))
+            return
+
+        if inputs is None:
+            try:
+                inputs = p.cache_key(req)
+            except Exception:
+                inputs = None
+
+            if inputs is None:
+                # the pipeline's inputs can't be found, so the response can't be told apart from other variants
+                return
+
+        self.requests_cache.put(self.variant_key(uri_key, p, inputs), response, len(response.body))
+        self.requests_cache.put(uri_key, cached_response(None, None, response.status, vary=req.vary), 0)
+
+    def use_cached_response(self, req, response):
+        """
+        Writes the given cached_response from the requests cache to the request (or answers a conditional
+        GET with its validator). Returns the same values as handle().
+
+        @req: a request_context
+        @response: a cached_response
+        """
+
+        if response.validator is not None:
+            self.set_validator_headers(req, response.validator)
+            if self.not_modified(req, response.validator):
+                return (True, apache.HTTP_NOT_MODIFIED)
+
+        req.status = response.status
+        req.content_type = response.mime
+        if response.encoding is not None:
+            self.set_vary_header(req, response.vary + ["Accept-Encoding"])
+        else:
+            self.set_vary_header(req, response.vary)
+        self.write_body(req, response.body, response.encoding)
+
+        if self.server.log_requests:
+            self.server.access_log.write("Handled request from cache: \"%s\"" % req.unparsed_uri)
+
+        return (True, apache.OK)
+
+    def render_error(self, req):
+        """
+        Returns the (success, result, mime) tuple of the first of the sitemap's pipelines (or, failing
+        those, the server's pipelines) which handles the request's error.
+
+        @req: a request_context
+        """
+
+        for p in self.pipelines + self.server.pipelines:
+            (success, result, mime) = p.handle_error(req)
+            if success:
+                return (success, result, mime)
+
+        return (False, None, None)
+
+    def handle_not_found(self, req, uri_key):
+        """
+        Renders the error page of a request which no pipeline matched and remembers it in the not-found
+        cache, so that later requests for the same URI are answered without trying the pipelines.
+
+        @req: a request_context whose status is HTTP_NOT_FOUND
+        @uri_key: the normalized uri of the request
+        """
+
+        (success, result, mime) = self.render_error(req)
+
+        if isinstance(result, result_chunks):
+            result = result.join()
+
+        if not success:
+            response = cached_response(None, None, apache.HTTP_NOT_FOUND, req.dependencies)
+            self.not_found_cache.put(uri_key, response, 0)
+            return self.use_not_found_response(req, response)
+
+        if isinstance(result, unicode):
+            result = result.encode("utf-8")
+
+        if isinstance(result, str) and not req.volatile and len(req.vary) == 0:
+            response = cached_response(result, mime, apache.HTTP_NOT_FOUND, req.dependencies)
+            self.not_found_cache.put(uri_key, response, len(result))
+            return self.use_not_found_response(req, response)
+
+        # the error page can't be remembered
+        if self.server.log_errors:
+            self.server.error_log.write("Sitemap handling error %s; request: \"%s\"" % (apache.HTTP_NOT_FOUND, req.unparsed_uri))
+
+        req.content_type = mime
+        write_result(req, result)
+
+        return (True, apache.DONE)
+
+    def use_not_found_response(self, req, response):
+        """
+        Writes the error page in the given cached_response from the not-found cache to the request.
+        Returns the same values as handle().
+
+        @req: a request_context
+        @response: a cached_response; its body is None if no pipeline handles the error
+        """
+
+        req.status = response.status
+
+        if response.body is None:
+            # the error is left to the handler
+            return (False, response.status)
+
+        if self.server.log_errors:
+            self.server.error_log.write("Sitemap handling error %s; request: \"%s\"" % (response.status, req.unparsed_uri))
+
+        req.content_type = response.mime
+        write_result(req, response.body)
+
+        return (True, apache.DONE)
+
     def handle_error(self, req, error_code):
         """
         Attempt to use the error_pipelines to handle the given error code.
 
-        @req: an Apache request object
+        @req: an Apache request object or a request_context
         @error_code: an Apache error code
         """
 
+        req = get_request_context(req)
+
         for p in self.pipelines:
             (success, result, mime) = p.handle_error(req)
         
@@ -90,8 +775,7 @@ class sitemap_config(object):
                     self.server.error_log.write("Sitemap handling error %s; request: \"%s\"" % (error_code, req.unparsed_uri))
 
                 req.content_type = mime
-                req.set_content_length(len(result))
-                req.write(result)
+                write_result(req, result)
 
                 return (True, apache.DONE)
 
@@ -115,10 +799,19 @@ class sitemap_config_parse(ContentHandler):
         self.sitemap = sitemap
         self.server = self.sitemap.parent
 
+        self.sitemap.filename = filename
+
         self.proc_comp_stack = []  # a stack for components being constructed
         
         parse(filename, self)
 
+        # now that all the pipelines are known, index them for request dispatching
+        self.sitemap.build_dispatch_index()
+        self.sitemap.build_caches()
+
+        # prepare the components and fill the caches before any requests are handled
+        self.sitemap.warm_up()
+
     def startElement(self, name, attrs):
         if name == "site-map":
             # some SAX flags
@@ -147,6 +840,13 @@ class sitemap_config_parse(ContentHandler):
             if self.sitemap.parent.ds_initialisers.has_key(str(attrs['type'])):
                 self.sitemap.parent.ds_initialisers[str(attrs['type'])](self.sitemap, attrs)
 
+        elif name == "warm-up":
+            # a URI to be requested once the sitemap is loaded
+            if not attrs.has_key('uri'):
+                raise SitemapError("<warm-up> element must have a 'uri' attribute.")
+
+            self.sitemap.warm_up_uris.append(str(attrs['uri']))
+
         elif name == "pipelines":
             # set the in_pipelines flag to True
             self.in_pipelines = True
@@ -49,6 +49,6 @@ class throw(syntax_component):
         return False
     
     def _result(self, req, p_sibling_result=None, child_results=[]):
-        self.server.EXCEPTION = sys.exc_info()
+        req.exception = sys.exc_info()
 
         return (False, int(self.error_code))
@@ -53,6 +53,9 @@ class command_transformer(transformer):
         parameter elements.
         """
 
+        # the command's output may change at any time, so the response can't be cached
+        req.volatile = True
+
         try:
             parameters = self.parameter_children(child_results)
             
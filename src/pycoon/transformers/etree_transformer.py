@@ -8,7 +8,7 @@ Element object to be manipulated directly.
 """
 
 from pycoon.transformers import transformer, TransformerError
-from pycoon.components import invokation_syntax, ComponentError
+from pycoon.components import invokation_syntax, ComponentError, event_stream
 import types
 import lxml.etree
 
@@ -23,7 +23,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["pipeline", "match", "when", "otherwise"]
     invk_syn.required_attribs = ["type", "module", "code-object"]
     invk_syn.required_attrib_values = {"type": "etree"}
-    invk_syn.optional_attribs = []
+    invk_syn.optional_attribs = ["stream", "volatile"]
     invk_syn.allowed_child_components = []
 
     server.component_syntaxes[("transform", "etree")] = invk_syn
@@ -34,7 +34,7 @@ class etree_transformer(transformer):
     etree_transformer allows a pipeline's working Element object to be manipulated directly.
     """
 
-    def __init__(self, parent, module, code_object, root_path=""):
+    def __init__(self, parent, module, code_object, stream="no", volatile="yes", root_path=""):
         """
         etree_transformer class constructor.
 
@@ -42,6 +42,12 @@ class etree_transformer(transformer):
         @code_object: is the name of the code object (function/class) in the module which performs
         the manipulation. It must be callable, accept an Element object as a parameter and return
         an Element object.
+        @stream: if "yes", the code object is called with each child of the root element in turn
+        (as the document is streamed) rather than with the whole document, and it may return an
+        Element, a list of Elements or None (to remove the child). Optional; "no" is default.
+        @volatile: if "yes", the code object may use more than its input (e.g. the time or a database),
+        so responses which use it aren't cached. Give "no" if its result only depends on the Element
+        object. Optional; "yes" is default.
         """
 
         try:
@@ -59,6 +65,8 @@ class etree_transformer(transformer):
 
         self.module = module
         self.code_object = code_object
+        self.streaming = (stream.lower() == "yes")
+        self.volatile = (volatile.lower() != "no")
 
         transformer.__init__(self, parent, root_path)
 
@@ -69,9 +77,22 @@ class etree_transformer(transformer):
 
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
-        Executes the transform function using the previous sibling result Element object.
+        Executes the transform function using the previous sibling result Element object (or, when
+        streaming, returns an event_stream which executes it on each child of the root element).
         """
 
+        if self.volatile:
+            # the code object's result may not depend only on its input, so the response can't be cached
+            req.volatile = True
+
+        if self.streaming:
+            if isinstance(p_sibling_result, lxml.etree._Element):
+                p_sibling_result = event_stream.from_tree(p_sibling_result)
+            elif not isinstance(p_sibling_result, event_stream):
+                raise TransformerError("etree_transformer: preceding pipeline components have returned no content!")
+
+            return (True, p_sibling_result.map(self.transform_child))
+
         try:
             result = self.transform(p_sibling_result)
 
@@ -84,3 +105,15 @@ class etree_transformer(transformer):
                 raise TransformerError("etree_transformer: transform function does not have correct signature.")
             else:
                 raise e
+
+    def transform_child(self, child):
+        """
+        Executes the transform function on one child of a streamed document.
+        """
+
+        result = self.transform(child)
+
+        if result is None or isinstance(result, (lxml.etree._Element, list)):
+            return result
+        else:
+            raise TransformerError("etree_transformer: transform function did not return an Element object.")
@@ -22,7 +22,7 @@ def register_invokation_syntax(server):
     invk_syn.allowed_parent_components = ["pipeline", "match", "when", "otherwise"]
     invk_syn.required_attribs = ["type", "module", "handler"]
     invk_syn.required_attrib_values = {"type": "sax-handler"}
-    invk_syn.optional_attribs = []
+    invk_syn.optional_attribs = ["volatile"]
     invk_syn.allowed_child_components = ["parameter"]
 
     server.component_syntaxes[("transform", "sax-handler")] = invk_syn
@@ -34,7 +34,9 @@ class sax_handler_transformer(transformer):
     and must return a well-formed XML document.
     """
 
-    def __init__(self, parent, module, handler, root_path=""):
+    reads_input_only = True
+
+    def __init__(self, parent, module, handler, volatile="yes", root_path=""):
         """
         sax_handler_transformer constructor.
 
@@ -44,13 +46,19 @@ class sax_handler_transformer(transformer):
         'result_stream' property, one of which should contain the result as either an Element object or
         an XML string. The pycoon.helpers module provides a pycoon_sax_handler base class which should be
         used to create SAX handlers for this component.
+        @volatile: if "yes", the handler may use more than its input and parameters (e.g. the time or a
+        database), so responses which use it aren't cached. Give "no" if its result only depends on
+        them. Optional; "yes" is default.
         """
 
+        # a new handler instance is created for each request, so just keep the class
         try:
-            self.handler = __import__(module, globals(), locals(), module.split(".")[-1]).__dict__[handler]()
+            self.handler_class = __import__(module, globals(), locals(), module.split(".")[-1]).__dict__[handler]
         except ImportError:
             raise ComponentError("Could not import sax_handler_transform handler class \"%s\" (from module \"%s\")" % (handler, module))
 
+        self.volatile = (volatile.lower() != "no")
+
         transformer.__init__(self, parent, root_path)
 
         self.description = "sax_handler_transfomer(\"%s\", \"%s\")" % (module, handler)
@@ -60,20 +68,26 @@ class sax_handler_transformer(transformer):
 
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
-        Parses the p_sibling_result using self.handler and returns the result as an Element object.
+        Parses the p_sibling_result using a new instance of the handler class and returns the result as
+        an Element object.
         """
 
+        if self.volatile:
+            # the handler's result may not depend only on its input, so the response can't be cached
+            req.volatile = True
+
         try:
             parameters = self.parameter_children(child_results)
 
-            self.handler.set_parameters(parameters)
+            handler = self.handler_class()
+            handler.set_parameters(parameters)
         
-            parseString(lxml.etree.tostring(p_sibling_result), self.handler)
+            parseString(lxml.etree.tostring(p_sibling_result), handler)
 
-            if isinstance(self.handler.result_tree, lxml.etree._Element):
-                return (True, self.handler.result_tree)
-            elif self.handler.result_stream != "<?xml version=\"1.0\"?>":
-                return (True, lxml.etree.parse(StringIO(self.handler.result_stream)).getroot())
+            if isinstance(handler.result_tree, lxml.etree._Element):
+                return (True, handler.result_tree)
+            elif handler.result_stream != "<?xml version=\"1.0\"?>":
+                return (True, lxml.etree.parse(StringIO(handler.result_stream)).getroot())
             else:
                 raise TransformerError("sax_handler_transformer: SAX handler has not produced a result.")
         except SAXException, e:
@@ -7,9 +7,73 @@ This software is licensed under the terms of the GNU GPL.
 from pycoon.transformers import transformer, TransformerError
 from pycoon.components import invokation_syntax
 from pycoon.interpolation import interpolate
-import os
+from pycoon.cache import compiled_stylesheet, file_mtime
+import os, re, urlparse
 import lxml.etree
 
+XSL_NAMESPACE = "http://www.w3.org/1999/XSL/Transform"
+
+# this regex is used to find the documents loaded by literal document() calls in stylesheets
+_find_document_calls = re.compile("document\(\s*(?:'([^']+)'|\"([^\"]+)\")")
+
+def stylesheet_dependencies(path, doc, dependencies):
+    """
+    Adds the modification times of the files which the given parsed stylesheet uses through xsl:include,
+    xsl:import and literal document() calls to the given dictionary (indexed by path). Included and
+    imported stylesheets are searched too.
+
+    @path: the path of the stylesheet file
+    @doc: the parsed stylesheet
+    @dependencies: a dictionary of modification times (indexed by path)
+    """
+
+    hrefs = []
+    for el in doc.iter("{%s}include" % XSL_NAMESPACE, "{%s}import" % XSL_NAMESPACE):
+        if el.get("href") is not None:
+            hrefs.append((el.get("href"), True))
+
+    for el in doc.iter():
+        for value in el.attrib.values():
+            for m in _find_document_calls.finditer(value):
+                hrefs.append((m.group(1) or m.group(2), False))
+
+    for (href, is_stylesheet) in hrefs:
+        # documents with URLs (other than file: URLs) can't be checked for modification
+        (scheme, netloc, href_path, params, query, fragment) = urlparse.urlparse(href)
+        if scheme not in ["", "file"] or href_path == "":
+            continue
+
+        dep_path = os.path.normpath(os.path.join(os.path.dirname(path), href_path))
+        if dependencies.has_key(dep_path):
+            continue
+
+        # record the modification time before the file is read, so it is never newer than what was compiled
+        dependencies[dep_path] = file_mtime(dep_path)
+
+        if is_stylesheet:
+            try:
+                stylesheet_dependencies(dep_path, lxml.etree.parse(dep_path), dependencies)
+            except (IOError, lxml.etree.XMLSyntaxError):
+                # the error will be reported when the stylesheet is compiled
+                pass
+
+def compile_stylesheet(path, find_dependencies=True):
+    """
+    Compiles the XSLT stylesheet file with the given path and returns a compiled_stylesheet.
+
+    @path: the path of the stylesheet file
+    @find_dependencies: whether the files used by the stylesheet are added to its dependencies (which
+                        means parsing the included and imported stylesheets again). If False, the
+                        dependencies only include the stylesheet file itself. Optional
+    """
+
+    dependencies = {path: file_mtime(path)}
+    doc = lxml.etree.parse(path)
+    if find_dependencies:
+        stylesheet_dependencies(path, doc, dependencies)
+
+    return compiled_stylesheet(lxml.etree.XSLT(doc), dependencies)
+
 def register_invokation_syntax(server):
     """
     Allows the component to register the required XML element syntax for it's invokation
@@ -36,6 +100,8 @@ class xslt_transformer(transformer):
     the transformation will treat tham as XPath expressions.
     """
 
+    reads_input_only = True
+
     def __init__(self, parent, src, root_path=""):
         """
         xslt_transformer constructor.
@@ -52,13 +118,52 @@ class xslt_transformer(transformer):
     def _descend(self, req, p_sibling_result=None):
         return True
 
+    def uses_dependencies(self):
+        """
+        Returns True if the files which a response depends on are used (to check cached responses or to
+        make the ETag and Last-Modified headers).
+        """
+
+        if self.sitemap is None:
+            return True
+
+        return self.sitemap.requests_cache is not None or self.sitemap.pipeline_cache is not None or\
+               self.server.use_conditional_get
+
+    def warm_up(self):
+        """
+        Compiles the stylesheet if its path is constant. The stylesheets cache is kept by each thread, so
+        this only saves the first request of the thread which loads the sitemap from compiling it (which
+        is every request's thread under a prefork server); the other threads compile it when they first
+        use it. Either way, errors in the stylesheet are reported when the sitemap is loaded.
+        """
+
+        path = self.constant_value(self.src, as_filename=True)
+        if path is None:
+            return
+
+        if self.sitemap is not None and self.sitemap.stylesheets_cache is not None:
+            self.sitemap.stylesheets_cache.get(path)
+        else:
+            # there's nowhere to keep it, but at least any errors in the stylesheet are reported early
+            compile_stylesheet(path, find_dependencies=False)
+
     def _result(self, req, p_sibling_result=None, child_results=[]):
         """
         Parse the p_sibling_result through the XSLT stylesheet.
         """
 
         try:
-            self.transform = lxml.etree.XSLT(lxml.etree.parse(interpolate(self, self.src, as_filename=True, root_path=self.root_path)))
+            path = interpolate(self, req, self.src, as_filename=True, root_path=self.root_path)
+
+            if self.sitemap is not None and self.sitemap.stylesheets_cache is not None:
+                stylesheet = self.sitemap.stylesheets_cache.get(path)
+            else:
+                # the stylesheet's dependencies are only needed if the response may be cached or validated
+                stylesheet = compile_stylesheet(path, self.uses_dependencies())
+
+            req.add_dependencies(stylesheet.dependencies)
+            transform = stylesheet.transform
 
             parameters = {}
             for c in child_results:
@@ -68,9 +173,9 @@ class xslt_transformer(transformer):
                     parameters.update(c)
 
             if len(parameters) > 0:
-                return (True, self.transform(p_sibling_result, **parameters).getroot())
+                return (True, transform(p_sibling_result, **parameters).getroot())
             else:
-                return (True, self.transform(p_sibling_result).getroot())
+                return (True, transform(p_sibling_result).getroot())
         except lxml.etree.XMLSyntaxError, e:
             raise TransformerError("xslt_transformer: XML syntax error in stylesheet file, \"%s\": \"%s\"" %\
-                                   (interpolate(self, self.src, as_filename=True, root_path=self.root_path), str(e)))
+                                   (interpolate(self, req, self.src, as_filename=True, root_path=self.root_path), str(e)))
@@ -60,6 +60,7 @@ class request(object):
         self._content_type = ""
 
         self.headers_in = headers_in
+        self.headers_out = fake_table()
         
         self.status = 200
 